@@ -68,6 +68,21 @@ def main():
 		logger.info(f"experiment_table: {config['experiment_table']}")
 		logger.info(f"gtf: {config['gtf']}")
 
+	# Check optional config keys
+	try:
+		events = general.parse_events(config.get('events'))
+	except ValueError as e:
+		logger.error(f"Invalid events in configuration file: {e}")
+		sys.exit(1)
+	# RI events are not analyzed in scRNA-seq data
+	if "RI" in events and config.get('events') is not None and str(config.get('events')).lower() != "all":
+		logger.warning("RI events are not supported in scShiba. Skipping RI events.")
+	events = [event for event in events if event != "RI"]
+	if not events:
+		logger.error("No event types to analyze. Exiting...")
+		sys.exit(1)
+	logger.info(f"events: {','.join(events)}")
+
 	# Prepare output directory
 	output_dir = config["workdir"]
 	logger.debug("Making output directory...")
@@ -92,7 +107,8 @@ def main():
 				"python", os.path.join(script_dir, "src", "gtf2event.py"),
 				"-i", gtf,
 				"-o", os.path.join(output_dir, "events"),
-				"-p", processors
+				"-p", processors,
+				"--events", ",".join(events)
 			]
 		},
 		{
@@ -100,21 +116,30 @@ def main():
 			"command": [
 				"python", os.path.join(script_dir, "src", "sc2junc.py"),
 				"-i", experiment_table,
-				"-o", os.path.join(output_dir, "junctions", "junctions.bed")
-			]
+				"-o", os.path.join(output_dir, "junctions", "junctions.bed"),
+				"-p", processors,
+				"--h5ad" if config.get('h5ad', False) else ""
+			] + ([
+				"--cell-psi", os.path.join(output_dir, "cell_psi"),
+				"-e", os.path.join(output_dir, "events"),
+				"--events", ",".join(events)
+			] if config.get('cell_psi', False) else [])
 		},
 		{
 			"name": "Step 3: scpsi.py",
 			"command": [
 				"python", os.path.join(script_dir, "src", "scpsi.py"),
-				"-p", "1",
-				"-r", config['reference_group'],
-				"-a", config['alternative_group'],
+				"-p", processors if config.get('contrasts') else "1"
+			] + (
+				["-c", str(config['contrasts'])] if config.get('contrasts') else ["-r", config['reference_group'], "-a", config['alternative_group']]
+			) + [
 				"-f", str(config['fdr']),
 				"-d", str(config['delta_psi']),
 				"-m", str(config['minimum_reads']),
 				"--onlypsi" if config['only_psi'] else "",
 				"--excel" if config['excel'] else "",
+				"--h5ad" if config.get('h5ad', False) else "",
+				"--events", ",".join(events),
 				os.path.join(output_dir, "junctions", "junctions.bed"),
 				os.path.join(output_dir, "events"),
 				os.path.join(output_dir, "results")
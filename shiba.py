@@ -88,6 +88,12 @@ def main():
     # Check optional config keys
     only_psi = config.get('only_psi', False)
     only_psi_group = config.get('only_psi_group', False)
+    try:
+        events = general.parse_events(config.get('events'))
+    except ValueError as e:
+        logger.error(f"Invalid events in configuration file: {e}")
+        sys.exit(1)
+    logger.info(f"events: {','.join(events)}")
 
     # Validate sample and group sizes in the experiment table
     sample_count = general.check_samplesize(config["experiment_table"])
@@ -127,6 +133,9 @@ def main():
     # Steps
     experiment_table = config["experiment_table"]
     gtf = config["gtf"]
+    # The native gene counter shares the BAM pass of bam2junc.py
+    native_gene_counts = config.get('gene_counter', "featureCounts") == "native" and not args.mame
+    gene_counts_dir = os.path.join(output_dir, "junctions", "gene_counts")
     steps = [
         {
             "name": "Step 1: bam2gtf.py",
@@ -146,7 +155,8 @@ def main():
                 "-r" if config['unannotated'] else "",
                 gtf if config['unannotated'] else "",
                 "-o", os.path.join(output_dir, "events"),
-                "-p", processors
+                "-p", processors,
+                "--events", ",".join(events)
             ]
         },
         {
@@ -154,13 +164,20 @@ def main():
             "command": [
                 "python", os.path.join(script_dir, "src", "bam2junc.py"),
                 "-i", experiment_table,
-                "-r", os.path.join(output_dir, "events", "EVENT_RI.txt"),
+                "-r" if "RI" in events else "",
+                os.path.join(output_dir, "events", "EVENT_RI.txt") if "RI" in events else "",
                 "-o", os.path.join(output_dir, "junctions", "junctions.bed"),
                 "-p", processors,
                 "-a", str(config['minimum_anchor_length']),
                 "-m", str(config['minimum_intron_length']),
                 "-M", str(config['maximum_intron_length']),
-                "-s", config['strand']
+                "-s", config['strand'],
+                "--junction-extractor", config.get('junction_extractor', "regtools"),
+                "--intron-counter", config.get('intron_counter', "featureCounts"),
+                "--gtf" if native_gene_counts else "",
+                gtf if native_gene_counts else "",
+                "--gene-counts" if native_gene_counts else "",
+                gene_counts_dir if native_gene_counts else ""
             ]
         },
         {
@@ -179,6 +196,7 @@ def main():
                 "--excel" if config['excel'] else "",
                 "--onlypsi" if only_psi else "",
                 "--onlypsi-group" if only_psi_group else "",
+                "--events", ",".join(events),
                 os.path.join(output_dir, "junctions", "junctions.bed"),
                 os.path.join(output_dir, "events"),
                 os.path.join(output_dir, "results", "splicing")
@@ -196,6 +214,10 @@ def main():
                 "" if only_psi or only_psi_group else "-a",
                 "" if only_psi or only_psi_group else config['alternative_group'],
                 "--excel" if config['excel'] else "",
+                "--gene-counter", config.get('gene_counter', "featureCounts"),
+                "--counts-dir" if native_gene_counts else "",
+                gene_counts_dir if native_gene_counts else "",
+                "--de-method", config.get('de_method', "DESeq2"),
                 "-p", processors
             ]
         },
@@ -216,7 +238,8 @@ def main():
                 "-i", os.path.join(output_dir, "results"),
                 "-e", experiment_table,
                 "-s", command_line,
-                "-o", os.path.join(output_dir, "plots")
+                "-o", os.path.join(output_dir, "plots"),
+                "--events", ",".join(events)
             ]
         }
     ]
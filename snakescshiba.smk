@@ -25,16 +25,29 @@ configfile_path= args[args.index("--configfile") + 1]
 configfile_dir_path = Path(configfile_path).resolve().parent
 command = command.replace(configfile_path, os.path.join(str(configfile_dir_path), configfile_path))
 
+# Event types to analyze (all but RI by default, RI is not supported in scShiba)
+sys.path.insert(0, os.path.join(base_dir, "src"))
+from lib.general import parse_events
+EVENTS = [event for event in parse_events(config.get("events")) if event != "RI"]
+
+# Results of multiple contrasts are saved in a directory for each contrast with a combined summary
+if config.get("contrasts"):
+    PSI_RESULTS = ["results/summary.txt"]
+    GROUP_OPTIONS = "-c " + str(config["contrasts"])
+else:
+    PSI_RESULTS = expand("results/PSI_{sample}.txt", sample = EVENTS)
+    GROUP_OPTIONS = "-r " + str(config["reference_group"]) + " -a " + str(config["alternative_group"])
+
 rule all:
     input:
-        event_all = expand("events/EVENT_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "MSE", "AFE", "ALE"]),
-        PSI = expand("results/PSI_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "MSE", "AFE", "ALE"]),
+        event_all = expand("events/EVENT_{sample}.txt", sample = EVENTS),
+        PSI = PSI_RESULTS,
         report = "report.json"
 
 rule generate_report:
     input:
-        event_all = expand("events/EVENT_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "MSE", "AFE", "ALE"]),
-        PSI = expand("results/PSI_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "MSE", "AFE", "ALE"])
+        event_all = expand("events/EVENT_{sample}.txt", sample = EVENTS),
+        PSI = PSI_RESULTS
     output:
         report = "report.json"
     params:
@@ -53,7 +66,7 @@ rule gtf2event:
         gtf = config["gtf"]
     output:
         events = directory("events"),
-        events_all = expand("events/EVENT_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "MSE", "AFE", "ALE"])
+        events_all = expand("events/EVENT_{sample}.txt", sample = EVENTS)
     threads:
         workflow.cores
     benchmark:
@@ -61,33 +74,43 @@ rule gtf2event:
     log:
         "log/gtf2event.log"
     params:
-        base_dir = base_dir
+        base_dir = base_dir,
+        events = ",".join(EVENTS)
     shell:
         """
         python {params.base_dir}/src/gtf2event.py \
         -i {input.gtf} \
         -o {output.events} \
         -p {threads} \
+        --events {params.events} \
         -v \
         >& {log}
         """
 
 rule sc2junc:
     input:
-        config["experiment_table"]
+        experiment_table = config["experiment_table"],
+        events_all = expand("events/EVENT_{sample}.txt", sample = EVENTS) if config.get("cell_psi", False) else []
     output:
-        "junctions/junctions.bed"
+        junc = "junctions/junctions.bed"
+    threads:
+        workflow.cores
     benchmark:
         "benchmark/sc2junc.txt"
     log:
         "log/sc2junc.log"
     params:
-        base_dir = base_dir
+        base_dir = base_dir,
+        cell_psi = "--cell-psi cell_psi -e events --events " + ",".join(EVENTS) if config.get("cell_psi", False) else "",
+        h5ad = "--h5ad" if config.get("h5ad", False) else ""
     shell:
         """
         python {params.base_dir}/src/sc2junc.py \
-        -i {input} \
-        -o {output} \
+        -i {input.experiment_table} \
+        -o {output.junc} \
+        -p {threads} \
+        {params.cell_psi} \
+        {params.h5ad} \
         -v \
         >& {log}
         """
@@ -95,18 +118,21 @@ rule sc2junc:
 rule scpsi:
     input:
         junc = "junctions/junctions.bed",
-        events_all = expand("events/EVENT_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "MSE", "AFE", "ALE"])
+        events_all = expand("events/EVENT_{sample}.txt", sample = EVENTS)
     output:
         results = directory("results"),
-        PSI = expand("results/PSI_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "MSE", "AFE", "ALE"])
+        PSI = PSI_RESULTS
     threads:
-        1
+        workflow.cores if config.get("contrasts") else 1
     benchmark:
         "benchmark/scpsi.txt"
     log:
         "log/scpsi.log"
     params:
-        base_dir = base_dir
+        base_dir = base_dir,
+        events = ",".join(EVENTS),
+        groups = GROUP_OPTIONS,
+        h5ad = config.get("h5ad", False)
     shell:
         """
         python {params.base_dir}/src/scpsi_snakemake.py \
@@ -114,10 +140,11 @@ rule scpsi:
         -f {config[fdr]} \
         -d {config[delta_psi]} \
         -m {config[minimum_reads]} \
-        -r {config[reference_group]} \
-        -a {config[alternative_group]} \
+        {params.groups} \
         --onlypsi {config[only_psi]} \
         --excel {config[excel]} \
+        --h5ad {params.h5ad} \
+        --events {params.events} \
         -v \
         {input.junc} \
         events \
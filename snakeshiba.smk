@@ -40,13 +40,18 @@ configfile_path= args[args.index("--configfile") + 1]
 configfile_dir_path = Path(configfile_path).resolve().parent
 command = command.replace(configfile_path, os.path.join(str(configfile_dir_path), configfile_path))
 
+# Event types to analyze (all by default)
+sys.path.insert(0, os.path.join(base_dir, "src"))
+from lib.general import parse_events
+EVENTS = parse_events(config.get("events"))
+
 workdir: config["workdir"]
 container: config["container"]
 
 rule all:
     input:
-        event_all = expand("events/EVENT_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"]),
-        PSI = expand("results/splicing/PSI_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"]),
+        event_all = expand("events/EVENT_{sample}.txt", sample = EVENTS),
+        PSI = expand("results/splicing/PSI_{sample}.txt", sample = EVENTS),
         summary = "plots/summary.html",
         barplot_splicing_summary = "plots/png/barplot_splicing_summary.png",
         tpm = "results/expression/TPM.txt",
@@ -61,8 +66,8 @@ rule all:
 
 rule generate_report:
     input:
-        event_all = expand("events/EVENT_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"]),
-        PSI = expand("results/splicing/PSI_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"]),
+        event_all = expand("events/EVENT_{sample}.txt", sample = EVENTS),
+        PSI = expand("results/splicing/PSI_{sample}.txt", sample = EVENTS),
         summary = "plots/summary.html",
         barplot_splicing_summary = "plots/png/barplot_splicing_summary.png",
         tpm = "results/expression/TPM.txt",
@@ -140,7 +145,7 @@ rule gtf2event:
         gtf = config["gtf"]
     output:
         events = directory("events"),
-        events_all = expand("events/EVENT_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"])
+        events_all = expand("events/EVENT_{sample}.txt", sample = EVENTS)
     threads:
         workflow.cores
     benchmark:
@@ -148,7 +153,8 @@ rule gtf2event:
     log:
         "log/gtf2event.log"
     params:
-        base_dir = base_dir
+        base_dir = base_dir,
+        events = ",".join(EVENTS)
     shell:
         """
         python {params.base_dir}/src/gtf2event.py \
@@ -156,6 +162,7 @@ rule gtf2event:
         -r {input.gtf} \
         -o {output.events} \
         -p {threads} \
+        --events {params.events} \
         -v \
         >& {log}
         """
@@ -215,7 +222,8 @@ rule bam2junc_RI:
         "log/bam2junc/{sample}_featureCounts_RI.log"
     params:
         base_dir = base_dir,
-        longread_option = lambda wildcards: "-l" if experiment_dict[wildcards.sample]["technology"] == "long" else ""
+        longread_option = lambda wildcards: "-l" if experiment_dict[wildcards.sample]["technology"] == "long" else "",
+        counter = config.get("intron_counter", "featureCounts")
     shell:
         """
         python {params.base_dir}/src/bam2junc_RI_snakemake.py \
@@ -223,6 +231,7 @@ rule bam2junc_RI:
         -r {input.RI} \
         -o {output.junc} \
         -t {threads} \
+        -c {params.counter} \
         {params.longread_option} \
         -v \
         &> {log}
@@ -231,7 +240,7 @@ rule bam2junc_RI:
 rule merge_junc:
     input:
         exonexon = expand("junctions/{sample}.junc", sample = experiment_dict),
-        exonintron = expand("junctions/{sample}_exon-intron.junc", sample = experiment_dict)
+        exonintron = expand("junctions/{sample}_exon-intron.junc", sample = experiment_dict) if "RI" in EVENTS else []
     output:
         "junctions/junctions.bed"
     benchmark:
@@ -239,12 +248,13 @@ rule merge_junc:
     log:
         "log/merge_junc.log"
     params:
-        base_dir = base_dir
+        base_dir = base_dir,
+        exonintron_option = lambda wildcards, input: "--exonintron " + " ".join(input.exonintron) if input.exonintron else ""
     shell:
         """
         python {params.base_dir}/src/merge_junc_snakemake.py \
         --exonexon {input.exonexon} \
-        --exonintron {input.exonintron} \
+        {params.exonintron_option} \
         --output {output} \
         -v \
         >& {log}
@@ -253,10 +263,10 @@ rule merge_junc:
 rule psi:
     input:
         junc = "junctions/junctions.bed",
-        events_all = expand("events/EVENT_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"])
+        events_all = expand("events/EVENT_{sample}.txt", sample = EVENTS)
     output:
         results = directory("results/splicing"),
-        PSI = expand("results/splicing/PSI_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"]),
+        PSI = expand("results/splicing/PSI_{sample}.txt", sample = EVENTS),
         PSI_matrix_sample = "results/splicing/PSI_matrix_sample.txt"
     threads:
         1
@@ -265,7 +275,8 @@ rule psi:
     log:
         "log/psi.log"
     params:
-        base_dir = base_dir
+        base_dir = base_dir,
+        events = ",".join(EVENTS)
     shell:
         """
         python {params.base_dir}/src/psi_snakemake.py \
@@ -281,6 +292,7 @@ rule psi:
         --onlypsi False \
         --onlypsi-group False \
         --excel {config[excel]} \
+        --events {params.events} \
         -v \
         {input.junc} \
         events \
@@ -304,7 +316,8 @@ rule expression_featureCounts:
         "log/expression/{sample}_featureCounts.log"
     params:
         base_dir = base_dir,
-        longread_option = lambda wildcards: "-l" if experiment_dict[wildcards.sample]["technology"] == "long" else ""
+        longread_option = lambda wildcards: "-l" if experiment_dict[wildcards.sample]["technology"] == "long" else "",
+        counter = config.get("gene_counter", "featureCounts")
     shell:
         """
         python {params.base_dir}/src/expression_featureCounts_snakemake.py \
@@ -312,6 +325,7 @@ rule expression_featureCounts:
         -g {input.gtf} \
         -o {output.counts} \
         -t {threads} \
+        -c {params.counter} \
         {params.longread_option} \
         -v \
         &> {log}
@@ -352,7 +366,8 @@ rule deseq2:
     log:
         "log/expression/DESeq2.log"
     params:
-        base_dir = base_dir
+        base_dir = base_dir,
+        method = config.get("de_method", "DESeq2")
     shell:
         """
         python {params.base_dir}/src/deseq2_snakemake.py \
@@ -361,6 +376,7 @@ rule deseq2:
         --reference {config[reference_group]} \
         --alternative {config[alternative_group]} \
         --output {output.deseq2} \
+        --method {params.method} \
         -v \
         &> {log}
         """
@@ -393,7 +409,7 @@ rule pca:
 
 rule plots:
     input:
-        PSI = expand("results/splicing/PSI_{sample}.txt", sample = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"]),
+        PSI = expand("results/splicing/PSI_{sample}.txt", sample = EVENTS),
         tpm_pca = "results/pca/tpm_pca.tsv",
         tpm_contribution = "results/pca/tpm_contribution.tsv",
         psi_pca = "results/pca/psi_pca.tsv",
@@ -407,7 +423,8 @@ rule plots:
         "log/plots.log"
     params:
         base_dir = base_dir,
-        command = command
+        command = command,
+        events = ",".join(EVENTS)
     shell:
         """
         python {params.base_dir}/src/plots.py \
@@ -415,6 +432,7 @@ rule plots:
         -e {config[experiment_table]} \
         -s "{params.command}" \
         -o plots \
+        --events {params.events} \
         -v \
         >& {log}
         """
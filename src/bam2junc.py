@@ -1,4 +1,5 @@
 import argparse
+import concurrent.futures
 import os
 import sys
 import shutil
@@ -6,7 +7,7 @@ import subprocess
 import logging
 import pandas as pd
 import pysam
-from lib import expression, general
+from lib import bamprobe, expression, general, junction
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -16,13 +17,17 @@ def get_args():
 		description="Pipeline for processing junction read counts."
 	)
 	parser.add_argument("-i", "--input", required=True, help="Experiment table")
-	parser.add_argument("-r", "--ri_event", required=True, help="Intron retention event file")
+	parser.add_argument("-r", "--ri_event", required=False, help="Intron retention event file (exon-intron junctions are not counted if omitted)")
 	parser.add_argument("-o", "--output", required=True, help="Output junction read counts file")
-	parser.add_argument("-p", "--processors", type=int, default=1, help="Number of processors to use (default: 1)")
+	parser.add_argument("-p", "--processors", type=int, default=1, help="Number of processors to use, shared by samples processed concurrently; native counts read one sample at a time with all processors (default: 1)")
 	parser.add_argument("-a", "--anchor", type=int, default=8, help="Minimum anchor length (default: 8)")
 	parser.add_argument("-m", "--min_intron", type=int, default=70, help="Minimum intron size (default: 70)")
 	parser.add_argument("-M", "--max_intron", type=int, default=500000, help="Maximum intron size (default: 500000)")
 	parser.add_argument("-s", "--strand", default="XS", help="Strand specificity (default: XS)")
+	parser.add_argument("--junction-extractor", choices=["regtools", "native"], default="regtools", help="Tool to extract exon-exon junctions; native reads BAM files with pysam in parallel across chromosomes (default: regtools)")
+	parser.add_argument("--intron-counter", choices=["featureCounts", "native"], default="featureCounts", help="Tool to count exon-intron junctions; native counts reads spanning RI boundaries with pysam in parallel across chromosomes (default: featureCounts)")
+	parser.add_argument("--gtf", help="Reference GTF file of genes to count with --gene-counts")
+	parser.add_argument("--gene-counts", help="Directory to write read counts of genes in --gtf for each sample ({sample}_counts.txt), counted natively in the same BAM pass as native junction extraction and intron counting")
 	parser.add_argument("-v", "--verbose", action="store_true", help="Verbose output")
 	return parser.parse_args()
 
@@ -53,8 +58,14 @@ def create_saf_file(ri_event, tmp_dir):
 	saf_df.drop_duplicates().to_csv(saf_file, sep="\t", index=False)
 	return saf_file
 
-def process_samples(experiment_file, strand, anchor, min_intron, max_intron, output_dir, logs_dir, tmp_dir, saf_file, processors):
-	junc_files = []
+def read_experiment(experiment_file):
+	"""
+	Reads samples from the experiment table and ensures that all BAM files are indexed.
+
+	Returns:
+		list: Tuples of sample name, BAM file and sequencing technology.
+	"""
+	sample_l = []
 	with open(experiment_file, "r") as experiment:
 		for line in experiment:
 			line = line.strip()
@@ -66,14 +77,8 @@ def process_samples(experiment_file, strand, anchor, min_intron, max_intron, out
 			except ValueError:
 				sample, bam, _group = line.split(maxsplit=2)
 				technology = "short"
-			sample_dir = os.path.dirname(bam)
 			bam_index = f"{bam}.bai"
 
-			logger.info(f"Processing sample: {sample}")
-			logger.debug(f"BAM file: {bam}")
-			if technology.lower() == "long":
-				logger.debug(f"{sample} will be processed as a long read sequencing experiment.")
-
 			# Ensure BAM index exists
 			if not os.path.isfile(bam_index):
 				logger.error(f"BAM index file not found for sample : {bam}")
@@ -81,127 +86,173 @@ def process_samples(experiment_file, strand, anchor, min_intron, max_intron, out
 				sys.exit(1)
 			else:
 				logger.debug(f"Found BAM index for {bam}")
+			sample_l.append((sample, bam, technology))
+	return sample_l
 
-			# Extract exon-exon junctions
-			logger.info(f"Counting exon-exon junctions for sample {sample}...")
-			exon_junc_file = os.path.join(tmp_dir, f"{sample}_exon-exon.junc")
-			regtools_command = [
-				"regtools",
-				"junctions",
-				"extract",
-				"-s", strand,
-				"-a", str(anchor),
-				"-m", str(min_intron),
-				"-M", str(max_intron),
-				"-o", exon_junc_file,
-				bam
-			]
-			logger.debug(f"Regtools command: {regtools_command}")
-			return_code = general.execute_command(
-				regtools_command, os.path.join(logs_dir, "regtools.log")
-			)
-			if return_code != 0:
-				logger.error(f"Regtools failed for sample {sample}")
-				sys.exit(1)
-			junc_files.append((exon_junc_file, "exon-exon"))
+def process_sample(sample, bam, technology, strand, anchor, min_intron, max_intron, logs_dir, tmp_dir, saf_file, boundary_df, threads, junction_extractor, intron_counter, gene_model=None, gene_counts_dir=None):
+	"""
+	Extracts exon-exon junctions and counts exon-intron junctions of a sample with external tools using `threads` cores,
+	and prepares counters of native counts, including gene counts when `gene_model` is given, to be read by count_native.
+	External tools write to logs named after the sample.
+
+	Returns:
+		list: Tuples of junction file and junction type.
+		list: Dictionaries of native counters by chromosome.
+		list: Functions writing the results of the native counters.
+	"""
+	junc_files = []
+	logger.info(f"Processing sample: {sample}")
+	logger.debug(f"BAM file: {bam}")
+	long_read = technology.lower() == "long"
+	if long_read:
+		logger.debug(f"{sample} will be processed as a long read sequencing experiment.")
+	# Check if BAM is paired-end
+	bam_info = bamprobe.probe(bam)
+	logger.debug(f"BAM metadata for {sample}: {bam_info}")
+	paired_flag = bam_info["paired"]
+
+	# Counters of the native BAM pass and functions writing their results
+	counter_dic_l, writer_l = [], []
 
-			# Count exon-intron junctions
-			logger.info(f"Counting exon-intron junctions for sample {sample}...")
-			exon_intron_file = os.path.join(tmp_dir, f"{sample}_exon-intron.junc")
-			# Check if BAM is paired-end
-			paired_flag = expression.is_paired_end(bam)
+	# Extract exon-exon junctions
+	logger.info(f"Counting exon-exon junctions for sample {sample}...")
+	if junction_extractor == "native":
+		exon_junc_file = os.path.join(tmp_dir, f"{sample}_exon-exon.txt")
+		counter_dic_l.append(junction.junction_counters(bam, strand, anchor, min_intron, max_intron))
+		writer_l.append(lambda result_dic: logger.debug(
+			f"{junction.write_junctions(result_dic, exon_junc_file)} junctions extracted for sample {sample}"
+		))
+		junc_files.append((exon_junc_file, "exon-exon-native"))
+	else:
+		exon_junc_file = os.path.join(tmp_dir, f"{sample}_exon-exon.junc")
+		regtools_command = [
+			"regtools",
+			"junctions",
+			"extract",
+			"-s", strand,
+			"-a", str(anchor),
+			"-m", str(min_intron),
+			"-M", str(max_intron),
+			"-o", exon_junc_file,
+			bam
+		]
+		logger.debug(f"Regtools command: {regtools_command}")
+		return_code = general.execute_command(
+			regtools_command, os.path.join(logs_dir, f"{sample}_regtools.log")
+		)
+		if return_code != 0:
+			logger.error(f"Regtools failed for sample {sample}")
+			sys.exit(1)
+		junc_files.append((exon_junc_file, "exon-exon"))
+
+	# Count exon-intron junctions
+	if saf_file:
+		logger.info(f"Counting exon-intron junctions for sample {sample}...")
+		exon_intron_file = os.path.join(tmp_dir, f"{sample}_exon-intron.junc")
+		if intron_counter == "native":
+			counter_dic, index_dic = junction.boundary_counters(bam, boundary_df, paired_flag, long_read)
+			counter_dic_l.append(counter_dic)
+			writer_l.append(lambda result_dic: logger.debug(
+				f"{junction.write_boundaries(bam, boundary_df, index_dic, result_dic, exon_intron_file)} reads assigned to intron boundaries for sample {sample}"
+			))
+		else:
 			paired_option = ["-p"] if paired_flag else []
 			# Check if BAM is longread
-			longread_flag = ["-L"] if technology.lower() == "long" else []
+			longread_flag = ["-L"] if long_read else []
 			featurecounts_command = [
 				"featureCounts",
 				"-a", saf_file,
 				"-o", exon_intron_file,
 				"-F", "SAF",
 				"--fracOverlapFeature", "1.0",
-				"-T", str(processors),
+				"-T", str(threads),
 				"-O"
 			] + paired_option + longread_flag + [bam]
-			# Delete empty strings
-			featurecounts_command = list(filter(None, featurecounts_command))
 			logger.debug(f"FeatureCounts command: {featurecounts_command}")
 			return_code = general.execute_command(
-				featurecounts_command, os.path.join(logs_dir, "featureCounts.log")
+				featurecounts_command, os.path.join(logs_dir, f"{sample}_featureCounts.log")
 			)
 			if return_code != 0:
 				logger.error(f"FeatureCounts failed for sample {sample}")
 				sys.exit(1)
-			junc_files.append((exon_intron_file, "exon-intron"))
+		junc_files.append((exon_intron_file, "exon-intron"))
 
-	return junc_files
+	# Count reads of genes
+	if gene_model:
+		logger.info(f"Counting reads of genes for sample {sample}...")
+		gene_counts_file = os.path.join(gene_counts_dir, f"{sample}_counts.txt")
+		counter_dic_l.append(expression.gene_counters(bam, gene_model, paired_flag, long_read))
+		writer_l.append(lambda result_dic: logger.debug(
+			f"{expression.write_gene_counts(bam, gene_model, result_dic, gene_counts_file)} reads assigned to genes for sample {sample}"
+		))
+
+	return junc_files, counter_dic_l, writer_l
+
+def count_native(sample, bam, counter_dic_l, writer_l, processors):
+	"""
+	Reads a BAM file once for all native counts of a sample, processing chromosomes in parallel with `processors` processes.
+	"""
+	logger.info(f"Reading BAM file for native counts of sample {sample}...")
+	for writer, result_dic in zip(writer_l, junction.scan_bam(bam, counter_dic_l, processors)):
+		writer(result_dic)
+
+def process_samples(experiment_file, strand, anchor, min_intron, max_intron, output_dir, logs_dir, tmp_dir, saf_file, processors, junction_extractor="regtools", intron_counter="featureCounts", gtf=None, gene_counts_dir=None):
+	"""
+	Processes samples concurrently within a budget of `processors` cores.
+	As many samples as cores run external tools at once, and the cores are split evenly among running samples.
+	Native counts fork processes, which is not safe while threads of the pool are running, so they are read
+	after the pool has finished, one sample at a time with all cores.
 
-def merge_junction_files(junc_files, output_file):
-	def process_junction_files(files, junction_type):
-		logger.info(f"Merging {junction_type} junction files...")
-		result_df = []
-		for file in files:
-			sample_name = os.path.basename(file).rsplit("_", 1)[0]
-			logger.debug(f"Processing sample: {sample_name}")
-
-			df = pd.read_csv(
-				file,
-				sep="\t",
-				comment="#" if junction_type == "exon-intron" else None,
-				header=None,
-				dtype={0: str}
+	Returns:
+		list: Tuples of junction file and junction type, in the order of the experiment table.
+	"""
+	sample_l = read_experiment(experiment_file)
+	boundary_df = junction.read_saf(saf_file) if saf_file and intron_counter == "native" else None
+	gene_model = None
+	if gene_counts_dir:
+		logger.info(f"Reading genes from {gtf}...")
+		gene_model = expression.read_gene_model(gtf)
+		os.makedirs(gene_counts_dir, exist_ok=True)
+	jobs = max(1, min(len(sample_l), processors))
+	threads = max(1, processors // jobs)
+	logger.debug(f"Processing {len(sample_l)} samples with {jobs} concurrent jobs of {threads} threads")
+	junc_files, native_l = [], []
+	with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+		futures = [
+			executor.submit(
+				process_sample, sample, bam, technology, strand, anchor, min_intron, max_intron, logs_dir, tmp_dir,
+				saf_file, boundary_df, threads, junction_extractor, intron_counter, gene_model, gene_counts_dir
 			)
+			for sample, bam, technology in sample_l
+		]
+		for (sample, bam, _technology), future in zip(sample_l, futures):
+			try:
+				sample_junc_files, counter_dic_l, writer_l = future.result()
+			except BaseException:
+				# Do not start the remaining samples after a failure
+				executor.shutdown(wait=True, cancel_futures=True)
+				raise
+			junc_files.extend(sample_junc_files)
+			if counter_dic_l:
+				native_l.append((sample, bam, counter_dic_l, writer_l))
 
-			if junction_type == "exon-exon":
-				df = df.iloc[:, [0, 1, 2, 4, 10]]
-				df.columns = ["chr", "start", "end", "count", "block"]
-				df = df.reset_index()
-				df["chr"] = df["chr"].apply(lambda x: f"chr{x}" if x.isdecimal() or len(x) <= 2 else x)
-				df["blockSize1"] = df["block"].str.split(",", expand = True)[0].astype("int32")
-				df["start"] = df["start"].astype("int32") + df["blockSize1"]
-				df["blockSize2"] = df["block"].str.split(",", expand = True)[1].astype("int32")
-				df["end"] = df["end"].astype("int32") - df["blockSize2"] + 1
-				df["ID"] = df["chr"].astype(str) + ":" + df["start"].astype(str) + "-" + df["end"].astype(str)
-			else:
-				df = df.iloc[1:, [1, 2, 3, 0, 6]]
-				df.columns = ["chr", "start", "end", "ID", "count"]
-
-			df["chr"] = df["chr"].apply(lambda x: f"chr{x}" if x.isdecimal() or len(x) <= 2 else x)
-			df["sample"] = sample_name
-			result_df.append(df[["ID", "sample", "count"]] if junction_type == "exon-exon" else df)
-
-		merged_df = pd.concat(result_df, ignore_index=True).drop_duplicates()
-		merged_df["count"] = merged_df["count"].astype(int)
-		return merged_df
-
-	# Separate files by junction type
-	exon_exon_files = [j[0] for j in junc_files if j[1] == "exon-exon"]
-	exon_intron_files = [j[0] for j in junc_files if j[1] == "exon-intron"]
-
-	# Process exon-exon junctions
-	exon_exon_df = process_junction_files(exon_exon_files, "exon-exon")
-	if exon_exon_df.duplicated(subset=["ID", "sample"]).any():
-		duplicates = exon_exon_df[exon_exon_df.duplicated(subset=["ID", "sample"], keep=False)]
-		logger.debug(f"Duplicated junctions found: {duplicates}")
-		logger.debug("Duplicated junctions occur when the same junction is detected in both strands.")
-		logger.debug("The duplicated junctions will be summed and merged.")
-		# Group by ID and sample and sum counts
-		exon_exon_df = exon_exon_df.groupby(["ID", "sample"], as_index=False).sum()
-
-	exon_exon_df = exon_exon_df.pivot(index="ID", columns="sample", values="count").fillna(0).reset_index()
-	exon_exon_df["chr"], exon_exon_df["start"], exon_exon_df["end"] = zip(*exon_exon_df["ID"].str.extract(r'([^:]+):(\d+)-(\d+)').values)
-	exon_exon_df = exon_exon_df.astype({"start": int, "end": int})
-	exon_exon_df = exon_exon_df[["chr", "start", "end", "ID"] + [col for col in exon_exon_df.columns if col not in ["chr", "start", "end", "ID"]]]
-
-	# Process exon-intron junctions
-	exon_intron_df = process_junction_files(exon_intron_files, "exon-intron")
-	exon_intron_df = exon_intron_df.pivot(index=["chr", "start", "end", "ID"], columns="sample", values="count").fillna(0).reset_index()
-	exon_intron_df = exon_intron_df.astype({col: int for col in exon_intron_df.columns if col not in ["chr", "start", "end", "ID"]})
-
-	# Combine and save results
-	final_df = pd.concat([exon_exon_df, exon_intron_df], ignore_index=True).sort_values(["chr", "start"])
-	# Make sure values are all integers
-	final_df = final_df.astype({col: int for col in final_df.columns if col not in ["chr", "start", "end", "ID"]})
-	final_df.to_csv(output_file, sep="\t", index=False)
+	for sample, bam, counter_dic_l, writer_l in native_l:
+		count_native(sample, bam, counter_dic_l, writer_l, processors)
+
+	return junc_files
+
+def merge_junction_files(junc_files, output_file, tmp_dir, processors=1):
+	"""
+	Merges junction files of all samples into a junction read count matrix.
+	Junctions detected in both strands are summed.
+	"""
+	sample_junc_dic = {}
+	for file, junction_type in junc_files:
+		sample_name = os.path.basename(file).rsplit("_", 1)[0]
+		sample_junc_dic.setdefault(sample_name, []).append((file, junction_type))
+	logger.info(f"Merging junction files of {len(sample_junc_dic)} samples...")
+	junction_n = junction.merge_junctions(sample_junc_dic, output_file, tmp_dir, processors)
+	logger.debug(f"Total number of junctions: {junction_n}")
 	logger.info(f"Junction read counts merged into {output_file}")
 
 def main():
@@ -216,15 +267,23 @@ def main():
 	logger.info("Processing junction read counts...")
 	logger.debug(args)
 
+	if args.gene_counts and not args.gtf:
+		logger.error("--gene-counts requires a GTF file given by --gtf.")
+		sys.exit(1)
 	output_dir, logs_dir, tmp_dir = prepare_output_dir(args.output)
-	saf_file = create_saf_file(args.ri_event, tmp_dir)
+	if args.ri_event:
+		saf_file = create_saf_file(args.ri_event, tmp_dir)
+	else:
+		logger.info("No intron retention event file given. Skipping exon-intron junctions.")
+		saf_file = None
 	logger.info("Extracting junctions from BAM files...")
 	junc_files = process_samples(
-		args.input, args.strand, args.anchor, args.min_intron, args.max_intron, output_dir, logs_dir, tmp_dir, saf_file, args.processors
+		args.input, args.strand, args.anchor, args.min_intron, args.max_intron, output_dir, logs_dir, tmp_dir, saf_file, args.processors,
+		args.junction_extractor, args.intron_counter, args.gtf, args.gene_counts
 	)
 	logger.debug(junc_files)
 	logger.info("Merging junction read counts...")
-	merge_junction_files(junc_files, args.output)
+	merge_junction_files(junc_files, args.output, tmp_dir, args.processors)
 
 	# Cleanup
 	logger.debug("Cleaning up temporary files...")
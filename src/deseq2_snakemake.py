@@ -3,7 +3,7 @@ import pandas as pd
 import os
 import sys
 current_dir = os.path.dirname(os.path.abspath(__file__))
-from lib import general
+from lib import deseq, general
 import logging
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -28,11 +28,12 @@ def parse_args():
 	parser.add_argument("--reference", type = str, help = "Reference")
 	parser.add_argument("--alternative", type = str, help = "Alternative")
 	parser.add_argument("--output", type = str, help = "Output file")
+	parser.add_argument("--method", type = str, choices = ["DESeq2", "native"], default = "DESeq2", help = "Method of differential expression analysis; native fits negative binomial GLMs in Python without R")
 	parser.add_argument('-v', '--verbose', action='store_true', help='Increase output verbosity')
 	args = parser.parse_args()
 	return args
 
-def deseq2(count, experiment_table, reference, alternative, output):
+def deseq2(count, experiment_table, reference, alternative, output, method = "DESeq2"):
 
 	# Load experiment table
 	df = pd.read_csv(experiment_table, sep = "\t")
@@ -43,7 +44,16 @@ def deseq2(count, experiment_table, reference, alternative, output):
 	count_alternative = count_df["sample"][alternative]
 
 	# Check if the number of samples is greater than or equal to 2
-	if count_reference >= 2 and count_alternative >= 2:
+	if count_reference >= 2 and count_alternative >= 2 and method == "native":
+		count_df = pd.read_csv(count, sep = "\t", index_col = "gene_id")
+		gene_name = count_df.pop("gene_name") if "gene_name" in count_df.columns else None
+		try:
+			result_df = deseq.deseq(count_df, df.set_index("sample")["group"], reference, alternative)
+		except ValueError as e:
+			logger.error(f"{e} Exiting...")
+			sys.exit(1)
+		deseq.write_deg(result_df, output, gene_name)
+	elif count_reference >= 2 and count_alternative >= 2:
 		# Get path of directory where this script is located
 		run_command = ["Rscript", os.path.join(current_dir, "deseq2.R"), experiment_table, count, reference, alternative, output]
 		returncode = general.execute_command(run_command)
@@ -68,8 +78,8 @@ def main():
 	logger.debug(args)
 
 	# Run DESeq2
-	logger.info("Running DESeq2...")
-	deseq2(args.count, args.experiment_table, args.reference, args.alternative, args.output)
+	logger.info("Running DESeq2..." if args.method == "DESeq2" else "Running native negative binomial GLMs...")
+	deseq2(args.count, args.experiment_table, args.reference, args.alternative, args.output, args.method)
 
 	# Finish
 	logger.info("Done.")
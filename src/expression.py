@@ -1,10 +1,11 @@
 import argparse
+import concurrent.futures
 import os
 import sys
 import subprocess
 import logging
 import pandas as pd
-from lib import expression, general, expression
+from lib import bamprobe, deseq, expression, general
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -18,7 +19,10 @@ def parse_args():
 	parser.add_argument("-o", "--output", required=True, help="Output directory")
 	parser.add_argument("-r", "--refgroup", default="NA", help="Reference group for differential expression analysis")
 	parser.add_argument("-a", "--altgroup", default="NA", help="Alternative group for differential expression analysis")
-	parser.add_argument("-p", "--processors", type=int, default=1, help="Number of processors to use (default: 1)")
+	parser.add_argument("-p", "--processors", type=int, default=1, help="Number of processors to use, shared by featureCounts calls running concurrently (default: 1)")
+	parser.add_argument("--gene-counter", choices=["featureCounts", "native"], default="featureCounts", help="Tool to count reads of genes; native reads BAM files with pysam in parallel across chromosomes (default: featureCounts)")
+	parser.add_argument("--counts-dir", help="Directory of gene counts written by bam2junc.py --gene-counts; samples without counts there are counted with --gene-counter")
+	parser.add_argument("--de-method", choices=["DESeq2", "native"], default="DESeq2", help="Method of differential expression analysis; native fits negative binomial GLMs in Python without R (default: DESeq2)")
 	parser.add_argument("--excel", help = "Make result files in excel format", action = 'store_true')
 	parser.add_argument("-v", "--verbose", action="store_true", help="Increase output verbosity")
 	return parser.parse_args()
@@ -26,8 +30,14 @@ def parse_args():
 def prepare_output_dir(output_dir):
     os.makedirs(f"{output_dir}/logs", exist_ok=True)
 
-def process_samples(experiment_file, reference_gtf, output_dir, processors):
-	count_all_df = pd.DataFrame()
+def read_experiment(experiment_file):
+	"""
+	Reads samples from the experiment table and ensures that all BAM files are indexed.
+
+	Returns:
+		list: Tuples of sample name, BAM file and sequencing technology.
+	"""
+	sample_l = []
 	with open(experiment_file, "r") as experiment:
 		for line in experiment:
 			line = line.strip()
@@ -41,11 +51,6 @@ def process_samples(experiment_file, reference_gtf, output_dir, processors):
 				technology = "short"
 			bam_index = f"{bam_file}.bai"
 
-			logger.info(f"Processing sample: {sample}")
-			logger.debug(f"BAM file: {bam_file}")
-			if technology.lower() == "long":
-				logger.debug(f"{sample} will be processed as a long read sequencing experiment.")
-
 			# Ensure BAM index exists
 			if not os.path.isfile(bam_index):
 				logger.error(f"BAM index file not found for sample : {sample}")
@@ -53,36 +58,111 @@ def process_samples(experiment_file, reference_gtf, output_dir, processors):
 				sys.exit(1)
 			else:
 				logger.debug(f"Found BAM index for {bam_file}")
+			sample_l.append((sample, bam_file, technology))
+	return sample_l
 
-			# Check if BAM is paired-end
-			paired_flag = expression.is_paired_end(bam_file)
-			paired_option = ["-p", "-B"] if paired_flag else []
-			# Check if BAM is long-read
-			longread_option = ["-L"] if technology.lower() == "long" else []
-
-			# Run featureCounts
-			counts_file = f"{output_dir}/{sample}_counts.txt"
-			featurecounts_command = [
-				"featureCounts", "-a", reference_gtf, "-o", counts_file, "-T", str(processors),
-				"-t", "exon", "-g", "gene_id"
-			] + paired_option + longread_option + [bam_file]
-			# Delete empty strings
-			featurecounts_command = list(filter(None, featurecounts_command))
-			return_code = general.execute_command(featurecounts_command, f"{output_dir}/logs/featureCounts.log")
-			if return_code != 0:
-				logger.error(f"FeatureCounts failed for sample {sample}")
-				sys.exit(1)
+def batch_samples(sample_l):
+	"""
+	Groups samples that share featureCounts options, so that each group is counted by one featureCounts call
+	and the annotation is loaded once per group instead of once per sample.
+
+	Returns:
+		list: Tuples of featureCounts options and a list of sample names and BAM files, in the order of the experiment table.
+	"""
+	batch_dict = {}
+	for sample, bam_file, technology in sample_l:
+		if technology.lower() == "long":
+			logger.debug(f"{sample} will be processed as a long read sequencing experiment.")
+		# Check if BAM is paired-end
+		bam_info = bamprobe.probe(bam_file)
+		logger.debug(f"BAM metadata for {sample}: {bam_info}")
+		paired_option = ("-p", "-B") if bam_info["paired"] else ()
+		# Check if BAM is long-read
+		longread_option = ("-L",) if technology.lower() == "long" else ()
+		batch_dict.setdefault(paired_option + longread_option, []).append((sample, bam_file))
+	return list(batch_dict.items())
+
+def count_batch(batch_id, options, batch_l, reference_gtf, output_dir, threads):
+	"""
+	Counts reads of genes in the BAM files of a batch with one featureCounts call of `threads` threads.
+
+	Returns:
+		pd.DataFrame: Gene lengths and read counts of the samples, indexed by gene_id.
+	"""
+	samples = [sample for sample, _bam_file in batch_l]
+	logger.info(f"Counting reads of genes for samples: {', '.join(samples)}")
+	counts_file = f"{output_dir}/batch{batch_id}_counts.txt"
+	featurecounts_command = [
+		"featureCounts", "-a", reference_gtf, "-o", counts_file, "-T", str(threads),
+		"-t", "exon", "-g", "gene_id"
+	] + list(options) + [bam_file for _sample, bam_file in batch_l]
+	logger.debug(f"FeatureCounts command: {featurecounts_command}")
+	return_code = general.execute_command(featurecounts_command, f"{output_dir}/logs/featureCounts_batch{batch_id}.log")
+	if return_code != 0:
+		logger.error(f"FeatureCounts failed for samples {', '.join(samples)}")
+		sys.exit(1)
+	return expression.read_counts(counts_file, samples)
+
+def count_sample(sample, bam_file, technology, gene_model, output_dir, processors):
+	"""
+	Counts reads of genes in a sample natively, processing chromosomes in parallel with `processors` processes.
 
-			# Simplify counts file
-			logger.info(f"Simplifying counts file for sample {sample}")
-			counts_file_df = pd.read_csv(counts_file, sep="\t", comment="#")
-			counts_file_df = counts_file_df.iloc[:, [0, 5, 6]]
-			counts_file_df.columns = ["GeneID", "Length", sample]
-			count_all_df = pd.merge(count_all_df, counts_file_df[["GeneID", sample]], on = "GeneID") if not count_all_df.empty else counts_file_df
+	Returns:
+		pd.DataFrame: Gene lengths and read counts of the sample, indexed by gene_id.
+	"""
+	logger.info(f"Counting reads of genes for sample: {sample}")
+	counts_file = f"{output_dir}/{sample}_counts.txt"
+	paired_flag = bamprobe.probe(bam_file)["paired"]
+	assigned_n = expression.count_genes(bam_file, gene_model, counts_file, paired_flag, technology.lower() == "long", processors)
+	logger.debug(f"{assigned_n} reads assigned to genes for sample {sample}")
+	return expression.read_counts(counts_file, [sample])
 
-	count_all_df = count_all_df.rename(columns = {"GeneID": "gene_id"})
-	count_all_df = count_all_df.sort_values("gene_id")
-	return count_all_df
+def process_samples(experiment_file, reference_gtf, output_dir, processors, gene_counter="featureCounts", counts_dir=None):
+	"""
+	Counts reads of genes in all samples within a budget of `processors` cores.
+	With featureCounts, samples sharing featureCounts options are counted by one featureCounts call, batches run concurrently
+	and the cores are split evenly among running batches. The native counter counts one sample at a time with all cores.
+	Counts already written to `counts_dir` are read instead.
+
+	Returns:
+		pd.DataFrame: Columns gene_id, Length and one column for each sample, sorted by gene_id.
+	"""
+	sample_l = read_experiment(experiment_file)
+	samples = [sample for sample, _bam_file, _technology in sample_l]
+	count_df_list = []
+	if counts_dir:
+		counted_l = [(sample, f"{counts_dir}/{sample}_counts.txt") for sample, _bam_file, _technology in sample_l]
+		counted_l = [(sample, counts_file) for sample, counts_file in counted_l if os.path.isfile(counts_file)]
+		logger.info(f"Reading gene counts of {len(counted_l)} samples from {counts_dir}")
+		count_df_list += [expression.read_counts(counts_file, [sample]) for sample, counts_file in counted_l]
+		counted_set = {sample for sample, _counts_file in counted_l}
+		sample_l = [(sample, bam_file, technology) for sample, bam_file, technology in sample_l if sample not in counted_set]
+	if sample_l and gene_counter == "native":
+		logger.info(f"Reading genes from {reference_gtf}...")
+		gene_model = expression.read_gene_model(reference_gtf)
+		for sample, bam_file, technology in sample_l:
+			count_df_list.append(count_sample(sample, bam_file, technology, gene_model, output_dir, processors))
+	elif sample_l:
+		batch_l = batch_samples(sample_l)
+		jobs = max(1, min(len(batch_l), processors))
+		threads = max(1, processors // jobs)
+		logger.debug(f"Counting {len(sample_l)} samples in {len(batch_l)} featureCounts calls with {jobs} concurrent jobs of {threads} threads")
+		with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+			futures = [
+				executor.submit(count_batch, i + 1, options, batch, reference_gtf, output_dir, threads)
+				for i, (options, batch) in enumerate(batch_l)
+			]
+			for future in futures:
+				try:
+					count_df_list.append(future.result())
+				except BaseException:
+					# Do not start the remaining batches after a failure
+					executor.shutdown(wait=True, cancel_futures=True)
+					raise
+
+	# Assemble counts in the order of the experiment table
+	count_all_df = expression.merge_counts(count_df_list)
+	return count_all_df[["gene_id", "Length"] + samples]
 
 def run_deseq2(src_path, experiment_file, counts_file, refgroup, altgroup, output_dir):
 	if refgroup != "NA" and altgroup != "NA":
@@ -95,6 +175,18 @@ def run_deseq2(src_path, experiment_file, counts_file, refgroup, altgroup, outpu
 			logger.error("DESeq2 failed")
 			sys.exit(1)
 
+def run_native_deseq(experiment_file, count_df, refgroup, altgroup, output_dir):
+	if refgroup != "NA" and altgroup != "NA":
+		logger.info("Running differential expression analysis using native negative binomial GLMs...")
+		condition = pd.read_csv(experiment_file, sep="\t", usecols=["sample", "group"]).set_index("sample")["group"]
+		count_df = count_df.set_index("gene_id")
+		try:
+			result_df = deseq.deseq(count_df.drop(columns="gene_name"), condition, refgroup, altgroup)
+		except ValueError as e:
+			logger.error(f"Differential expression analysis failed: {e}")
+			sys.exit(1)
+		deseq.write_deg(result_df, f"{output_dir}/DEG.txt", count_df["gene_name"])
+
 def main():
 
 	# Parse arguments
@@ -119,7 +211,7 @@ def main():
 		logger.info(f"Mapped {len(gene_dict)} gene IDs to gene names.")
 
 	# Process samples and generate count files
-	count_all_df = process_samples(args.input, args.reference, args.output, args.processors)
+	count_all_df = process_samples(args.input, args.reference, args.output, args.processors, args.gene_counter, args.counts_dir)
 	# Save count files
 	logger.info("Saving count files...")
 	count_df = count_all_df.drop(columns = ["Length"])
@@ -135,9 +227,9 @@ def main():
 	# Save counts
 	count_df.to_csv(f"{args.output}/counts.txt", sep = "\t", index = False)
 
-	# Calculate TPM
-	logger.info("Calculating TPM...")
-	tpm_df = expression.ExpressionProcessor(count_all_df.copy()).TPM()
+	# Calculate TPM and CPM in one pass
+	logger.info("Calculating TPM and CPM...")
+	tpm_df, cpm_df = expression.ExpressionProcessor(count_all_df).normalize()
 	try:
 		tpm_df['gene_name'] = tpm_df['gene_id'].map(gene_dict)
 	except Exception as e:
@@ -150,9 +242,6 @@ def main():
 	# Save TPM
 	tpm_df.to_csv(f"{args.output}/TPM.txt", sep = "\t", index = False)
 
-	# Calculate CPM
-	logger.info("Calculating CPM...")
-	cpm_df = expression.ExpressionProcessor(count_all_df.copy()).CPM()
 	try:
 		cpm_df['gene_name'] = cpm_df['gene_id'].map(gene_dict)
 	except Exception as e:
@@ -187,7 +276,10 @@ def main():
 			cpm_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "C2", sheet_name = "CPM")
 
 	# Run DESeq2 for differential expression analysis
-	run_deseq2(os.path.dirname(__file__), args.input, f"{args.output}/counts.txt", args.refgroup, args.altgroup, args.output)
+	if args.de_method == "native":
+		run_native_deseq(args.input, count_df, args.refgroup, args.altgroup, args.output)
+	else:
+		run_deseq2(os.path.dirname(__file__), args.input, f"{args.output}/counts.txt", args.refgroup, args.altgroup, args.output)
 
 	# Cleanup
 	for count_file in os.listdir(args.output):
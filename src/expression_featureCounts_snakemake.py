@@ -2,7 +2,7 @@ import argparse
 import os
 import sys
 import pysam
-from lib import expression, general
+from lib import bamprobe, expression, general
 import logging
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -19,14 +19,22 @@ def parse_args():
 	parser.add_argument('-o', '--output', type=str, help='Output count file')
 	parser.add_argument('-t', '--threads', type=int, help='Number of threads')
 	parser.add_argument('-l', '--long-read', action='store_true', help='Long read mode')
+	parser.add_argument('-c', '--counter', choices=['featureCounts', 'native'], default='featureCounts', help='Tool to count reads of genes')
 	parser.add_argument('-v', '--verbose', action='store_true', help='Increase output verbosity')
 	args = parser.parse_args()
 	return args
 
-def bam2junc(bam, gtf, output, threads, long_read=False):
+def bam2junc(bam, gtf, output, threads, long_read=False, counter="featureCounts"):
 
 	# Check if BAM is paired-end
-	paired_flag = expression.is_paired_end(bam)
+	paired_flag = bamprobe.probe(bam)["paired"]
+
+	if counter == "native":
+		assigned_n = expression.count_genes(
+			bam, expression.read_gene_model(gtf), output, paired_flag, long_read, processors=threads
+		)
+		logger.debug(f"{assigned_n} reads assigned to genes")
+		return
 	paired_option = ["-p", "-B"] if paired_flag else [""]
 
 	# Check if long read mode is enabled
@@ -56,8 +64,8 @@ def main():
 	logger.debug(args)
 
 	# Run featureCounts
-	logger.info("Running featureCounts...")
-	bam2junc(args.bam, args.gtf, args.output, args.threads, args.long_read)
+	logger.info(f"Running {args.counter}...")
+	bam2junc(args.bam, args.gtf, args.output, args.threads, args.long_read, args.counter)
 
 	# Finish
 	logger.info("Done.")
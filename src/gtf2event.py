@@ -10,6 +10,10 @@ import itertools
 import time
 import concurrent.futures
 import logging
+import hashlib
+import shutil
+import tempfile
+from lib import cache, general
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -34,13 +38,18 @@ def get_args():
 	parser.add_argument("-r", "--reference-gtf", type = str, help = "Reference GTF file", required = False)
 	parser.add_argument("-o", "--output", type = str, help = "Output directory", required = True)
 	parser.add_argument("-p", "--num-process", type = int, help = "Number of processors to use", default = 1)
+	parser.add_argument("--events", type = str, help = "Comma-separated event types to search, e.g. SE,RI,MXE (default: all)", default = "all")
+	parser.add_argument("--max-mse-n", type = int, help = "Maximum number of exons skipped in MSE events (default: 500)", default = 500)
+	parser.add_argument("--cache-dir", type = str, help = "Directory to cache compiled annotation indexes for later runs (default: no caching)", required = False)
+	parser.add_argument("--cache-size", type = float, help = "Maximum size of the cache directory in GB (default: 10)", default = 10)
+	parser.add_argument("--incremental", action = "store_true", help = "Reuse events of genes unchanged since the previous run in the output directory and keep their event IDs")
 	parser.add_argument("-v", "--verbose", action="store_true", help="Verbose output")
 	args = parser.parse_args()
 	return(args)
 
-def gtf(gtf, num_process) -> pd.DataFrame:
+def gtf(gtf) -> dict:
 	"""
-	Reads a GTF file and extracts exon information to create a pandas DataFrame.
+	Reads a GTF file and extracts exon information to create gene models.
 
 	Args:
 		gtf (str): The path to the GTF file.
@@ -227,51 +236,332 @@ def gtf(gtf, num_process) -> pd.DataFrame:
 
 	# Discard genes with only one transcript
 	gtf_dic = {k: v for k, v in gtf_dic.items() if len(v["transcript_exon_dic"]) > 1}
-	# Split gene list into number of processes
-	gene_l_split = np.array_split(list(gtf_dic.keys()), num_process)
-	# Split dictionry into number of processes
-	gtf_dic_split = defaultdict(dict)
-	for i in range(num_process):
-		gtf_dic_split[i] = defaultdict(dict)
-		for gene in gene_l_split[i]:
-			gtf_dic_split[i][gene] = gtf_dic[gene]
-
-	return(gtf_dic_split)
-
-def gtf_exon_set(gtf_path) -> set:
+
+	return(gtf_dic)
+
+def split_gtf(gtf_dic, max_genes = 500) -> list:
 	"""
-	Reads a GTF file and extracts exon information to create a set of exon coordinates.
+	Splits gene models into chunks of genes on the same chromosome, submitted to worker processes one by one.
 
 	Args:
-		gtf (str): The path to the GTF file.
+		gtf_dic: A dictionary containing information about the GTF file.
+		max_genes (int): Maximum number of genes in a chunk.
+
+	Returns:
+		list: Dictionaries containing information about the genes in each chunk.
+	"""
+
+	chr_gene_dic = defaultdict(list)
+	for gene, gene_model in gtf_dic.items():
+		chr_gene_dic[gene_model["chr"]].append(gene)
+	gtf_chunk_l = []
+	for chr in sorted(chr_gene_dic):
+		gene_l = chr_gene_dic[chr]
+		for i in range(0, len(gene_l), max_genes):
+			gtf_chunk_l.append({gene: gtf_dic[gene] for gene in gene_l[i:i + max_genes]})
+
+	return(gtf_chunk_l)
+
+def search_results(futures, event, event_store = None):
+	"""
+	Yields results of event search as worker processes complete, followed by events of genes reused from the event store.
+
+	Args:
+		futures (list): Futures of event search.
+		event (str): Event type.
+		event_store (EventStore): Event store of an incremental run.
+
+	Yields:
+		list: Events found in a chunk of genes.
+	"""
+
+	for future in concurrent.futures.as_completed(futures):
+		event_l = future.result()
+		if event_store:
+			event_store.add(event, event_l)
+		yield(event_l)
+	if event_store:
+		yield(event_store.reused(event))
+
+class EventWriter:
+	"""
+	Writes events of an event type to the output file in chromosome-ordered batches, so that all events are never held in memory.
+	Events are spilled to a temporary file per chromosome as they are found. Each chromosome is then sorted, de-duplicated
+	by pos_id and numbered in turn. pos_id contains the chromosome, so de-duplicating each chromosome de-duplicates all events.
+
+	Args:
+		event (str): Event type.
+		columns (list): Output columns after event_id.
+		sort_columns (list): Columns to sort events by. The first one must start with the chromosome.
+		tmp_dir (str): Directory for temporary files.
+	"""
+
+	def __init__(self, event, columns, sort_columns, tmp_dir):
+		self.event = event
+		self.columns = columns
+		self.sort_columns = sort_columns
+		self.tmp_dir = tmp_dir
+		self.chr_file_dic = {}
+
+	def add(self, event_df):
+		"""
+		Spills a batch of events to the temporary files of their chromosomes.
+		"""
+		chr_s = event_df["pos_id"].str.split("@", n = 2).str[1]
+		for chr, chr_df in event_df.groupby(chr_s, sort = False):
+			header = chr not in self.chr_file_dic
+			if header:
+				self.chr_file_dic[chr] = os.path.join(self.tmp_dir, f"{self.event}_{len(self.chr_file_dic)}.txt")
+			chr_df[self.columns].to_csv(self.chr_file_dic[chr], sep = "\t", index = False, header = header, mode = "a")
+
+	def write(self, path, event_store = None) -> int:
+		"""
+		Sorts, de-duplicates and numbers events chromosome by chromosome and writes them to the output file.
+
+		Returns:
+			int: Number of events written.
+		"""
+		event_n = 0
+		with open(path, "w") as f:
+			f.write("\t".join(["event_id"] + self.columns) + "\n")
+			# Chromosomes in the order of the sort columns, which start with "chr:"
+			for chr in sorted(self.chr_file_dic, key = lambda x: x + ":"):
+				logger.debug(f"Writing {self.event} events on {chr}....")
+				chr_file = self.chr_file_dic[chr]
+				chr_df = pd.read_csv(chr_file, sep = "\t", dtype = str, keep_default_na = False)
+				chr_df = chr_df.sort_values(self.sort_columns)
+				chr_df = chr_df.drop_duplicates(subset = "pos_id", keep = "first")
+				chr_df = chr_df.reset_index(drop = True)
+				if event_store:
+					event_id_num = event_store.number(self.event, chr_df["pos_id"])
+				else:
+					event_id_num = chr_df.index + event_n + 1
+				chr_df.insert(0, "event_id", f"{self.event}_" + event_id_num.astype(str))
+				chr_df.to_csv(f, sep = "\t", index = False, header = False)
+				event_n += len(chr_df)
+				os.remove(chr_file)
+
+		return(event_n)
+
+def gene_hash(gene_model) -> str:
+	"""
+	Hashes the transcript structure of a gene.
+
+	Args:
+		gene_model: A dictionary containing information about a gene in the GTF file.
+
+	Returns:
+		str: Hash of the chromosome, strand, gene name and exons of all transcripts, independent of transcript IDs.
+	"""
+
+	structure = (
+		gene_model["chr"],
+		gene_model["strand"],
+		gene_model["gene_name"],
+		sorted(tuple(sorted(exons)) for exons in gene_model["transcript_exon_dic"].values())
+	)
+
+	return(hashlib.sha1(repr(structure).encode()).hexdigest())
+
+class EventStore:
+	"""
+	Events of each gene and event IDs from a previous run, used to search events only in new or changed genes.
+
+	Args:
+		path (str): The path to the event store file.
+		gtf_dic: A dictionary containing information about the GTF file.
+		events (list): Event types to search. Events are not reused if any of them was not searched in the previous run.
+		settings (dict): Settings affecting event search. Events are not reused if the settings have changed.
+	"""
+
+	def __init__(self, path, gtf_dic, events, settings):
+		self.path = path
+		self.settings = settings
+		self.gene_hash = {gene: gene_hash(gene_model) for gene, gene_model in gtf_dic.items()}
+		self.previous = cache.load(path) or {}
+		previous_events = self.previous.get("events", {})
+		if self.previous.get("settings") == settings and all(event in previous_events for event in events):
+			previous_gene_hash = self.previous["gene_hash"]
+			self.unchanged = {gene for gene, h in self.gene_hash.items() if previous_gene_hash.get(gene) == h}
+		else:
+			self.unchanged = set()
+		self.events = {}
+		self.event_id = {}
+		self.last_event_id = {}
+
+	def add(self, event, event_l):
+		"""
+		Records newly searched events.
+		"""
+		gene_event_dic = self.events.setdefault(event, defaultdict(list))
+		for row in event_l:
+			gene_event_dic[row[-2]].append(row)
+
+	def reused(self, event) -> list:
+		"""
+		Returns and records events of unchanged genes from the previous run.
+		"""
+		gene_event_dic = self.events.setdefault(event, defaultdict(list))
+		previous_gene_event_dic = self.previous.get("events", {}).get(event, {})
+		event_l = []
+		for gene in self.unchanged:
+			if gene in previous_gene_event_dic:
+				gene_event_dic[gene] = previous_gene_event_dic[gene]
+				event_l += previous_gene_event_dic[gene]
+		return(event_l)
+
+	def number(self, event, pos_id) -> pd.Series:
+		"""
+		Numbers events, batch by batch. Events found in the previous run keep their numbers, new events are numbered
+		after the last number ever assigned, so that numbers of removed events are not reused.
+		"""
+		previous_event_id = self.previous.get("event_id", {}).get(event, {})
+		last_event_id = self.last_event_id.get(event, self.previous.get("last_event_id", {}).get(event, 0))
+		event_id_num = pos_id.map(previous_event_id)
+		new = event_id_num.isna()
+		event_id_num.loc[new] = np.arange(last_event_id + 1, last_event_id + 1 + new.sum())
+		event_id_num = event_id_num.astype(int)
+		self.event_id.setdefault(event, {}).update(zip(pos_id, event_id_num))
+		self.last_event_id[event] = max(last_event_id, event_id_num.max()) if len(event_id_num) else last_event_id
+		return(event_id_num)
+
+	def save(self):
+		# Event IDs of event types not searched in this run are kept for later runs
+		cache.save(
+			{
+				"settings": self.settings,
+				"gene_hash": self.gene_hash,
+				"events": {event: dict(gene_event_dic) for event, gene_event_dic in self.events.items()},
+				"event_id": {**self.previous.get("event_id", {}), **self.event_id},
+				"last_event_id": {**self.previous.get("last_event_id", {}), **self.last_event_id}
+			},
+			self.path
+		)
+
+def annotation_index(gtf_path, reader, name, cache_dir = None):
+	"""
+	Builds an annotation index from a GTF file, or loads it from the cache.
+	Cache files are keyed by the Shiba version and the content hash of the GTF file.
+
+	Args:
+		gtf_path (str): The path to the GTF file.
+		reader: A function that builds the annotation index from the GTF file.
+		name (str): Name of the annotation index used in the cache file name.
+		cache_dir (str): Cache directory. The cache is not used if None.
+
+	Returns:
+		tuple: The annotation index and the path to its cache file (None if the cache is not used).
+	"""
+
+	if cache_dir is None:
+		return(reader(gtf_path), None)
+	cache_path = cache.cache_path(cache_dir, name, gtf_path)
+	index = cache.load(cache_path)
+	if index is not None:
+		logger.info(f"Loaded cached annotation index: {cache_path}")
+		return(index, cache_path)
+	index = reader(gtf_path)
+	logger.debug(f"Saving annotation index to cache: {cache_path}")
+	cache.save(index, cache_path)
+
+	return(index, cache_path)
+
+def reference_gtf(gtf_path) -> tuple:
+	"""
+	Reads a reference GTF file once and extracts exon and intron coordinates.
+	Introns are taken from consecutive exons of each transcript sorted by start position, without building gene models.
+
+	Args:
+		gtf_path (str): The path to the reference GTF file.
 
 	Returns:
-		set: A set of exon coordinates in the format "chr:start-end".
+		tuple: A set of exon coordinates and a set of intron coordinates, both in the format "chr:start-end".
 	"""
 
 	gtf_df = pd.read_csv(
 		gtf_path,
 		sep = "\t",
 		usecols = [
-			0, 2, 3, 4
+			0, 2, 3, 4, 8
 		],
 		dtype = {
 			0: "str",
 			2: "str",
 			3: "int32",
-			4: "int32"
+			4: "int32",
+			8: "str"
 		},
 		comment = "#",
 		header = None
 	)
 
-	gtf_df = gtf_df[gtf_df[2] == "exon"][[0, 3, 4]]
-	gtf_df.columns = ["chr", "start", "end"]
+	gtf_df = gtf_df[gtf_df[2] == "exon"][[0, 3, 4, 8]]
+	gtf_df.columns = ["chr", "start", "end", "information"]
 	gtf_df.loc[(~(gtf_df["chr"].str.startswith("chr")) & (gtf_df["chr"].str.len() <= 2)), "chr"] = "chr" + gtf_df["chr"]
-	gtf_df["exon"] = gtf_df["chr"] + ":" + gtf_df["start"].astype(str) + "-" + gtf_df["end"].astype(str)
-	gtf_exon_set = set(gtf_df["exon"])
+	gtf_df["transcript_id"] = gtf_df["information"].str.extract(r'(?:^|;)\s*transcript_id\s+"?([^";]+)', expand = False)
+	gtf_df = gtf_df.drop(columns = ["information"]).sort_values(["transcript_id", "start"], kind = "stable")
+
+	gtf_chr = gtf_df["chr"].values
+	gtf_start = gtf_df["start"].astype(str).values
+	gtf_end = gtf_df["end"].astype(str).values
+	gtf_transcript_id = gtf_df["transcript_id"].values
+	gtf_exon_set = set(gtf_chr + ":" + gtf_start + "-" + gtf_end)
+	# Introns between consecutive exons of the same transcript
+	same_transcript = gtf_transcript_id[1:] == gtf_transcript_id[:-1]
+	gtf_intron_set = set(gtf_chr[1:][same_transcript] + ":" + gtf_end[:-1][same_transcript] + "-" + gtf_start[1:][same_transcript])
+
+	return(gtf_exon_set, gtf_intron_set)
+
+def split_coordinate(coordinate) -> pd.DataFrame:
+	"""
+	Splits coordinates into chromosome, start and end in one pass.
+
+	Args:
+		coordinate (pd.Series): Coordinates in the format "chr:start-end".
+			For semicolon-concatenated coordinates, the first coordinate is used.
+
+	Returns:
+		pd.DataFrame: A DataFrame with chr, start and end columns.
+	"""
+
+	coordinate_df = coordinate.str.extract(r"^([^;]+):(\d+)-(\d+)(?:;|$)")
+	coordinate_df.columns = ["chr", "start", "end"]
+
+	return(coordinate_df)
+
+def remove_chr(coordinate) -> pd.Series:
+	"""
+	Removes chromosome names from coordinates (e.g. "chr1:100-200;chr1:300-400" to "100-200;300-400").
+
+	Args:
+		coordinate (pd.Series): Coordinates in the format "chr:start-end", optionally semicolon-concatenated.
+
+	Returns:
+		pd.Series: Coordinates without chromosome names.
+	"""
+
+	return(coordinate.str.replace(r"[^;]+:", "", regex = True))
+
+def annotation_label(event_df, reference_dic) -> pd.Series:
+	"""
+	Labels events as annotated when all their introns (or exons) are present in the reference GTF.
+
+	Args:
+		event_df (pd.DataFrame): A DataFrame of events.
+		reference_dic (dict): Column name to a set of reference introns or exons.
+			Semicolon-concatenated values are split and all of them have to be in the reference.
+
+	Returns:
+		pd.Series: "annotated" or "unannotated" for each event.
+	"""
+
+	annotated = pd.Series(True, index = event_df.index)
+	for column, reference_set in reference_dic.items():
+		feature = event_df[column].str.split(";").explode()
+		annotated &= feature.isin(reference_set).groupby(level = 0).all()
+	label = np.where(annotated, "annotated", "unannotated")
 
-	return(gtf_exon_set)
+	return(pd.Series(label, index = event_df.index))
 
 def se(gtf_dic) -> list:
 	"""
@@ -326,12 +616,13 @@ def se(gtf_dic) -> list:
 
 	return(event_l)
 
-def mse(gtf_dic) -> list:
+def mse(gtf_dic, max_mse_n = 500) -> list:
 	'''
 	Make multi-skipped exon list.
 
 	Args:
 		gtf_dic: A dictionary containing information about the GTF file.
+		max_mse_n (int): Maximum number of exons skipped.
 
 	Returns:
 		list: List of multi-skipped exon events, where each event is represented as a list of the form
@@ -348,69 +639,50 @@ def mse(gtf_dic) -> list:
 		chr = gtf_dic[gene]["chr"]
 		strand = gtf_dic[gene]["strand"]
 		gene_name = gtf_dic[gene]["gene_name"]
-		gene_start_values = gtf_dic[gene]["start"]
-		gene_end_values = gtf_dic[gene]["end"]
 		intron_list = gtf_dic[gene]["intron_list"]
 		intron_start_dict = gtf_dic[gene]["intron_start_dic"]
-		intron_end_dict = gtf_dic[gene]["intron_end_dic"]
 		intron_dic = gtf_dic[gene]["transcript_intron_dic"]
 		exon_dic = gtf_dic[gene]["transcript_exon_dic"]
-		# Sort exons by start position, ascending order
-		exon_dic = {k: sorted(list(v), key = lambda x: int(x.split(":")[1].split("-")[0])) for k, v in exon_dic.items()}
-		# Transcript list sorted by exon number
-		transcript_list = sorted(exon_dic, key = lambda x: len(exon_dic[x]))
+		candidate_l = []
+		for transcript_idx, transcript in enumerate(exon_dic.keys()):
+			# Sort exons by start position, ascending order
+			exon_list_in_transcript = sorted([tuple(int(i) for i in exon.split(":")[1].split("-")) for exon in exon_dic[transcript]])
+			# At least two skipped exons and their flanking exons
+			if len(exon_list_in_transcript) < 4:
+				continue
+			exon_start_in_transcript = [i[0] for i in exon_list_in_transcript]
+			exon_end_in_transcript = [i[1] for i in exon_list_in_transcript]
+			exon_start_idx_dic = {start: idx for idx, start in enumerate(exon_start_in_transcript)}
+
+			# (inc_1)[exon_1](inc_2)[exon_2]...[exon_(mse_n-1)](inc_(mse_n))[exon_(mse_n)](inc_(mse_n+1))
+			# (x1, y1)[y1, x2](x2, y2)[y2, x3]...[x(mse_n-1), y(mse_n)](x(mse_n), y(mse_n))[y(mse_n), x(mse_n+1)](x(mse_n+1), y(mse_n+1))
+			# inc1: (x1, y1)
+			# inc2: (x2, y2)
+			# ...
+			# inc(mse_n): (x(mse_n), y(mse_n))
+			# inc(mse_n+1): (x(mse_n+1), y(mse_n+1))
+			# exc: (x1, y(mse_n+1))
+			# Walk the transcript once, the exclusion intron starting at x1 fixes the skipped exons of every window size
+			for first_idx in range(1, len(exon_list_in_transcript) - 2):
+				x1 = exon_end_in_transcript[first_idx - 1]
+				for y_mse_n_1 in intron_start_dict.get(str(x1), set()):
+					if int(y_mse_n_1) not in exon_start_idx_dic:
+						continue
+					last_idx = exon_start_idx_dic[int(y_mse_n_1)] - 1
+					mse_n = last_idx - first_idx + 1
+					if (mse_n < 2) or (mse_n > max_mse_n):
+						continue
+					exc = chr + ":" + str(x1) + "-" + str(y_mse_n_1)
+					# Check if exclusion intron is NOT present in the same transcript
+					if (exc not in intron_list) or (exc in intron_dic[transcript]):
+						continue
+					all_exons = [chr + ":" + str(exon_start_in_transcript[i]) + "-" + str(exon_end_in_transcript[i]) for i in range(first_idx, last_idx + 1)]
+					all_introns = [chr + ":" + str(exon_end_in_transcript[i]) + "-" + str(exon_start_in_transcript[i + 1]) for i in range(first_idx - 1, last_idx + 1)] + [exc]
+					candidate_l += [((mse_n, transcript_idx, first_idx), [";".join(all_exons), ";".join(all_introns), mse_n, strand, gene, gene_name])]
 
-		# Identify multi-skipped exon events until five-hundredth exon skipping
-		for mse_n in range(2, 501):
-			# Get transcript with at least mse_n+2 exons
-			transcript_list = [transcript for transcript in exon_dic.keys() if len(exon_dic[transcript]) >= mse_n + 2]
-			if len(transcript_list) == 0:
-				break
-			for transcript in transcript_list:
-				exon_list_in_transcript = exon_dic[transcript]
-				exon_start_in_transcript = np.array([i.split(":")[1].split("-")[0] for i in exon_list_in_transcript]).astype("int32")
-				exon_end_in_transcript = np.array([i.split(":")[1].split("-")[1] for i in exon_list_in_transcript]).astype("int32")
-
-				# Get combinations of n adjuscent index
-				# e.g. (1, 2) when mse_n = 2 and exon number = 3, first and last exons are excluded
-				# e.g. (1, 2), (2, 3) when mse_n = 2 and exon number = 4, first and last exons are excluded
-				# e.g. (1, 2, 3), (2, 3, 4) when mse_n = 3 and exon number = 6, first and last exons are excluded
-				# e.g. (1, 2, 3), (2, 3, 4), (3, 4, 5) when mse_n = 3 and exon number = 7, first and last exons are excluded
-				idx_number_list = [i for i in range(len(exon_list_in_transcript) - mse_n)] # e.g. [0, 1] when mse_n = 2 and exon number = 4
-				idx_list_list = [list(range(i + 1, i + 1 + mse_n)) for i in idx_number_list] # e.g. [[1, 2], [2, 3]] when mse_n = 2 and exon number = 4
-				for idx_list in idx_list_list:
-
-					# (inc_1)[exon_1](inc_2)[exon_2]...[exon_(mse_n-1)](inc_(mse_n))[exon_(mse_n)](inc_(mse_n+1))
-					# (x1, y1)[y1, x2](x2, y2)[y2, x3]...[x(mse_n-1), y(mse_n)](x(mse_n), y(mse_n))[y(mse_n), x(mse_n+1)](x(mse_n+1), y(mse_n+1))
-					# inc1: (x1, y1)
-					# inc2: (x2, y2)
-					# ...
-					# inc(mse_n): (x(mse_n), y(mse_n))
-					# inc(mse_n+1): (x(mse_n+1), y(mse_n+1))
-					# exc: (x1, y(mse_n+1))
-
-					all_exons = [chr + ":" + str(exon_start_in_transcript[i]) + "-" + str(exon_end_in_transcript[i]) for i in idx_list]
-					exonlist = ";".join(all_exons)
-
-					x1_list = intron_end_dict.get(str(exon_start_in_transcript[idx_list[0]]), set())
-					y_mse_n_1_list = intron_start_dict.get(str(exon_end_in_transcript[idx_list[mse_n - 1]]), set())
-					for x1, y_mse_n_1 in itertools.product(x1_list, y_mse_n_1_list):
-
-						all_inclusion_introns = [chr + ":" + str(x1) + "-" + str(exon_start_in_transcript[idx_list[0]])] # inc1 (first intron)
-						for i in range(mse_n - 1): # inc2 to inc(mse_n)
-							all_inclusion_introns += [chr + ":"
-								+ str(exon_end_in_transcript[idx_list[i]])
-								+ "-"
-								+ str(exon_start_in_transcript[idx_list[i + 1]])
-							]
-						all_inclusion_introns += [chr + ":" + str(exon_end_in_transcript[idx_list[mse_n - 1]]) + "-" + str(y_mse_n_1)] # inc(mse_n+1)
-						exc = chr + ":" + str(x1) + "-" + str(y_mse_n_1)
-						all_introns = all_inclusion_introns + [exc]
-						intronlist = ";".join(all_introns)
-
-						# Check if all inclusion introns are and exclusion introns are NOT present in the same transcript
-						if (set(all_inclusion_introns) <= intron_dic[transcript]) and (exc not in intron_dic[transcript]) and (exc in intron_list):
-							event_l += [[exonlist, intronlist, mse_n, strand, gene, gene_name]]
+		# Keep the order of events by the number of skipped exons
+		candidate_l.sort(key = lambda x: x[0])
+		event_l += [candidate[1] for candidate in candidate_l]
 
 	return(event_l)
 
@@ -588,15 +860,21 @@ def three(gtf_dic) -> list:
 
 	return(event_l)
 
-def afe(gtf_dic) -> list:
+def terminal_exon(gtf_dic, first_exon) -> list:
 	'''
-	Make alternative first exon list.
+	Make alternative first or last exon list.
+
+	Exons of each transcript are walked from the terminal exon (first exon for AFE, last exon for ALE)
+	to the first exon shared with the other transcript. Exon chains are parsed once per transcript,
+	transcripts are grouped by their terminal exon, and each (distal, proximal) signature,
+	i.e. the exons up to the first shared exon, is evaluated only once.
 
 	Args:
 		gtf_dic: A dictionary containing information about the GTF file.
+		first_exon (bool): True for alternative first exons, False for alternative last exons.
 
 	Returns:
-		list: List of alternative first exon events, where each event is represented as a list of the form
+		list: List of alternative first or last exon events, where each event is represented as a list of the form
 		[exon_a, exon_b, intron_a, intron_b, strand, gene, gene_name].
 	'''
 
@@ -607,481 +885,146 @@ def afe(gtf_dic) -> list:
 		chr = gtf_dic[gene]["chr"]
 		strand = gtf_dic[gene]["strand"]
 		gene_name = gtf_dic[gene]["gene_name"]
-		gene_start_values = gtf_dic[gene]["start"]
-		gene_end_values = gtf_dic[gene]["end"]
 		intron_list = gtf_dic[gene]["intron_list"]
-		intron_start_dict = gtf_dic[gene]["intron_start_dic"]
-		intron_end_dict = gtf_dic[gene]["intron_end_dic"]
-		intron_dic = gtf_dic[gene]["transcript_intron_dic"]
 		exon_dic = gtf_dic[gene]["transcript_exon_dic"]
-		# Sort exons by start position, ascending order
-		exon_dic = {k: sorted(list(v), key = lambda x: int(x.split(":")[1].split("-")[0])) for k, v in exon_dic.items()}
+		# Walk exons in ascending order for AFE on + strand and ALE on - strand
+		ascending = (strand == "+") == first_exon
 		# Transcript list sorted by exon number
 		transcript_list = sorted(exon_dic, key = lambda x: len(exon_dic[x]))
-		# Keep transcripts with at least two exons
-		transcript_list = [transcript for transcript in transcript_list if len(exon_dic[transcript]) >= 2]
-		if len(transcript_list) < 2:
+		# Parse exon chains of transcripts with at least two exons, identical chains are kept once
+		chain_l = []
+		chain_set = set()
+		for transcript in transcript_list:
+			if len(exon_dic[transcript]) < 2:
+				continue
+			chain = sorted([tuple(int(i) for i in exon.split(":")[1].split("-")) for exon in exon_dic[transcript]])
+			chain = tuple(chain) if ascending else tuple(chain[::-1])
+			if chain not in chain_set:
+				chain_set.add(chain)
+				chain_l += [chain]
+		if len(chain_l) < 2:
 			continue
-		for transcript1, transcript2 in itertools.combinations(transcript_list, 2):
-			# Get first exons
-			first_exon_list = [exon_dic[transcript][0] if strand == "+" else exon_dic[transcript][-1] for transcript in [transcript1, transcript2]]
-			first_exon_transcript1 = first_exon_list[0]
-			first_exon_transcript1_start = first_exon_transcript1.split(":")[1].split("-")[0]
-			first_exon_transcript1_end = first_exon_transcript1.split(":")[1].split("-")[1]
-			first_exon_transcript2 = first_exon_list[1]
-			first_exon_transcript2_start = first_exon_transcript2.split(":")[1].split("-")[0]
-			first_exon_transcript2_end = first_exon_transcript2.split(":")[1].split("-")[1]
-			if strand == "+":
-				
-				# Set distal and proximal first exons
-				if (first_exon_transcript1_start < first_exon_transcript2_start) and (first_exon_transcript1_end < first_exon_transcript2_end):
-					distal_transcript = transcript1
-					proximal_transcript = transcript2
-					first_exon_distal = first_exon_transcript1
-					first_exon_distal_start = first_exon_transcript1_start
-					first_exon_distal_end = first_exon_transcript1_end
-					first_exon_proximal = first_exon_transcript2
-					first_exon_proximal_start = first_exon_transcript2_start
-					first_exon_proximal_end = first_exon_transcript2_end
-				elif (first_exon_transcript1_start > first_exon_transcript2_start) and (first_exon_transcript1_end > first_exon_transcript2_end):
-					distal_transcript = transcript2
-					proximal_transcript = transcript1
-					first_exon_distal = first_exon_transcript2
-					first_exon_distal_start = first_exon_transcript2_start
-					first_exon_distal_end = first_exon_transcript2_end
-					first_exon_proximal = first_exon_transcript1
-					first_exon_proximal_start = first_exon_transcript1_start
-					first_exon_proximal_end = first_exon_transcript1_end
-				else:
-					continue
-			
-				# Find the first shared exons between the two transcripts after the first exon
-				for exon1 in exon_dic[distal_transcript][1:]:
-					for exon2 in exon_dic[proximal_transcript][1:]:
-						if exon1 == exon2:
-							first_shared_exon = exon1
-							break
-					else:
-						continue
-					break
-				# Continue if no shared exon is found
-				else:
-					continue
-
-				# Get introns and exons between the distal first exon and the first shared exon
-				intron_a_list = []
-				exon_a_list = []
-				for exon_number in range(len(exon_dic[distal_transcript])):
-					if exon_number == 0:
-						intron_start = exon_dic[distal_transcript][0].split(":")[1].split("-")[1]
-						exon_a_list.append(exon_dic[distal_transcript][0])
-						continue
-					else:
-						intron_end = exon_dic[distal_transcript][exon_number].split(":")[1].split("-")[0]
-						intron = chr + ":" + str(intron_start) + "-" + str(intron_end)
-						intron_a_list.append(intron)
-						intron_start = exon_dic[distal_transcript][exon_number].split(":")[1].split("-")[1]
-					if exon_dic[distal_transcript][exon_number] == first_shared_exon:
-						break
-					exon_a_list.append(exon_dic[distal_transcript][exon_number])
-				
-				# Get introns between the proximal first exon and the first shared exon
-				intron_b_list = []
-				exon_b_list = []
-				for exon_number in range(len(exon_dic[proximal_transcript])):
-					if exon_number == 0:
-						intron_start = exon_dic[proximal_transcript][0].split(":")[1].split("-")[1]
-						exon_b_list.append(exon_dic[proximal_transcript][0])
-						continue
-					else:
-						intron_end = exon_dic[proximal_transcript][exon_number].split(":")[1].split("-")[0]
-						intron = chr + ":" + str(intron_start) + "-" + str(intron_end)
-						intron_b_list.append(intron)
-						intron_start = exon_dic[proximal_transcript][exon_number].split(":")[1].split("-")[1]
-					if exon_dic[proximal_transcript][exon_number] == first_shared_exon:
-						break
-					exon_b_list.append(exon_dic[proximal_transcript][exon_number])
-
-				# Check if no intron connecting the first exons and the next exons that other transcripts have
-				intron_connecting_other_transcripts = False
-				for transcript in transcript_list:
-					for i in range(2, len(exon_dic[transcript])):
-						intron_end = exon_dic[transcript][i].split(":")[1].split("-")[0]
-						intron_start = exon_dic[transcript][i - 1].split(":")[1].split("-")[1]
-						intron_connecting = f"{chr}:{intron_start}-{intron_end}"
-						if intron_connecting in {intron_a_list[0], intron_b_list[0]}:
-							intron_connecting_other_transcripts = True
-							break
-					if intron_connecting_other_transcripts:
+		# Introns entering each exon after the terminal exon
+		intron_chain_l = [
+			tuple((chain[n - 1][1], chain[n][0]) if ascending else (chain[n][1], chain[n - 1][0]) for n in range(1, len(chain)))
+			for chain in chain_l
+		]
+		# Exon position in each chain, terminal exon excluded
+		exon_position_l = [{exon: n for n, exon in enumerate(chain) if n > 0} for chain in chain_l]
+		# Introns other than the first intron from the terminal exon of each transcript
+		inner_intron_set = {intron for intron_chain in intron_chain_l for intron in intron_chain[1:]}
+		intron_set = set()
+		for intron in intron_list:
+			intron_chr, intron_pos = intron.split(":")
+			if intron_chr == chr:
+				intron_set.add(tuple(int(i) for i in intron_pos.split("-")))
+		# Group transcripts by terminal exon
+		terminal_dic = defaultdict(list)
+		for idx, chain in enumerate(chain_l):
+			terminal_dic[chain[0]].append(idx)
+
+		# signature -> [first transcript pair, valid]
+		signature_dic = {}
+		for terminal1, terminal2 in itertools.combinations(terminal_dic.keys(), 2):
+			# Set distal and proximal terminal exons, distal exon comes first in the walking direction
+			if (terminal1[0] < terminal2[0]) and (terminal1[1] < terminal2[1]):
+				distal_terminal, proximal_terminal = (terminal1, terminal2) if ascending else (terminal2, terminal1)
+			elif (terminal1[0] > terminal2[0]) and (terminal1[1] > terminal2[1]):
+				distal_terminal, proximal_terminal = (terminal2, terminal1) if ascending else (terminal1, terminal2)
+			else:
+				continue
+			for distal_idx, proximal_idx in itertools.product(terminal_dic[distal_terminal], terminal_dic[proximal_terminal]):
+				pair = (min(distal_idx, proximal_idx), max(distal_idx, proximal_idx))
+				distal_chain = chain_l[distal_idx]
+				proximal_chain = chain_l[proximal_idx]
+				# Find the first shared exon between the two transcripts after the terminal exon
+				proximal_position = exon_position_l[proximal_idx]
+				for k in range(1, len(distal_chain)):
+					if distal_chain[k] in proximal_position:
+						m = proximal_position[distal_chain[k]]
 						break
-				if intron_connecting_other_transcripts:
-					continue
-
-			else:  # strand == "-"
-
-				# Set distal and proximal first exons
-				if (first_exon_transcript1_start < first_exon_transcript2_start) and (first_exon_transcript1_end < first_exon_transcript2_end):
-					distal_transcript = transcript2
-					proximal_transcript = transcript1
-					first_exon_distal = first_exon_transcript2
-					first_exon_distal_start = first_exon_transcript2_start
-					first_exon_distal_end = first_exon_transcript2_end
-					first_exon_proximal = first_exon_transcript1
-					first_exon_proximal_start = first_exon_transcript1_start
-					first_exon_proximal_end = first_exon_transcript1_end
-				elif (first_exon_transcript1_start > first_exon_transcript2_start) and (first_exon_transcript1_end > first_exon_transcript2_end):
-					distal_transcript = transcript1
-					proximal_transcript = transcript2
-					first_exon_distal = first_exon_transcript1
-					first_exon_distal_start = first_exon_transcript1_start
-					first_exon_distal_end = first_exon_transcript1_end
-					first_exon_proximal = first_exon_transcript2
-					first_exon_proximal_start = first_exon_transcript2_start
-					first_exon_proximal_end = first_exon_transcript2_end
-				else:
-					continue
-				
-				# Find the first shared exons between the two transcripts after the first exon
-				for exon1 in exon_dic[distal_transcript][::-1][1:]:
-					for exon2 in exon_dic[proximal_transcript][::-1][1:]:
-						if exon1 == exon2:
-							first_shared_exon = exon1
-							break
-					else:
-						continue
-					break
 				# Continue if no shared exon is found
 				else:
 					continue
-
-				# Get introns between the distal first exon and the first shared exon
-				intron_a_list = []
-				exon_a_list = []
-				for exon_number in range(len(exon_dic[distal_transcript])):
-					if exon_number == 0:
-						intron_end = exon_dic[distal_transcript][::-1][0].split(":")[1].split("-")[0]
-						exon_a_list.append(exon_dic[distal_transcript][::-1][0])
-						continue
-					else:
-						intron_start = exon_dic[distal_transcript][::-1][exon_number].split(":")[1].split("-")[1]
-						intron = chr + ":" + str(intron_start) + "-" + str(intron_end)
-						intron_a_list.append(intron)
-						intron_end = exon_dic[distal_transcript][::-1][exon_number].split(":")[1].split("-")[0]
-					if exon_dic[distal_transcript][::-1][exon_number] == first_shared_exon:
-						break
-					exon_a_list.append(exon_dic[distal_transcript][::-1][exon_number])
-
-				# Get introns between the proximal first exon and the first shared exon
-				intron_b_list = []
-				exon_b_list = []
-				for exon_number in range(len(exon_dic[proximal_transcript])):
-					if exon_number == 0:
-						intron_end = exon_dic[proximal_transcript][::-1][0].split(":")[1].split("-")[0]
-						exon_b_list.append(exon_dic[proximal_transcript][::-1][0])
-						continue
-					else:
-						intron_start = exon_dic[proximal_transcript][::-1][exon_number].split(":")[1].split("-")[1]
-						intron = chr + ":" + str(intron_start) + "-" + str(intron_end)
-						intron_b_list.append(intron)
-						intron_end = exon_dic[proximal_transcript][::-1][exon_number].split(":")[1].split("-")[0]
-					if exon_dic[proximal_transcript][::-1][exon_number] == first_shared_exon:
-						break
-					exon_b_list.append(exon_dic[proximal_transcript][::-1][exon_number])
-
-				# Check if no intron connecting the first exons and the next exons that other transcripts have
-				intron_connecting_other_transcripts = False
-				for transcript in transcript_list:
-					for i in range(2, len(exon_dic[transcript])):
-						intron_start = exon_dic[transcript][::-1][i].split(":")[1].split("-")[1]
-						intron_end = exon_dic[transcript][::-1][i - 1].split(":")[1].split("-")[0]
-						intron_connecting = f"{chr}:{intron_start}-{intron_end}"
-						if intron_connecting in {intron_a_list[0], intron_b_list[0]}:
-							intron_connecting_other_transcripts = True
-							break
-					if intron_connecting_other_transcripts:
-						break
-				if intron_connecting_other_transcripts:
+				# Exons and introns between the terminal exon and the first shared exon
+				signature = (distal_chain[:k], proximal_chain[:m], intron_chain_l[distal_idx][:k], intron_chain_l[proximal_idx][:m])
+				if signature in signature_dic:
+					signature_dic[signature][0] = min(signature_dic[signature][0], pair)
 					continue
-
-			# Check if no intron connecting the distal transcript exons and the proximal transcript exons present
-			intron_connecting_count = 0
-			for exon_a in exon_a_list:
-				for exon_b in exon_b_list:
-					exon_a_start = exon_a.split(":")[1].split("-")[0]
-					exon_a_end = exon_a.split(":")[1].split("-")[1]
-					exon_b_start = exon_b.split(":")[1].split("-")[0]
-					exon_b_end = exon_b.split(":")[1].split("-")[1]
-					if exon_a_end < exon_b_start:
-						intron_connecting = chr + ":" + str(exon_a_end) + "-" + str(exon_b_start)
-					elif exon_b_end < exon_a_start:
-						intron_connecting = chr + ":" + str(exon_b_end) + "-" + str(exon_a_start)
-					else:
-						continue
-					if intron_connecting in intron_list:
-						intron_connecting_count += 1
-			if intron_connecting_count > 0:
-				continue
-
-			intron_a = ";".join(intron_a_list)
-			exon_a = ";".join(exon_a_list)
-			intron_b = ";".join(intron_b_list)
-			exon_b = ";".join(exon_b_list)
-			# Check if intron_a_list and intron_b_list do not share any introns
-			intron_a_set = set(intron_a_list)
-			intron_b_set = set(intron_b_list)
-			if intron_a_set & intron_b_set:
-				continue
-			# Add the event to the list
+				exon_a_list, exon_b_list, intron_a_list, intron_b_list = signature
+				# Check if no intron connecting the terminal exons and the next exons that other transcripts have
+				valid = (intron_a_list[0] not in inner_intron_set) and (intron_b_list[0] not in inner_intron_set)
+				# Check if no intron connecting the distal transcript exons and the proximal transcript exons present
+				if valid:
+					for exon_a, exon_b in itertools.product(exon_a_list, exon_b_list):
+						if exon_a[1] < exon_b[0]:
+							intron_connecting = (exon_a[1], exon_b[0])
+						elif exon_b[1] < exon_a[0]:
+							intron_connecting = (exon_b[1], exon_a[0])
+						else:
+							continue
+						if intron_connecting in intron_set:
+							valid = False
+							break
+				# Check if intron_a_list and intron_b_list do not share any introns
+				if valid and (set(intron_a_list) & set(intron_b_list)):
+					valid = False
+				signature_dic[signature] = [pair, valid]
+
+		# Add events in the order of the transcript pairs
+		for pair, signature in sorted((v[0], k) for k, v in signature_dic.items() if v[1]):
+			exon_a, exon_b, intron_a, intron_b = [";".join(chr + ":" + str(i[0]) + "-" + str(i[1]) for i in l) for l in signature]
 			event_l += [[exon_a, exon_b, intron_a, intron_b, strand, gene, gene_name]]
 
 	return(event_l)
 
-def ale(gtf_dic) -> list:
+def afe(gtf_dic) -> list:
 	'''
-	Make alternative last exon list.
+	Make alternative first exon list.
 
 	Args:
 		gtf_dic: A dictionary containing information about the GTF file.
 
 	Returns:
-		list: List of alternative last exon events, where each event is represented as a list of the form
+		list: List of alternative first exon events, where each event is represented as a list of the form
 		[exon_a, exon_b, intron_a, intron_b, strand, gene, gene_name].
 	'''
 
-	event_l = []
-	for gene in gtf_dic.keys():
-		if "intron_list" not in gtf_dic[gene]:
-			continue
-		chr = gtf_dic[gene]["chr"]
-		strand = gtf_dic[gene]["strand"]
-		gene_name = gtf_dic[gene]["gene_name"]
-		gene_start_values = gtf_dic[gene]["start"]
-		gene_end_values = gtf_dic[gene]["end"]
-		intron_list = gtf_dic[gene]["intron_list"]
-		intron_start_dict = gtf_dic[gene]["intron_start_dic"]
-		intron_end_dict = gtf_dic[gene]["intron_end_dic"]
-		intron_dic = gtf_dic[gene]["transcript_intron_dic"]
-		exon_dic = gtf_dic[gene]["transcript_exon_dic"]
-		# Sort exons by start position, ascending order
-		exon_dic = {k: sorted(list(v), key = lambda x: int(x.split(":")[1].split("-")[0])) for k, v in exon_dic.items()}
-		# Transcript list sorted by exon number
-		transcript_list = sorted(exon_dic, key = lambda x: len(exon_dic[x]))
-		# Keep transcripts with at least two exons
-		transcript_list = [transcript for transcript in transcript_list if len(exon_dic[transcript]) >= 2]
-		if len(transcript_list) < 2:
-			continue
-		for transcript1, transcript2 in itertools.combinations(transcript_list, 2):
-			# Get last exons
-			last_exon_list = [exon_dic[transcript][-1] if strand == "+" else exon_dic[transcript][0] for transcript in [transcript1, transcript2]]
-			last_exon_transcript1 = last_exon_list[0]
-			last_exon_transcript1_start = last_exon_transcript1.split(":")[1].split("-")[0]
-			last_exon_transcript1_end = last_exon_transcript1.split(":")[1].split("-")[1]
-			last_exon_transcript2 = last_exon_list[1]
-			last_exon_transcript2_start = last_exon_transcript2.split(":")[1].split("-")[0]
-			last_exon_transcript2_end = last_exon_transcript2.split(":")[1].split("-")[1]
-			if strand == "+":
-				# Set distal and proximal last exons
-				if (last_exon_transcript1_start < last_exon_transcript2_start) and (last_exon_transcript1_end < last_exon_transcript2_end):
-					distal_transcript = transcript2
-					proximal_transcript = transcript1
-					last_exon_distal = last_exon_transcript2
-					last_exon_distal_start = last_exon_transcript2_start
-					last_exon_distal_end = last_exon_transcript2_end
-					last_exon_proximal = last_exon_transcript1
-					last_exon_proximal_start = last_exon_transcript1_start
-					last_exon_proximal_end = last_exon_transcript1_end
-				elif (last_exon_transcript1_start > last_exon_transcript2_start) and (last_exon_transcript1_end > last_exon_transcript2_end):
-					distal_transcript = transcript1
-					proximal_transcript = transcript2
-					last_exon_distal = last_exon_transcript1
-					last_exon_distal_start = last_exon_transcript1_start
-					last_exon_distal_end = last_exon_transcript1_end
-					last_exon_proximal = last_exon_transcript2
-					last_exon_proximal_start = last_exon_transcript2_start
-					last_exon_proximal_end = last_exon_transcript2_end
-				else:
-					continue
+	return(terminal_exon(gtf_dic, True))
 
-				# Find the first shared exons between the two transcripts before the last exon
-				for exon1 in exon_dic[distal_transcript][::-1][1:]:
-					for exon2 in exon_dic[proximal_transcript][::-1][1:]:
-						if exon1 == exon2:
-							first_shared_exon = exon1
-							break
-					else:
-						continue
-					break
-				# Continue if no shared exon is found
-				else:
-					continue
+def ale(gtf_dic) -> list:
+	'''
+	Make alternative last exon list.
 
-				# Get introns and exons between the distal last exon and the first shared exon
-				intron_a_list = []
-				exon_a_list = []
-				for exon_number in range(len(exon_dic[distal_transcript])):
-					if exon_number == 0:
-						intron_end = exon_dic[distal_transcript][::-1][0].split(":")[1].split("-")[0]
-						exon_a_list.append(exon_dic[distal_transcript][::-1][0])
-						continue
-					else:
-						intron_start = exon_dic[distal_transcript][::-1][exon_number].split(":")[1].split("-")[1]
-						intron = chr + ":" + str(intron_start) + "-" + str(intron_end)
-						intron_a_list.append(intron)
-						intron_end = exon_dic[distal_transcript][::-1][exon_number].split(":")[1].split("-")[0]
-					if exon_dic[distal_transcript][::-1][exon_number] == first_shared_exon:
-						break
-					exon_a_list.append(exon_dic[distal_transcript][::-1][exon_number])
-				
-				# Get introns between the proximal last exon and the first shared exon
-				intron_b_list = []
-				exon_b_list = []
-				for exon_number in range(len(exon_dic[proximal_transcript])):
-					if exon_number == 0:
-						intron_end = exon_dic[proximal_transcript][::-1][0].split(":")[1].split("-")[0]
-						exon_b_list.append(exon_dic[proximal_transcript][::-1][0])
-						continue
-					else:
-						intron_start = exon_dic[proximal_transcript][::-1][exon_number].split(":")[1].split("-")[1]
-						intron = chr + ":" + str(intron_start) + "-" + str(intron_end)
-						intron_b_list.append(intron)
-						intron_end = exon_dic[proximal_transcript][::-1][exon_number].split(":")[1].split("-")[0]
-					if exon_dic[proximal_transcript][::-1][exon_number] == first_shared_exon:
-						break
-					exon_b_list.append(exon_dic[proximal_transcript][::-1][exon_number])
-				
-				# Check if no intron connecting the first exons and the next exons that other transcripts have
-				intron_connecting_other_transcripts = False
-				for transcript in transcript_list:
-					for i in range(2, len(exon_dic[transcript])):
-						intron_start = exon_dic[transcript][::-1][i].split(":")[1].split("-")[1]
-						intron_end = exon_dic[transcript][::-1][i - 1].split(":")[1].split("-")[0]
-						intron_connecting = f"{chr}:{intron_start}-{intron_end}"
-						if intron_connecting in {intron_a_list[0], intron_b_list[0]}:
-							intron_connecting_other_transcripts = True
-							break
-					if intron_connecting_other_transcripts:
-						break
-				if intron_connecting_other_transcripts:
-					continue
+	Args:
+		gtf_dic: A dictionary containing information about the GTF file.
 
-			else:  # strand == "-"
-
-				# Set distal and proximal last exons
-				if (last_exon_transcript1_start < last_exon_transcript2_start) and (last_exon_transcript1_end < last_exon_transcript2_end):
-					distal_transcript = transcript1
-					proximal_transcript = transcript2
-					last_exon_distal = last_exon_transcript1
-					last_exon_distal_start = last_exon_transcript1_start
-					last_exon_distal_end = last_exon_transcript1_end
-					last_exon_proximal = last_exon_transcript2
-					last_exon_proximal_start = last_exon_transcript2_start
-					last_exon_proximal_end = last_exon_transcript2_end
-				elif (last_exon_transcript1_start > last_exon_transcript2_start) and (last_exon_transcript1_end > last_exon_transcript2_end):
-					distal_transcript = transcript2
-					proximal_transcript = transcript1
-					last_exon_distal = last_exon_transcript2
-					last_exon_distal_start = last_exon_transcript2_start
-					last_exon_distal_end = last_exon_transcript2_end
-					last_exon_proximal = last_exon_transcript1
-					last_exon_proximal_start = last_exon_transcript1_start
-					last_exon_proximal_end = last_exon_transcript1_end
-				else:
-					continue
+	Returns:
+		list: List of alternative last exon events, where each event is represented as a list of the form
+		[exon_a, exon_b, intron_a, intron_b, strand, gene, gene_name].
+	'''
 
-				# Find the first shared exons between the two transcripts before the last exon
-				for exon1 in exon_dic[distal_transcript][1:]:
-					for exon2 in exon_dic[proximal_transcript][1:]:
-						if exon1 == exon2:
-							first_shared_exon = exon1
-							break
-					else:
-						continue
-					break
-				# Continue if no shared exon is found
-				else:
-					continue
+	return(terminal_exon(gtf_dic, False))
 
-				# Get introns and exons between the distal last exon and the first shared exon
-				intron_a_list = []
-				exon_a_list = []
-				for exon_number in range(len(exon_dic[distal_transcript])):
-					if exon_number == 0:
-						intron_start = exon_dic[distal_transcript][0].split(":")[1].split("-")[1]
-						exon_a_list.append(exon_dic[distal_transcript][0])
-						continue
-					else:
-						intron_end = exon_dic[distal_transcript][exon_number].split(":")[1].split("-")[0]
-						intron = chr + ":" + str(intron_start) + "-" + str(intron_end)
-						intron_a_list.append(intron)
-						intron_start = exon_dic[distal_transcript][exon_number].split(":")[1].split("-")[1]
-					if exon_dic[distal_transcript][exon_number] == first_shared_exon:
-						break
-					exon_a_list.append(exon_dic[distal_transcript][exon_number])
-				# Get introns between the proximal last exon and the first shared exon
-				intron_b_list = []
-				exon_b_list = []
-				for exon_number in range(len(exon_dic[proximal_transcript])):
-					if exon_number == 0:
-						intron_start = exon_dic[proximal_transcript][0].split(":")[1].split("-")[1]
-						exon_b_list.append(exon_dic[proximal_transcript][0])
-						continue
-					else:
-						intron_end = exon_dic[proximal_transcript][exon_number].split(":")[1].split("-")[0]
-						intron = chr + ":" + str(intron_start) + "-" + str(intron_end)
-						intron_b_list.append(intron)
-						intron_start = exon_dic[proximal_transcript][exon_number].split(":")[1].split("-")[1]
-					if exon_dic[proximal_transcript][exon_number] == first_shared_exon:
-						break
-					exon_b_list.append(exon_dic[proximal_transcript][exon_number])
-
-				# Check if no intron connecting the first exons and the next exons that other transcripts have
-				intron_connecting_other_transcripts = False
-				for transcript in transcript_list:
-					for i in range(2, len(exon_dic[transcript])):
-						intron_end = exon_dic[transcript][i].split(":")[1].split("-")[0]
-						intron_start = exon_dic[transcript][i - 1].split(":")[1].split("-")[1]
-						intron_connecting = f"{chr}:{intron_start}-{intron_end}"
-						if intron_connecting in {intron_a_list[0], intron_b_list[0]}:
-							intron_connecting_other_transcripts = True
-							break
-					if intron_connecting_other_transcripts:
-						break
-				if intron_connecting_other_transcripts:
-					continue
+def transcript_bitset(feature_dic, transcript_index) -> dict:
+	"""
+	Make an inverted index from features (exons or introns) to the transcripts containing them.
 
-			# Check if no intron connecting the distal transcript exons and the proximal transcript exons present
-			intron_connecting_count = 0
-			for exon_a in exon_a_list:
-				for exon_b in exon_b_list:
-					exon_a_start = exon_a.split(":")[1].split("-")[0]
-					exon_a_end = exon_a.split(":")[1].split("-")[1]
-					exon_b_start = exon_b.split(":")[1].split("-")[0]
-					exon_b_end = exon_b.split(":")[1].split("-")[1]
-					if exon_a_end < exon_b_start:
-						intron_connecting = chr + ":" + str(exon_a_end) + "-" + str(exon_b_start)
-					elif exon_b_end < exon_a_start:
-						intron_connecting = chr + ":" + str(exon_b_end) + "-" + str(exon_a_start)
-					else:
-						continue
-					if intron_connecting in intron_list:
-						intron_connecting_count += 1
-			if intron_connecting_count > 0:
-				continue
+	Args:
+		feature_dic: A dictionary of transcript ID to a set of features.
+		transcript_index: A dictionary of transcript ID to bit position.
 
-			intron_a = ";".join(intron_a_list)
-			exon_a = ";".join(exon_a_list)
-			intron_b = ";".join(intron_b_list)
-			exon_b = ";".join(exon_b_list)	
-			# Check if intron_a_list and intron_b_list do not share any introns
-			intron_a_set = set(intron_a_list)
-			intron_b_set = set(intron_b_list)
-			if intron_a_set & intron_b_set:
-				continue
+	Returns:
+		dict: Feature to bitset (int), where bit i is set if the i-th transcript contains the feature.
+	"""
 
-			# Add the event to the list
-			event_l += [[exon_a, exon_b, intron_a, intron_b, strand, gene, gene_name]]
+	bitset_dic = defaultdict(int)
+	for transcript, features in feature_dic.items():
+		bit = 1 << transcript_index[transcript]
+		for feature in features:
+			bitset_dic[feature] |= bit
 
-	return(event_l)
+	return(bitset_dic)
 
 def mxe(gtf_dic) -> list:
 	"""
@@ -1103,8 +1046,6 @@ def mxe(gtf_dic) -> list:
 		chr = gtf_dic[gene]["chr"]
 		strand = gtf_dic[gene]["strand"]
 		gene_name = gtf_dic[gene]["gene_name"]
-		gene_start_values = gtf_dic[gene]["start"]
-		gene_end_values = gtf_dic[gene]["end"]
 		intron_list = gtf_dic[gene]["intron_list"]
 		intron_start_dic = gtf_dic[gene]["intron_start_dic"]
 		intron_end_dic = gtf_dic[gene]["intron_end_dic"]
@@ -1114,42 +1055,54 @@ def mxe(gtf_dic) -> list:
 		exon_list_unique = np.unique([[i.split(":")[1].split("-")[0], i.split(":")[1].split("-")[1]] for i in exon_list], axis = 0)
 		exon_start = np.array([i[0] for i in exon_list_unique]).astype("int32")
 		exon_end = np.array([i[1] for i in exon_list_unique]).astype("int32")
-		idx1_idx2_iter = itertools.combinations(range(len(exon_start)), 2)
-		for idx1, idx2 in idx1_idx2_iter:
-			retained_intron = chr + ":" + str(exon_start[idx1]) + "-" + str(exon_end[idx2])
-			# exon_a is upstream of exon_b
-			# Not retained intron
-			if (exon_end[idx1] < exon_start[idx2]) and (retained_intron not in exon_list) and (str(exon_start[idx1]) in intron_end_dic) and (str(exon_end[idx1]) in intron_start_dic) and (str(exon_start[idx2]) in intron_end_dic) and (str(exon_end[idx2]) in intron_start_dic):
-				intron_a1_start_list = intron_end_dic[str(exon_start[idx1])]
-				intron_a1_end = exon_start[idx1]
-				intron_a2_start = exon_end[idx1]
-				intron_a2_end_list = intron_start_dic[str(exon_end[idx1])]
-				intron_b1_start_list = intron_end_dic[str(exon_start[idx2])]
-				intron_b1_end = exon_start[idx2]
-				intron_b2_start = exon_end[idx2]
-				intron_b2_end_list = intron_start_dic[str(exon_end[idx2])]
-				intron_iter = itertools.product(intron_a1_start_list, intron_a2_end_list, intron_b1_start_list, intron_b2_end_list)
-				for intron_a1_start, intron_a2_end, intron_b1_start, intron_b2_end in intron_iter:
-					exon_a = chr + ":" + str(exon_start[idx1]) + "-" + str(exon_end[idx1])
-					exon_b = chr + ":" + str(exon_start[idx2]) + "-" + str(exon_end[idx2])
-					intron_a1 = chr + ":" + str(intron_a1_start) + "-" + str(intron_a1_end)
-					intron_a2 = chr + ":" + str(intron_a2_start) + "-" + str(intron_a2_end)
-					intron_b1 = chr + ":" + str(intron_b1_start) + "-" + str(intron_b1_end)
-					intron_b2 = chr + ":" + str(intron_b2_start) + "-" + str(intron_b2_end)
-					intron_c = chr + ":" + str(intron_a2_start) + "-" + str(intron_b1_end)
-					intron_d = chr + ":" + str(intron_a1_start) + "-" + str(intron_b2_end)
-					if (int(intron_a1_start) == int(intron_b1_start)) and (int(intron_a1_end) != int(intron_b1_end)) and (int(intron_a2_start) != int(intron_b2_start)) and (int(intron_a2_end) == int(intron_b2_end)) and (intron_c not in intron_list) and (intron_d not in intron_list):
-						key1_key2_iter = itertools.permutations(intron_dic.keys(), 2)
-						for key1, key2 in key1_key2_iter:
-							if (intron_a1 in intron_dic[key1]) and (intron_a2 in intron_dic[key1]) and (intron_b1 in intron_dic[key2]) and (intron_b2 in intron_dic[key2]):
-								# exons not present in the same transcript
-								flag = False
-								for key3 in exon_dic.keys():
-									if (exon_a in exon_dic[key3]) and (exon_b in exon_dic[key3]):
-										flag = True
-										break
-								if flag == False:
-									event_l += [[exon_a, exon_b, intron_a1, intron_a2, intron_b1, intron_b2, strand, gene, gene_name]]
+		# Exon -> transcript and intron -> transcript bitsets
+		transcript_index = {transcript: i for i, transcript in enumerate(exon_dic.keys())}
+		exon_bitset = transcript_bitset(exon_dic, transcript_index)
+		intron_bitset = transcript_bitset(intron_dic, transcript_index)
+
+		# Group exons by upstream intron start and downstream intron end
+		# (x1)--(y1)[exon](x2)--(y2): exons sharing (x1, y2) are MXE candidates
+		flank_dic = defaultdict(list)
+		for idx in range(len(exon_start)):
+			intron_up_list = intron_end_dic.get(str(exon_start[idx]), set())
+			intron_down_list = intron_start_dic.get(str(exon_end[idx]), set())
+			for intron_up, intron_down in itertools.product(intron_up_list, intron_down_list):
+				flank_dic[(int(intron_up), int(intron_down))].append(idx)
+
+		candidate_l = []
+		for (intron_up, intron_down), idx_list in flank_dic.items():
+			for idx1, idx2 in itertools.combinations(idx_list, 2):
+				# exon_a is upstream of exon_b
+				if exon_end[idx1] >= exon_start[idx2]:
+					continue
+				# Not retained intron
+				retained_intron = chr + ":" + str(exon_start[idx1]) + "-" + str(exon_end[idx2])
+				if retained_intron in exon_list:
+					continue
+				# No intron connecting exon_a and exon_b, no intron skipping both
+				intron_c = chr + ":" + str(exon_end[idx1]) + "-" + str(exon_start[idx2])
+				intron_d = chr + ":" + str(intron_up) + "-" + str(intron_down)
+				if (intron_c in intron_list) or (intron_d in intron_list):
+					continue
+				exon_a = chr + ":" + str(exon_start[idx1]) + "-" + str(exon_end[idx1])
+				exon_b = chr + ":" + str(exon_start[idx2]) + "-" + str(exon_end[idx2])
+				# exons not present in the same transcript
+				if exon_bitset.get(exon_a, 0) & exon_bitset.get(exon_b, 0):
+					continue
+				intron_a1 = chr + ":" + str(intron_up) + "-" + str(exon_start[idx1])
+				intron_a2 = chr + ":" + str(exon_end[idx1]) + "-" + str(intron_down)
+				intron_b1 = chr + ":" + str(intron_up) + "-" + str(exon_start[idx2])
+				intron_b2 = chr + ":" + str(exon_end[idx2]) + "-" + str(intron_down)
+				# Two different transcripts including exon_a and exon_b with their flanking introns
+				transcript_a = intron_bitset.get(intron_a1, 0) & intron_bitset.get(intron_a2, 0)
+				transcript_b = intron_bitset.get(intron_b1, 0) & intron_bitset.get(intron_b2, 0)
+				transcript_ab = transcript_a | transcript_b
+				if transcript_a and transcript_b and (transcript_ab & (transcript_ab - 1)):
+					candidate_l += [(idx1, idx2, intron_up, intron_down, [exon_a, exon_b, intron_a1, intron_a2, intron_b1, intron_b2, strand, gene, gene_name])]
+
+		# Keep the exon pair order of exon_list_unique
+		candidate_l.sort(key = lambda x: x[:4])
+		event_l += [candidate[4] for candidate in candidate_l]
 
 	return(event_l)
 
@@ -1179,22 +1132,40 @@ def ri(gtf_dic) -> list:
 		exon_list_unique = np.unique([[i.split(":")[1].split("-")[0], i.split(":")[1].split("-")[1]] for i in exon_list], axis = 0)
 		exon_start = np.array([i[0] for i in exon_list_unique]).astype("int32")
 		exon_end = np.array([i[1] for i in exon_list_unique]).astype("int32")
-		idx1_idx2_iter = itertools.combinations(range(len(exon_start)), 2)
-		for idx1, idx2 in idx1_idx2_iter:
-			# Retained intron
-			retained_intron = chr + ":" + str(exon_end[idx1]) + "-" + str(exon_start[idx2])
-			retained_exon = chr + ":" + str(exon_start[idx1]) + "-" + str(exon_end[idx2])
-			exon_a = chr + ":" + str(exon_start[idx1]) + "-" + str(exon_end[idx1])
-			exon_b = chr + ":" + str(exon_start[idx2]) + "-" + str(exon_end[idx2])
-			exon_c = retained_exon
-			intron_a = chr + ":" + str(exon_end[idx1]) + "-" + str(exon_start[idx2])
-			# exon_a is upstream of exon_b
-			if (exon_end[idx1] < exon_start[idx2]) and (retained_intron in intron_list) and (retained_exon in exon_list):
-				# exons present in the same transcript
-				for exon_key in exon_dic.keys():
-					if (exon_a in exon_dic[exon_key]) and (exon_b in exon_dic[exon_key]):
-						event_l += [[exon_a, exon_b, exon_c, intron_a, strand, gene, gene_name]]
-						break
+		# Exon -> transcript bitset
+		transcript_index = {transcript: i for i, transcript in enumerate(exon_dic.keys())}
+		exon_bitset = transcript_bitset(exon_dic, transcript_index)
+		# Index unique exons by donor (exon end) and acceptor (exon start)
+		donor_dic = defaultdict(list)
+		acceptor_dic = defaultdict(list)
+		for idx in range(len(exon_start)):
+			donor_dic[int(exon_end[idx])].append(idx)
+			acceptor_dic[int(exon_start[idx])].append(idx)
+
+		candidate_l = []
+		for intron in intron_list:
+			intron_chr, intron_pos = intron.split(":")
+			if intron_chr != chr:
+				continue
+			intron_start, intron_end = intron_pos.split("-")
+			# (exon_a)(intron_a)(exon_b) and exon_c covering all three
+			for idx1 in donor_dic.get(int(intron_start), []):
+				for idx2 in acceptor_dic.get(int(intron_end), []):
+					# Exon pairs are visited in the order of exon_list_unique, exon_a is upstream of exon_b
+					if (idx1 >= idx2) or (exon_end[idx1] >= exon_start[idx2]):
+						continue
+					retained_exon = chr + ":" + str(exon_start[idx1]) + "-" + str(exon_end[idx2])
+					if retained_exon not in exon_list:
+						continue
+					exon_a = chr + ":" + str(exon_start[idx1]) + "-" + str(exon_end[idx1])
+					exon_b = chr + ":" + str(exon_start[idx2]) + "-" + str(exon_end[idx2])
+					# exons present in the same transcript
+					if exon_bitset.get(exon_a, 0) & exon_bitset.get(exon_b, 0):
+						candidate_l += [(idx1, idx2, [exon_a, exon_b, retained_exon, intron, strand, gene, gene_name])]
+
+		# Keep the same event order as the pairwise exon search
+		candidate_l.sort(key = lambda x: (x[0], x[1]))
+		event_l += [candidate[2] for candidate in candidate_l]
 
 	return(event_l)
 
@@ -1212,350 +1183,303 @@ def main():
 	gtf_path = args.gtf
 	reference_gtf_path = args.reference_gtf
 	num_process = args.num_process
+	max_mse_n = args.max_mse_n
 	output_dir = args.output
+	cache_dir = args.cache_dir
+	try:
+		events = general.parse_events(args.events)
+	except ValueError as e:
+		logger.error(e)
+		sys.exit(1)
 
 	logger.info("Starting event search...")
 	logger.debug(args)
+	logger.info(f"Event types: {', '.join(events)}")
 	logger.info(f"Loading {gtf_path}....")
-	gtf_dic_split = gtf(gtf_path, num_process)
+	gtf_dic, gtf_cache_path = annotation_index(gtf_path, gtf, "gene_model", cache_dir)
+	if args.incremental:
+		event_store = EventStore(os.path.join(output_dir, "event_store.pkl"), gtf_dic, events, {"version": cache.shiba_version(), "max_mse_n": max_mse_n})
+		logger.info(f"{len(event_store.unchanged)} of {len(gtf_dic)} genes unchanged since the previous run, searching events in the others....")
+		gtf_dic = {gene: gene_model for gene, gene_model in gtf_dic.items() if gene not in event_store.unchanged}
+	else:
+		event_store = None
+	gtf_chunk_l = split_gtf(gtf_dic)
+	del gtf_dic
 
 	if reference_gtf_path:
 		logger.info(f"Loading {reference_gtf_path}....")
-		gtf_ref_exon_set = gtf_exon_set(reference_gtf_path)
+		(gtf_ref_exon_set, gtf_ref_intron_set), gtf_ref_cache_path = annotation_index(reference_gtf_path, reference_gtf, "reference", cache_dir)
 		logger.debug("Size of exon set in reference GTF: " + str(len(gtf_ref_exon_set)))
-		gtf_ref_dic = gtf(reference_gtf_path, 1)
-		# Only intron_list is needed
-		gtf_ref_intron_set_dict = {k: v["intron_list"] for k, v in gtf_ref_dic[0].items() if "intron_list" in v}
-		gtf_ref_intron_set = set()
-		for k in gtf_ref_intron_set_dict:
-			gtf_ref_intron_set |= gtf_ref_intron_set_dict[k]
 		logger.debug("Size of intron set in reference GTF: " + str(len(gtf_ref_intron_set)))
-
-	#################################### Event search #########################################
-
-	output_df_dict = {}
-
-	#################################### Skipped exon (SE) ####################################
-
-	logger.info("Searching skipped exon (SE)....")
-	with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
-		futures = [executor.submit(se, gtf_dic_split[i]) for i in range(num_process)]
-	output_l = []
-	logger.debug("Waiting for skipped exon search to complete....")
-	for future in concurrent.futures.as_completed(futures):
-		output_l += future.result()
-	output_df = pd.DataFrame(
-		output_l,
-		columns = ["exon", "intron_a", "intron_b", "intron_c", "strand", "gene_id", "gene_name"]
-	)
-
-	logger.debug("Creating event_id....")
-	output_df["pos_id"] = \
-		"SE@" + \
-		output_df["exon"].str.split(":", expand = True)[0].astype(str) + "@" + \
-		output_df["exon"].str.split(":", expand = True)[1].str.split("-", expand = True)[0].astype(str) + "-" + output_df["exon"].str.split(":", expand = True)[1].str.split("-", expand = True)[1].astype(str) + "@" + \
-		output_df["intron_c"].str.split(":", expand = True)[1].str.split("-", expand = True)[0].astype(str) + "-" + output_df["intron_c"].str.split(":", expand = True)[1].str.split("-", expand = True)[1].astype(str)
-	output_df = output_df.sort_values("exon")
-	output_df = output_df.drop_duplicates(subset = "pos_id", keep = "first")
-	output_df = output_df.reset_index()
-	output_df["event_id_num"] = output_df.index + 1
-	output_df["event_id"] = "SE_" + output_df["event_id_num"].astype(str)
-	output_df = output_df[["event_id", "pos_id", "exon", "intron_a", "intron_b", "intron_c", "strand", "gene_id", "gene_name"]]
-
-	logger.debug("Creating label....")
-	if reference_gtf_path:
-		output_df["label"] = output_df.apply(lambda x: "annotated" if (x["intron_a"] in gtf_ref_intron_set) and (x["intron_b"] in gtf_ref_intron_set) and (x["intron_c"] in gtf_ref_intron_set) else "unannotated", axis = 1)
-	else:
-		output_df["label"] = "annotated"
-	output_df_dict["SE"] = output_df
-	del output_df
-
-	logger.info("Skipped exon search completed.")
-
-	#################################### Alternative Five prime ss (FIVE) ####################################
-
-	logger.info("Searching alternative five prime ss (FIVE)....")
-	with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
-		futures = [executor.submit(five, gtf_dic_split[i]) for i in range(num_process)]
-	output_l = []
-	logger.debug("Waiting for alternative five prime ss search to complete....")
-	for future in concurrent.futures.as_completed(futures):
-		output_l += future.result()
-	output_df = pd.DataFrame(
-		output_l,
-		columns = ["exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name"]
-	)
-
-	logger.debug("Creating event_id....")
-	output_df["pos_id"] = \
-		"FIVE@" + \
-		output_df["intron_a"].str.split(":", expand = True)[0].astype(str) + "@" + \
-		output_df["intron_a"].str.split(":", expand = True)[1].str.split("-", expand = True)[0].astype(str) + "-" + output_df["intron_a"].str.split(":", expand = True)[1].str.split("-", expand = True)[1].astype(str) + "@" + \
-		output_df["intron_b"].str.split(":", expand = True)[1].str.split("-", expand = True)[0].astype(str) + "-" + output_df["intron_b"].str.split(":", expand = True)[1].str.split("-", expand = True)[1].astype(str)
-	output_df = output_df.sort_values("exon_a")
-	output_df = output_df.drop_duplicates(subset = "pos_id", keep = "first")
-	output_df = output_df.reset_index()
-	output_df["event_id_num"] = output_df.index + 1
-	output_df["event_id"] = "FIVE_" + output_df["event_id_num"].astype(str)
-	output_df = output_df[["event_id", "pos_id", "exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name"]]
-
-	logger.debug("Creating label....")
-	if reference_gtf_path:
-		output_df["label"] = output_df.apply(lambda x: "annotated" if (x["intron_a"] in gtf_ref_intron_set) and (x["intron_b"] in gtf_ref_intron_set) else "unannotated", axis = 1)
-	else:
-		output_df["label"] = "annotated"
-	output_df_dict["FIVE"] = output_df
-	del output_df
-
-	logger.info("Alternative five prime ss search completed.")
-
-	#################################### Alternative three prime ss (THREE) ####################################
-
-	logger.info("Searching alternative three prime ss (THREE)....")
-	with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
-		futures = [executor.submit(three, gtf_dic_split[i]) for i in range(num_process)]
-	output_l = []
-	logger.debug("Waiting for alternative three prime ss search to complete....")
-	for future in concurrent.futures.as_completed(futures):
-		output_l += future.result()
-	output_df = pd.DataFrame(
-		output_l,
-		columns = ["exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name"]
-	)
-
-	logger.debug("Creating event_id....")
-	output_df["pos_id"] = \
-		"THREE@" + \
-		output_df["intron_a"].str.split(":", expand = True)[0].astype(str) + "@" + \
-		output_df["intron_a"].str.split(":", expand = True)[1].str.split("-", expand = True)[0].astype(str) + "-" + output_df["intron_a"].str.split(":", expand = True)[1].str.split("-", expand = True)[1].astype(str) + "@" + \
-		output_df["intron_b"].str.split(":", expand = True)[1].str.split("-", expand = True)[0].astype(str) + "-" + output_df["intron_b"].str.split(":", expand = True)[1].str.split("-", expand = True)[1].astype(str)
-	output_df = output_df.sort_values("exon_a")
-	output_df = output_df.drop_duplicates(subset = "pos_id", keep = "first")
-	output_df = output_df.reset_index()
-	output_df["event_id_num"] = output_df.index + 1
-	output_df["event_id"] = "THREE_" + output_df["event_id_num"].astype(str)
-	output_df = output_df[["event_id", "pos_id", "exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name"]]
-
-	logger.debug("Creating label....")
-	if reference_gtf_path:
-		output_df["label"] = output_df.apply(lambda x: "annotated" if (x["intron_a"] in gtf_ref_intron_set) and (x["intron_b"] in gtf_ref_intron_set) else "unannotated", axis = 1)
-	else:
-		output_df["label"] = "annotated"
-	output_df_dict["THREE"] = output_df
-	del output_df
-
-	logger.info("Alternative three prime ss search completed.")
-
-	#################################### Mutually exclusive exon (MXE) ####################################
-
-	logger.info("Searching mutually exclusive exons (MXE)....")
-	with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
-		futures = [executor.submit(mxe, gtf_dic_split[i]) for i in range(num_process)]
-	output_l = []
-	logger.debug("Waiting for mutually exclusive exon search to complete....")
-	for future in concurrent.futures.as_completed(futures):
-		output_l += future.result()
-	output_df = pd.DataFrame(
-		output_l,
-		columns = ["exon_a", "exon_b", "intron_a1", "intron_a2", "intron_b1", "intron_b2", "strand", "gene_id", "gene_name"]
-	)
-
-	logger.debug("Creating event_id....")
-	output_df["pos_id"] = \
-		"MXE@" + \
-		output_df["intron_a1"].str.split(":", expand = True)[0].astype(str) + "@" + \
-		output_df["intron_a1"].str.split(":", expand = True)[1].str.split("-", expand = True)[0].astype(str) + "@" + \
-		output_df["exon_a"].str.split(":", expand = True)[1].str.split("-", expand = True)[0].astype(str) + "-" + output_df["exon_a"].str.split(":", expand = True)[1].str.split("-", expand = True)[1].astype(str) + "@" + \
-		output_df["exon_b"].str.split(":", expand = True)[1].str.split("-", expand = True)[0].astype(str) + "-" + output_df["exon_b"].str.split(":", expand = True)[1].str.split("-", expand = True)[1].astype(str) + "@" + \
-		output_df["intron_b2"].str.split(":", expand = True)[1].str.split("-", expand = True)[1].astype(str)
-	output_df = output_df.sort_values("exon_a")
-	output_df = output_df.drop_duplicates(subset = "pos_id", keep = "first")
-	output_df = output_df.reset_index()
-	output_df["event_id_num"] = output_df.index + 1
-	output_df["event_id"] = "MXE_" + output_df["event_id_num"].astype(str)
-	output_df = output_df[["event_id", "pos_id", "exon_a", "exon_b", "intron_a1", "intron_a2", "intron_b1", "intron_b2", "strand", "gene_id", "gene_name"]]
-
-	logger.debug("Creating label....")
-	if reference_gtf_path:
-		output_df["label"] = output_df.apply(lambda x: "annotated" if (x["intron_a1"] in gtf_ref_intron_set) and (x["intron_a2"] in gtf_ref_intron_set) and (x["intron_b1"] in gtf_ref_intron_set) and (x["intron_b2"] in gtf_ref_intron_set) else "unannotated", axis = 1)
 	else:
-		output_df["label"] = "annotated"
-	output_df_dict["MXE"] = output_df
-	del output_df
+		gtf_ref_cache_path = None
 
-	logger.info("Mutually exclusive exon search completed.")
+	if cache_dir:
+		# Keep the cache directory within the size limit
+		evicted = cache.evict(cache_dir, args.cache_size * 1024 ** 3, keep = [path for path in [gtf_cache_path, gtf_ref_cache_path] if path])
+		if evicted:
+			logger.info(f"Removed {len(evicted)} old annotation index file(s) from {cache_dir}")
 
-	#################################### Retained intron (RI) ####################################
-
-	logger.info("Searching retained intron (RI)....")
-	with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
-		futures = [executor.submit(ri, gtf_dic_split[i]) for i in range(num_process)]
-	output_l = []
-	logger.debug("Waiting for retained intron search to complete....")
-	for future in concurrent.futures.as_completed(futures):
-		output_l += future.result()
-	output_df = pd.DataFrame(
-		output_l,
-		columns = ["exon_a", "exon_b", "exon_c", "intron_a", "strand", "gene_id", "gene_name"]
-	)
-
-	logger.debug("Creating event_id....")
-	output_df["pos_id"] = \
-		"RI@" + \
-		output_df["intron_a"].str.replace(":", "@")
-	output_df = output_df.sort_values("exon_a")
-	output_df = output_df.drop_duplicates(subset = "pos_id", keep = "first")
-	output_df = output_df.reset_index()
-	output_df["event_id_num"] = output_df.index + 1
-	output_df["event_id"] = "RI_" + output_df["event_id_num"].astype(str)
-	output_df = output_df[["event_id", "pos_id", "exon_a", "exon_b", "exon_c", "intron_a", "strand", "gene_id", "gene_name"]]
-
-	logger.debug("Creating label....")
-	if reference_gtf_path:
-		output_df["label"] = output_df.apply(lambda x: "annotated" if (x["intron_a"] in gtf_ref_intron_set) and (x["exon_c"] in gtf_ref_exon_set) else "unannotated", axis = 1)
-	else:
-		output_df["label"] = "annotated"
-	output_df_dict["RI"] = output_df
-	del output_df
-
-	logger.info("Retained intron search completed.")
-
-	#################################### Multiple skipped exons (MSE) ####################################
-
-	logger.info("Searching multiple skipped exons (MSE)....")
-	with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
-		futures = [executor.submit(mse, gtf_dic_split[i]) for i in range(num_process)]
-	output_l = []
-	logger.debug("Waiting for multiple skipped exons search to complete....")
-	for future in concurrent.futures.as_completed(futures):
-		output_l += future.result()
-	output_df = pd.DataFrame(
-		output_l,
-		columns = ["exon", "intron", "mse_n", "strand", "gene_id", "gene_name"]
-	)
-
-	logger.debug("Creating event_id....")
-	# pos_id = chromosome@exon_start-exon_end;exon_start-exon_end@exclusionintron_start-exclusionintron_end
-	output_df["chr"] = output_df["exon"].str.split(":", expand = True)[0]
-	output_df["exon_for_posid"] = output_df.apply(lambda x: x["exon"].replace(x["chr"] + ":", ""), axis = 1)
-	output_df["exc"] = output_df["intron"].apply(lambda x: x.split(";")[-1])
-	output_df["pos_id"] = \
-		"MSE@" + \
-		output_df["chr"] + "@" + \
-		output_df["exon_for_posid"] + "@" + \
-		output_df["exc"].str.split(":", expand = True)[1].str.split("-", expand = True)[0].astype(str) + "-" + output_df["exc"].str.split(":", expand = True)[1].str.split("-", expand = True)[1].astype(str)
-	output_df = output_df.sort_values("exon")
-	output_df = output_df.drop_duplicates(subset = "pos_id", keep = "first")
-	output_df = output_df.reset_index()
-	output_df["event_id_num"] = output_df.index + 1
-	output_df["event_id"] = "MSE_" + output_df["event_id_num"].astype(str)
-	output_df = output_df[["event_id", "pos_id", "mse_n", "exon", "intron", "strand", "gene_id", "gene_name"]]
-
-	logger.debug("Creating label....")
-	# Check if the intron is annotated
-	if reference_gtf_path:
-		output_df["label"] = output_df["intron"].apply(lambda x: "annotated" if set(x.split(";")) <= gtf_ref_intron_set else "unannotated")
-	else:
-		output_df["label"] = "annotated"
-	output_df_dict["MSE"] = output_df
-	del output_df
-
-	logger.info("Multiple skipped exons search completed.")
-
-	#################################### Alternative first exons (AFE) ####################################
-
-	logger.info("Searching alternative first exons (AFE)....")
-	with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
-		futures = [executor.submit(afe, gtf_dic_split[i]) for i in range(num_process)]
-	output_l = []
-	logger.debug("Waiting for alternative first exons search to complete....")
-	for future in concurrent.futures.as_completed(futures):
-		output_l += future.result()
-	output_df = pd.DataFrame(
-		output_l,
-		columns = ["exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name"]
-	)
-
-	logger.debug("Creating event_id....")
-	output_df["chr"] = output_df["exon_a"].str.split(":", expand = True)[0]
-	output_df["intron_a_for_posid"] = output_df.apply(lambda x: x["intron_a"].replace(x["chr"] + ":", ""), axis = 1)
-	output_df["intron_b_for_posid"] = output_df.apply(lambda x: x["intron_b"].replace(x["chr"] + ":", ""), axis = 1)
-	output_df["pos_id"] = \
-		"AFE@" + \
-		output_df["chr"] + "@" + \
-		output_df["intron_a_for_posid"] + "@" + \
-		output_df["intron_b_for_posid"]
-	output_df = output_df.sort_values(["exon_a", "exon_b"], ascending = [True, True])
-	output_df = output_df.drop_duplicates(subset = "pos_id", keep = "first")
-	output_df = output_df.reset_index()
-	output_df["event_id_num"] = output_df.index + 1
-	output_df["event_id"] = "AFE_" + output_df["event_id_num"].astype(str)
-	output_df = output_df[["event_id", "pos_id", "exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name"]]
-
-	logger.debug("Creating label....")
-	# Check if the intron is annotated
-	if reference_gtf_path:
-		output_df["label"] = output_df.apply(lambda x: "annotated" if (set(x["intron_a"].split(";")) <= gtf_ref_intron_set) and (set(x["intron_b"].split(";")) <= gtf_ref_intron_set) else "unannotated", axis = 1)
-	else:
-		output_df["label"] = "annotated"
-	output_df_dict["AFE"] = output_df
-	del output_df
-	
-	logger.info("Alternative first exons search completed.")
-
-	################################### Alternative last exons (ALE) ###################################
-	logger.info("Searching alternative last exons (ALE)....")
-	with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
-		futures = [executor.submit(ale, gtf_dic_split[i]) for i in range(num_process)]
-	output_l = []
-	logger.debug("Waiting for alternative last exons search to complete....")
-	for future in concurrent.futures.as_completed(futures):
-		output_l += future.result()
-	output_df = pd.DataFrame(
-		output_l,
-		columns = ["exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name"]
-	)
+	#################################### Event search #########################################
 
-	logger.debug("Creating event_id....")
-	output_df["chr"] = output_df["exon_a"].str.split(":", expand = True)[0]
-	output_df["intron_a_for_posid"] = output_df.apply(lambda x: x["intron_a"].replace(x["chr"] + ":", ""), axis = 1)
-	output_df["intron_b_for_posid"] = output_df.apply(lambda x: x["intron_b"].replace(x["chr"] + ":", ""), axis = 1)
-	output_df["pos_id"] = \
-		"ALE@" + \
-		output_df["chr"] + "@" + \
-		output_df["intron_a_for_posid"] + "@" + \
-		output_df["intron_b_for_posid"]
-	output_df = output_df.sort_values(["exon_a", "exon_b"], ascending = [True, True])
-	output_df = output_df.drop_duplicates(subset = "pos_id", keep = "first")
-	output_df = output_df.reset_index()
-	output_df["event_id_num"] = output_df.index + 1
-	output_df["event_id"] = "ALE_" + output_df["event_id_num"].astype(str)
-	output_df = output_df[["event_id", "pos_id", "exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name"]]
-
-	logger.debug("Creating label....")
-	# Check if the intron is annotated
-	if reference_gtf_path:
-		output_df["label"] = output_df.apply(lambda x: "annotated" if (set(x["intron_a"].split(";")) <= gtf_ref_intron_set) and (set(x["intron_b"].split(";")) <= gtf_ref_intron_set) else "unannotated", axis = 1)
-	else:
-		output_df["label"] = "annotated"
-	output_df_dict["ALE"] = output_df
-	del output_df
+	os.makedirs(output_dir, exist_ok = True)
+	tmp_dir = tempfile.mkdtemp(prefix = "tmp_", dir = output_dir)
+	try:
+		#################################### Skipped exon (SE) ####################################
+
+		if "SE" in events:
+			logger.info("Searching skipped exon (SE)....")
+			event_writer = EventWriter("SE", ["pos_id", "exon", "intron_a", "intron_b", "intron_c", "strand", "gene_id", "gene_name", "label"], ["exon"], tmp_dir)
+			with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
+				futures = [executor.submit(se, gtf_chunk) for gtf_chunk in gtf_chunk_l]
+				logger.debug("Waiting for skipped exon search to complete....")
+				for output_l in search_results(futures, "SE", event_store):
+					output_df = pd.DataFrame(
+						output_l,
+						columns = ["exon", "intron_a", "intron_b", "intron_c", "strand", "gene_id", "gene_name"]
+					)
+
+					exon_df = split_coordinate(output_df["exon"])
+					intron_c_df = split_coordinate(output_df["intron_c"])
+					output_df["pos_id"] = \
+						"SE@" + \
+						exon_df["chr"] + "@" + \
+						exon_df["start"] + "-" + exon_df["end"] + "@" + \
+						intron_c_df["start"] + "-" + intron_c_df["end"]
+
+					if reference_gtf_path:
+						output_df["label"] = annotation_label(output_df, {"intron_a": gtf_ref_intron_set, "intron_b": gtf_ref_intron_set, "intron_c": gtf_ref_intron_set})
+					else:
+						output_df["label"] = "annotated"
+					event_writer.add(output_df)
+			event_n = event_writer.write(os.path.join(output_dir, "EVENT_SE.txt"), event_store)
+
+			logger.info(f"Skipped exon search completed. {event_n} events found.")
+
+		#################################### Alternative Five prime ss (FIVE) ####################################
+
+		if "FIVE" in events:
+			logger.info("Searching alternative five prime ss (FIVE)....")
+			event_writer = EventWriter("FIVE", ["pos_id", "exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name", "label"], ["exon_a"], tmp_dir)
+			with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
+				futures = [executor.submit(five, gtf_chunk) for gtf_chunk in gtf_chunk_l]
+				logger.debug("Waiting for alternative five prime ss search to complete....")
+				for output_l in search_results(futures, "FIVE", event_store):
+					output_df = pd.DataFrame(
+						output_l,
+						columns = ["exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name"]
+					)
+
+					intron_a_df = split_coordinate(output_df["intron_a"])
+					intron_b_df = split_coordinate(output_df["intron_b"])
+					output_df["pos_id"] = \
+						"FIVE@" + \
+						intron_a_df["chr"] + "@" + \
+						intron_a_df["start"] + "-" + intron_a_df["end"] + "@" + \
+						intron_b_df["start"] + "-" + intron_b_df["end"]
+
+					if reference_gtf_path:
+						output_df["label"] = annotation_label(output_df, {"intron_a": gtf_ref_intron_set, "intron_b": gtf_ref_intron_set})
+					else:
+						output_df["label"] = "annotated"
+					event_writer.add(output_df)
+			event_n = event_writer.write(os.path.join(output_dir, "EVENT_FIVE.txt"), event_store)
+
+			logger.info(f"Alternative five prime ss search completed. {event_n} events found.")
+
+		#################################### Alternative three prime ss (THREE) ####################################
+
+		if "THREE" in events:
+			logger.info("Searching alternative three prime ss (THREE)....")
+			event_writer = EventWriter("THREE", ["pos_id", "exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name", "label"], ["exon_a"], tmp_dir)
+			with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
+				futures = [executor.submit(three, gtf_chunk) for gtf_chunk in gtf_chunk_l]
+				logger.debug("Waiting for alternative three prime ss search to complete....")
+				for output_l in search_results(futures, "THREE", event_store):
+					output_df = pd.DataFrame(
+						output_l,
+						columns = ["exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name"]
+					)
+
+					intron_a_df = split_coordinate(output_df["intron_a"])
+					intron_b_df = split_coordinate(output_df["intron_b"])
+					output_df["pos_id"] = \
+						"THREE@" + \
+						intron_a_df["chr"] + "@" + \
+						intron_a_df["start"] + "-" + intron_a_df["end"] + "@" + \
+						intron_b_df["start"] + "-" + intron_b_df["end"]
+
+					if reference_gtf_path:
+						output_df["label"] = annotation_label(output_df, {"intron_a": gtf_ref_intron_set, "intron_b": gtf_ref_intron_set})
+					else:
+						output_df["label"] = "annotated"
+					event_writer.add(output_df)
+			event_n = event_writer.write(os.path.join(output_dir, "EVENT_THREE.txt"), event_store)
+
+			logger.info(f"Alternative three prime ss search completed. {event_n} events found.")
+
+		#################################### Mutually exclusive exon (MXE) ####################################
+
+		if "MXE" in events:
+			logger.info("Searching mutually exclusive exons (MXE)....")
+			event_writer = EventWriter("MXE", ["pos_id", "exon_a", "exon_b", "intron_a1", "intron_a2", "intron_b1", "intron_b2", "strand", "gene_id", "gene_name", "label"], ["exon_a"], tmp_dir)
+			with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
+				futures = [executor.submit(mxe, gtf_chunk) for gtf_chunk in gtf_chunk_l]
+				logger.debug("Waiting for mutually exclusive exon search to complete....")
+				for output_l in search_results(futures, "MXE", event_store):
+					output_df = pd.DataFrame(
+						output_l,
+						columns = ["exon_a", "exon_b", "intron_a1", "intron_a2", "intron_b1", "intron_b2", "strand", "gene_id", "gene_name"]
+					)
+
+					intron_a1_df = split_coordinate(output_df["intron_a1"])
+					intron_b2_df = split_coordinate(output_df["intron_b2"])
+					output_df["pos_id"] = \
+						"MXE@" + \
+						intron_a1_df["chr"] + "@" + \
+						intron_a1_df["start"] + "@" + \
+						remove_chr(output_df["exon_a"]) + "@" + \
+						remove_chr(output_df["exon_b"]) + "@" + \
+						intron_b2_df["end"]
+
+					if reference_gtf_path:
+						output_df["label"] = annotation_label(output_df, {"intron_a1": gtf_ref_intron_set, "intron_a2": gtf_ref_intron_set, "intron_b1": gtf_ref_intron_set, "intron_b2": gtf_ref_intron_set})
+					else:
+						output_df["label"] = "annotated"
+					event_writer.add(output_df)
+			event_n = event_writer.write(os.path.join(output_dir, "EVENT_MXE.txt"), event_store)
+
+			logger.info(f"Mutually exclusive exon search completed. {event_n} events found.")
+
+		#################################### Retained intron (RI) ####################################
+
+		if "RI" in events:
+			logger.info("Searching retained intron (RI)....")
+			event_writer = EventWriter("RI", ["pos_id", "exon_a", "exon_b", "exon_c", "intron_a", "strand", "gene_id", "gene_name", "label"], ["exon_a"], tmp_dir)
+			with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
+				futures = [executor.submit(ri, gtf_chunk) for gtf_chunk in gtf_chunk_l]
+				logger.debug("Waiting for retained intron search to complete....")
+				for output_l in search_results(futures, "RI", event_store):
+					output_df = pd.DataFrame(
+						output_l,
+						columns = ["exon_a", "exon_b", "exon_c", "intron_a", "strand", "gene_id", "gene_name"]
+					)
+
+					output_df["pos_id"] = \
+						"RI@" + \
+						output_df["intron_a"].str.replace(":", "@")
+
+					if reference_gtf_path:
+						output_df["label"] = annotation_label(output_df, {"intron_a": gtf_ref_intron_set, "exon_c": gtf_ref_exon_set})
+					else:
+						output_df["label"] = "annotated"
+					event_writer.add(output_df)
+			event_n = event_writer.write(os.path.join(output_dir, "EVENT_RI.txt"), event_store)
+
+			logger.info(f"Retained intron search completed. {event_n} events found.")
+
+		#################################### Multiple skipped exons (MSE) ####################################
+
+		if "MSE" in events:
+			logger.info("Searching multiple skipped exons (MSE)....")
+			event_writer = EventWriter("MSE", ["pos_id", "mse_n", "exon", "intron", "strand", "gene_id", "gene_name", "label"], ["exon"], tmp_dir)
+			with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
+				futures = [executor.submit(mse, gtf_chunk, max_mse_n) for gtf_chunk in gtf_chunk_l]
+				logger.debug("Waiting for multiple skipped exons search to complete....")
+				for output_l in search_results(futures, "MSE", event_store):
+					output_df = pd.DataFrame(
+						output_l,
+						columns = ["exon", "intron", "mse_n", "strand", "gene_id", "gene_name"]
+					)
+
+					# pos_id = chromosome@exon_start-exon_end;exon_start-exon_end@exclusionintron_start-exclusionintron_end
+					exon_df = split_coordinate(output_df["exon"])
+					exc = output_df["intron"].str.rsplit(";", n = 1).str[-1]
+					output_df["pos_id"] = \
+						"MSE@" + \
+						exon_df["chr"] + "@" + \
+						remove_chr(output_df["exon"]) + "@" + \
+						remove_chr(exc)
+
+					# Check if the intron is annotated
+					if reference_gtf_path:
+						output_df["label"] = annotation_label(output_df, {"intron": gtf_ref_intron_set})
+					else:
+						output_df["label"] = "annotated"
+					event_writer.add(output_df)
+			event_n = event_writer.write(os.path.join(output_dir, "EVENT_MSE.txt"), event_store)
+
+			logger.info(f"Multiple skipped exons search completed. {event_n} events found.")
+
+		#################################### Alternative first exons (AFE) ####################################
+
+		if "AFE" in events:
+			logger.info("Searching alternative first exons (AFE)....")
+			event_writer = EventWriter("AFE", ["pos_id", "exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name", "label"], ["exon_a", "exon_b"], tmp_dir)
+			with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
+				futures = [executor.submit(afe, gtf_chunk) for gtf_chunk in gtf_chunk_l]
+				logger.debug("Waiting for alternative first exons search to complete....")
+				for output_l in search_results(futures, "AFE", event_store):
+					output_df = pd.DataFrame(
+						output_l,
+						columns = ["exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name"]
+					)
+
+					exon_a_df = split_coordinate(output_df["exon_a"])
+					output_df["pos_id"] = \
+						"AFE@" + \
+						exon_a_df["chr"] + "@" + \
+						remove_chr(output_df["intron_a"]) + "@" + \
+						remove_chr(output_df["intron_b"])
+
+					# Check if the intron is annotated
+					if reference_gtf_path:
+						output_df["label"] = annotation_label(output_df, {"intron_a": gtf_ref_intron_set, "intron_b": gtf_ref_intron_set})
+					else:
+						output_df["label"] = "annotated"
+					event_writer.add(output_df)
+			event_n = event_writer.write(os.path.join(output_dir, "EVENT_AFE.txt"), event_store)
+
+			logger.info(f"Alternative first exons search completed. {event_n} events found.")
+
+		################################### Alternative last exons (ALE) ###################################
+		if "ALE" in events:
+			logger.info("Searching alternative last exons (ALE)....")
+			event_writer = EventWriter("ALE", ["pos_id", "exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name", "label"], ["exon_a", "exon_b"], tmp_dir)
+			with concurrent.futures.ProcessPoolExecutor(max_workers=num_process) as executor:
+				futures = [executor.submit(ale, gtf_chunk) for gtf_chunk in gtf_chunk_l]
+				logger.debug("Waiting for alternative last exons search to complete....")
+				for output_l in search_results(futures, "ALE", event_store):
+					output_df = pd.DataFrame(
+						output_l,
+						columns = ["exon_a", "exon_b", "intron_a", "intron_b", "strand", "gene_id", "gene_name"]
+					)
+
+					exon_a_df = split_coordinate(output_df["exon_a"])
+					output_df["pos_id"] = \
+						"ALE@" + \
+						exon_a_df["chr"] + "@" + \
+						remove_chr(output_df["intron_a"]) + "@" + \
+						remove_chr(output_df["intron_b"])
+
+					# Check if the intron is annotated
+					if reference_gtf_path:
+						output_df["label"] = annotation_label(output_df, {"intron_a": gtf_ref_intron_set, "intron_b": gtf_ref_intron_set})
+					else:
+						output_df["label"] = "annotated"
+					event_writer.add(output_df)
+			event_n = event_writer.write(os.path.join(output_dir, "EVENT_ALE.txt"), event_store)
 
-	logger.info("Alternative last exons search completed.")
+			logger.info(f"Alternative last exons search completed. {event_n} events found.")
+	finally:
+		# Remove spilled event chunks also when an event search fails
+		shutil.rmtree(tmp_dir, ignore_errors = True)
 
 	#################################### Event search end #########################################
 
-	### Export
-	logger.info("Exporting results....")
-	os.makedirs(output_dir, exist_ok = True)
-	for EVENT in output_df_dict.keys():
-		logger.debug(f"Exporting {EVENT}....")
-		event_file = os.path.join(output_dir, f"EVENT_{EVENT}.txt")
-		output_df_dict[EVENT].to_csv(
-			event_file,
-			sep = "\t",
-			index = False
-		)
+	if event_store:
+		logger.debug("Saving event store....")
+		event_store.save()
 
 	logger.info("Event search completed.")
 
@@ -0,0 +1,111 @@
+import os
+import json
+import statistics
+import pysam
+from lib import cache
+import logging
+logger = logging.getLogger(__name__)
+
+# Number of reads sampled for the read length distribution
+LENGTH_READS = 1000
+
+def sidecar_path(bam_file):
+	"""
+	Returns the sidecar file caching the probe result of a BAM file.
+	"""
+	return f"{bam_file}.probe.json"
+
+def bam_key(bam_file):
+	"""
+	Returns the key identifying a version of a BAM file: its path, size and modification time.
+	"""
+	stat = os.stat(bam_file)
+	return {"path": os.path.abspath(bam_file), "size": stat.st_size, "mtime": stat.st_mtime_ns, "version": cache.shiba_version()}
+
+def scan_reads(bam_file, max_reads=100000):
+	"""
+	Reads the head of a BAM file for paired-end status and read lengths.
+	A BAM file is paired-end when at least 10 paired reads are found in the first `max_reads` records.
+	"""
+	paired_count = 0
+	total_checked = 0
+	length_dic = {}
+	with pysam.AlignmentFile(bam_file, "rb") as bam:
+		for read in bam.fetch(until_eof=True):
+			total_checked += 1
+			if read.is_paired:
+				paired_count += 1
+			if total_checked <= LENGTH_READS and not read.is_secondary and not read.is_supplementary:
+				length = read.infer_read_length() or read.query_length
+				if length:
+					length_dic[length] = length_dic.get(length, 0) + 1
+			if paired_count >= 10 and total_checked >= LENGTH_READS:
+				break
+			if total_checked >= max_reads:
+				break
+	logger.debug(f"Checked {total_checked} reads in {bam_file}. Paired count: {paired_count}")
+	length_l = [length for length, count in length_dic.items() for _ in range(count)]
+	return {
+		"paired": paired_count >= 10,
+		"read_length": {
+			"min": min(length_l) if length_l else 0,
+			"median": statistics.median(length_l) if length_l else 0,
+			"max": max(length_l) if length_l else 0,
+			"distribution": [[length, count] for length, count in sorted(length_dic.items())]
+		}
+	}
+
+def read_index(bam_file):
+	"""
+	Reads chromosome naming from the header and mapped-read totals from the index of a BAM file.
+	Totals are None when the BAM file is not indexed.
+	"""
+	with pysam.AlignmentFile(bam_file, "rb") as bam:
+		references = list(bam.references)
+		indexed = bam.has_index()
+		mapped = unmapped = None
+		if indexed:
+			index_stat_l = bam.get_index_statistics()
+			mapped = sum(stat.mapped for stat in index_stat_l)
+			unmapped = sum(stat.unmapped for stat in index_stat_l) + bam.nocoordinate
+	return {
+		"references": len(references),
+		"chr_prefix": any(reference.startswith("chr") for reference in references),
+		"indexed": indexed,
+		"mapped": mapped,
+		"unmapped": unmapped
+	}
+
+def probe(bam_file, max_reads=100000):
+	"""
+	Collects metadata of a BAM file: paired-end status, read length distribution, chromosome naming,
+	index presence and mapped-read totals. The result of reading the BAM file is cached in a sidecar
+	file next to it, keyed by the path, size and modification time of the BAM file, so that each
+	stage of a run reuses it. Index information is read every time since indexes can be created later.
+
+	Returns:
+		dict: Metadata of the BAM file.
+	"""
+	key = bam_key(bam_file)
+	path = sidecar_path(bam_file)
+	result = None
+	try:
+		with open(path, "r") as f:
+			cached = json.load(f)
+		if cached.get("key") == key and cached.get("max_reads") == max_reads:
+			result = cached["result"]
+			logger.debug(f"Loaded BAM probe from {path}")
+	except (OSError, ValueError, KeyError):
+		pass
+	if result is None:
+		result = scan_reads(bam_file, max_reads)
+		try:
+			tmp_path = f"{path}.{os.getpid()}.tmp"
+			with open(tmp_path, "w") as f:
+				json.dump({"key": key, "max_reads": max_reads, "result": result}, f)
+			os.replace(tmp_path, path)
+		except OSError as e:
+			logger.debug(f"Failed to save BAM probe to {path}: {e}")
+	result = dict(result)
+	result.update(read_index(bam_file))
+	return result
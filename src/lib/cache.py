@@ -0,0 +1,87 @@
+import os
+import hashlib
+import mmap
+import pickle
+import logging
+logger = logging.getLogger(__name__)
+
+def shiba_version():
+	"""
+	Returns the Shiba version written in the VERSION file of the repository.
+	"""
+	version_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, os.pardir, "VERSION")
+	try:
+		with open(version_file, "r") as f:
+			return f.read().strip()
+	except FileNotFoundError:
+		logger.debug(f"VERSION file not found: {version_file}")
+		return "unknown"
+
+def file_hash(path, chunk_size=1 << 20):
+	"""
+	Computes the SHA-256 hash of a file's content, reading it in chunks.
+	"""
+	sha256 = hashlib.sha256()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(chunk_size), b""):
+			sha256.update(chunk)
+	return sha256.hexdigest()
+
+def cache_path(cache_dir, name, path):
+	"""
+	Returns the cache file for an object built from `path`, keyed by the Shiba version and the content hash of `path`.
+	"""
+	return os.path.join(cache_dir, f"{name}_{shiba_version()}_{file_hash(path)}.pkl")
+
+def load(path):
+	"""
+	Loads a cached object by memory-mapping the cache file.
+	Returns None if the cache file does not exist or cannot be read.
+	"""
+	if not os.path.isfile(path):
+		return None
+	try:
+		with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+			obj = pickle.loads(m)
+	except (OSError, ValueError, EOFError, pickle.UnpicklingError) as e:
+		logger.warning(f"Failed to load cache file {path}: {e}")
+		return None
+	# Mark as recently used
+	os.utime(path)
+	return obj
+
+def save(obj, path):
+	"""
+	Saves an object to a cache file. The file is written to a temporary path first and then renamed,
+	so that concurrent runs never read a partially written cache.
+	"""
+	os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+	tmp_path = f"{path}.{os.getpid()}.tmp"
+	with open(tmp_path, "wb") as f:
+		pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+	os.replace(tmp_path, path)
+	logger.debug(f"Saved cache file: {path}")
+
+def evict(cache_dir, max_size, keep=()):
+	"""
+	Removes the least recently used cache files until the total size of the cache directory is at most `max_size` bytes.
+	Files listed in `keep` are never removed.
+	"""
+	keep = {os.path.abspath(path) for path in keep}
+	cache_files = []
+	for file in os.listdir(cache_dir):
+		path = os.path.abspath(os.path.join(cache_dir, file))
+		if file.endswith(".pkl") and os.path.isfile(path):
+			cache_files.append((os.path.getmtime(path), os.path.getsize(path), path))
+	total_size = sum(size for _, size, _ in cache_files)
+	removed = []
+	for _, size, path in sorted(cache_files):
+		if total_size <= max_size:
+			break
+		if path in keep:
+			continue
+		os.remove(path)
+		total_size -= size
+		removed.append(path)
+		logger.debug(f"Evicted cache file: {path}")
+	return removed
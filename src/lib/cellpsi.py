@@ -0,0 +1,215 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import logging
+logger = logging.getLogger(__name__)
+
+# Junction columns of inclusion and exclusion isoforms for each event type.
+# Columns may hold ";"-separated junctions. For MSE, the last junction of "intron" is the exclusion junction.
+EVENT_JUNCTIONS = {
+	"SE": (["intron_a", "intron_b"], ["intron_c"]),
+	"FIVE": (["intron_a"], ["intron_b"]),
+	"THREE": (["intron_a"], ["intron_b"]),
+	"MXE": (["intron_a1", "intron_a2"], ["intron_b1", "intron_b2"]),
+	"MSE": (["intron"], []),
+	"AFE": (["intron_a"], ["intron_b"]),
+	"ALE": (["intron_a"], ["intron_b"]),
+}
+
+# Event annotations kept for each event in per-cell outputs
+EVENT_ANNOTATIONS = ["event_id", "event_type", "pos_id", "strand", "gene_id", "gene_name", "label"]
+
+def star_junction_id(junction_id):
+	"""
+	Converts junction IDs of events (last exon base to first exon base) to STARsolo junction IDs
+	(first to last intron base), as in features.tsv of SJ directories.
+
+	Args:
+		junction_id (pd.Series): Junction IDs of events.
+
+	Returns:
+		pd.Series: STARsolo junction IDs.
+	"""
+	coordinate = junction_id.str.rsplit(":", n=1, expand=True)
+	position = coordinate[1].str.split("-", expand=True).astype(np.int64)
+	return coordinate[0] + ":" + (position[0] + 1).astype(str) + "-" + (position[1] - 1).astype(str)
+
+def event_junctions(event_df_dict):
+	"""
+	Lists junctions of events as weights of inclusion and exclusion read counts.
+	The read count of an isoform is the mean of its junctions as in shibalib, so each junction of an isoform
+	with n junctions has a weight of 1/n. Events are numbered in the order of event types and event files.
+
+	Args:
+		event_df_dict (dict): DataFrames of events by event type.
+
+	Returns:
+		pd.DataFrame: Event annotations.
+		pd.DataFrame: Junctions of events with columns event (event number), junction (STARsolo ID), inclusion (bool) and weight.
+	"""
+	annotation_list, junction_list = [], []
+	offset = 0
+	for event_type, event_df in event_df_dict.items():
+		if event_type not in EVENT_JUNCTIONS:
+			logger.warning(f"{event_type} events are not supported for per-cell PSI. Skipping {event_type} events.")
+			continue
+		event_df = event_df.reset_index(drop=True)
+		annotation_df = event_df.reindex(columns=EVENT_ANNOTATIONS)
+		annotation_df["event_type"] = event_type
+		annotation_list.append(annotation_df)
+		inclusion_columns, exclusion_columns = EVENT_JUNCTIONS[event_type]
+		for columns, inclusion in [(inclusion_columns, True), (exclusion_columns, False)]:
+			if not columns:
+				continue
+			junction_df = pd.concat(
+				[pd.DataFrame({"event": np.arange(len(event_df)), "junction": event_df[column].str.split(";")}) for column in columns]
+			).explode("junction")
+			junction_df["inclusion"] = inclusion
+			if event_type == "MSE":
+				# The last junction skips all exons
+				last = ~junction_df["event"].duplicated(keep="last")
+				junction_df.loc[last.to_numpy(), "inclusion"] = False
+			junction_list.append(junction_df.assign(event=junction_df["event"] + offset))
+		offset += len(event_df)
+	if not annotation_list:
+		return pd.DataFrame(columns=EVENT_ANNOTATIONS), pd.DataFrame(columns=["event", "junction", "inclusion", "weight"])
+	annotation_df = pd.concat(annotation_list, ignore_index=True)
+	junction_df = pd.concat(junction_list, ignore_index=True).dropna(subset=["junction"])
+	junction_df = junction_df[junction_df["junction"] != ""]
+	junction_df["junction"] = star_junction_id(junction_df["junction"])
+	junction_df["weight"] = 1 / junction_df.groupby(["event", "inclusion"])["junction"].transform("size")
+	return annotation_df, junction_df.reset_index(drop=True)
+
+def event_weight_matrix(junction_df, sj_index, event_n, inclusion):
+	"""
+	Builds a sparse event x junction matrix of the weights of inclusion or exclusion junctions.
+	Junctions not detected in the SJ directory count as zero reads.
+	"""
+	junction_df = junction_df[junction_df["inclusion"] == inclusion]
+	junction_pos = pd.Index(sj_index).get_indexer(junction_df["junction"])
+	found = junction_pos >= 0
+	return sparse.csr_matrix(
+		(junction_df["weight"].to_numpy(np.float32)[found], (junction_df["event"].to_numpy(np.int64)[found], junction_pos[found])),
+		shape=(event_n, len(sj_index))
+	)
+
+def cell_counts(count_matrix, sj_index, junction_df, event_n):
+	"""
+	Computes inclusion and exclusion read counts of every cell and event from a sparse junction x cell matrix
+	with one sparse product for each isoform.
+
+	Args:
+		count_matrix (sparse matrix): Junction x cell read counts.
+		sj_index (pd.Index): STARsolo junction IDs of the rows of count_matrix.
+		junction_df (pd.DataFrame): Junctions of events from event_junctions.
+		event_n (int): Number of events.
+
+	Returns:
+		sparse.csr_matrix: Cell x event inclusion read counts.
+		sparse.csr_matrix: Cell x event exclusion read counts.
+	"""
+	count_matrix = sparse.csr_matrix(count_matrix, dtype=np.float32)
+	inclusion = (event_weight_matrix(junction_df, sj_index, event_n, True) @ count_matrix).T.tocsr()
+	exclusion = (event_weight_matrix(junction_df, sj_index, event_n, False) @ count_matrix).T.tocsr()
+	inclusion.eliminate_zeros()
+	exclusion.eliminate_zeros()
+	return inclusion, exclusion
+
+def cell_psi(inclusion, exclusion, minimum_reads=1):
+	"""
+	Computes PSI of cell x event pairs where the inclusion or exclusion read count reaches `minimum_reads`,
+	following the coverage rule of shibalib. Only covered pairs are stored, so a PSI of zero is stored
+	explicitly and pairs that are not stored have no PSI.
+
+	Args:
+		inclusion (sparse.csr_matrix): Cell x event inclusion read counts.
+		exclusion (sparse.csr_matrix): Cell x event exclusion read counts.
+		minimum_reads (float): Minimum read count of either isoform.
+
+	Returns:
+		sparse.csr_matrix: Cell x event PSI.
+	"""
+	total = (inclusion + exclusion).tocsr()
+	total.sort_indices()
+	inclusion = inclusion.tocsr()
+	inclusion.sort_indices()
+	# Align inclusion counts to the stored pairs of the total, which contain those of the inclusion
+	row = np.repeat(np.arange(total.shape[0], dtype=np.int64), np.diff(total.indptr))
+	inclusion_row = np.repeat(np.arange(inclusion.shape[0], dtype=np.int64), np.diff(inclusion.indptr))
+	key = row * total.shape[1] + total.indices
+	inclusion_key = inclusion_row * total.shape[1] + inclusion.indices
+	inclusion_value = np.zeros(total.nnz, dtype=total.data.dtype)
+	inclusion_value[np.searchsorted(key, inclusion_key)] = inclusion.data
+	exclusion_value = total.data - inclusion_value
+	covered = ((inclusion_value >= minimum_reads) | (exclusion_value >= minimum_reads)) & (total.data > 0)
+	indptr = np.concatenate([[0], np.cumsum(np.bincount(row[covered], minlength=total.shape[0]))])
+	return sparse.csr_matrix(
+		(inclusion_value[covered] / total.data[covered], total.indices[covered], indptr),
+		shape=total.shape
+	)
+
+def covered(psi):
+	"""
+	Returns positions of cells and events with at least one covered pair.
+	"""
+	cell_pos = np.flatnonzero(psi.getnnz(axis=1))
+	event_pos = np.flatnonzero(psi.getnnz(axis=0))
+	return cell_pos, event_pos
+
+def write_npz(output_dir, psi, inclusion, exclusion, cell_df, event_df):
+	"""
+	Writes per-cell PSI and read counts as sparse .npz files with cell and event tables.
+	"""
+	os.makedirs(output_dir, exist_ok=True)
+	sparse.save_npz(os.path.join(output_dir, "psi.npz"), psi)
+	sparse.save_npz(os.path.join(output_dir, "inclusion.npz"), inclusion)
+	sparse.save_npz(os.path.join(output_dir, "exclusion.npz"), exclusion)
+	cell_df.to_csv(os.path.join(output_dir, "cells.tsv"), sep="\t", index=False)
+	event_df.to_csv(os.path.join(output_dir, "events.tsv"), sep="\t", index=False)
+
+def dense_psi(psi):
+	"""
+	Converts a sparse PSI matrix to a dense float32 array with NaN where PSI is not stored.
+	"""
+	psi = psi.tocoo()
+	psi_dense = np.full(psi.shape, np.nan, dtype=np.float32)
+	psi_dense[psi.row, psi.col] = psi.data
+	return psi_dense
+
+def group_psi(junc_df, event_df_dict, minimum_reads=1):
+	"""
+	Computes PSI of every sample or group in a junction file and every event with the sparse products used for cells.
+	Junction IDs of the junction file are converted like those of events, so that the two match.
+
+	Args:
+		junc_df (pd.DataFrame): Junction read counts with columns chr, start, end, ID and one column for each sample or group.
+		event_df_dict (dict): DataFrames of events by event type.
+		minimum_reads (float): Minimum read count of either isoform.
+
+	Returns:
+		sparse.csr_matrix: Group x event PSI.
+		sparse.csr_matrix: Group x event inclusion read counts.
+		sparse.csr_matrix: Group x event exclusion read counts.
+		pd.DataFrame: Event annotations.
+	"""
+	group_list = [col for col in junc_df.columns if col not in ["chr", "start", "end", "ID"]]
+	event_df, junction_df = event_junctions(event_df_dict)
+	sj_index = pd.Index(star_junction_id(junc_df["ID"]))
+	count_matrix = sparse.csr_matrix(junc_df[group_list].to_numpy(dtype=np.float32))
+	inclusion, exclusion = cell_counts(count_matrix, sj_index, junction_df, len(event_df))
+	psi = cell_psi(inclusion, exclusion, minimum_reads)
+	return psi, inclusion, exclusion, event_df
+
+def write_h5ad(output_path, X, obs_df, var_df, layers=None):
+	"""
+	Writes a matrix as an AnnData h5ad file with observation and variable annotations indexed by name.
+	Matrices are gzip-compressed, which stores them in chunks, so the file can be opened lazily
+	with anndata.read_h5ad(output_path, backed="r"). Requires anndata.
+	"""
+	import anndata
+	def annotation(df):
+		# Text annotations are written as strings, numeric ones as they are
+		return df.apply(lambda col: col if pd.api.types.is_numeric_dtype(col) else col.fillna("").astype(str))
+	adata = anndata.AnnData(X=X, obs=annotation(obs_df), var=annotation(var_df), layers=layers)
+	adata.write_h5ad(output_path, compression="gzip")
@@ -0,0 +1,369 @@
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+from scipy.special import gammaln, polygamma
+import statsmodels.stats.multitest as multitest
+from statsmodels.nonparametric.smoothers_lowess import lowess
+import logging
+logger = logging.getLogger(__name__)
+
+# Defaults of DESeq2
+MIN_DISP = 1e-8
+MIN_MU = 0.5
+OUTLIER_SD = 2
+LFC_RIDGE = 1e-6
+FILTER_ALPHA = 0.1
+
+# Number of gene x sample values processed at once
+CHUNK_VALUES = 2000000
+
+def gene_chunks(gene_n, sample_n):
+	"""
+	Yields slices of genes so that each chunk has about CHUNK_VALUES values.
+	"""
+	chunksize = max(1, CHUNK_VALUES // max(sample_n, 1))
+	for start in range(0, gene_n, chunksize):
+		yield slice(start, min(start + chunksize, gene_n))
+
+def size_factors(counts):
+	"""
+	Estimates size factors of samples by the median-of-ratios method, using genes with reads in every sample.
+
+	Args:
+		counts (np.ndarray): Gene x sample read counts.
+
+	Returns:
+		np.ndarray: Size factors.
+	"""
+	with np.errstate(divide="ignore"):
+		log_counts = np.log(counts)
+	log_geomeans = log_counts.mean(axis=1)
+	use = np.isfinite(log_geomeans)
+	if not use.any():
+		raise ValueError("Every gene has zero reads in at least one sample, so size factors cannot be estimated.")
+	return np.exp(np.median(log_counts[use] - log_geomeans[use, None], axis=0))
+
+def nb_loglik(y, mu, log_alpha, X, log_prior_mean=None, prior_var=None):
+	"""
+	Cox-Reid adjusted negative binomial log-likelihood of dispersions of genes, up to terms not depending on the dispersion,
+	with an optional log-normal prior.
+
+	Args:
+		y (np.ndarray): Gene x sample read counts.
+		mu (np.ndarray): Gene x sample expected read counts.
+		log_alpha (np.ndarray): Log dispersions of genes.
+		X (np.ndarray): Sample x coefficient design matrix.
+		log_prior_mean (np.ndarray): Log dispersions of the prior of genes, or None for no prior.
+		prior_var (float): Variance of the prior of log dispersions.
+
+	Returns:
+		np.ndarray: Log-likelihood of genes.
+	"""
+	alpha = np.exp(log_alpha)[:, None]
+	inverse = 1 / alpha
+	loglik = np.sum(gammaln(y + inverse) - gammaln(inverse) - y * np.log(mu + inverse) - inverse * np.log1p(mu * alpha), axis=1)
+	w = 1 / (1 / mu + alpha)
+	_, logdet = np.linalg.slogdet(np.einsum("gm,mp,mq->gpq", w, X, X))
+	loglik -= 0.5 * logdet
+	if log_prior_mean is not None:
+		loglik -= 0.5 * (log_alpha - log_prior_mean) ** 2 / prior_var
+	return loglik
+
+def fit_dispersion(y, mu, X, max_disp, log_prior_mean=None, prior_var=None, grid_n=41, refine_n=3):
+	"""
+	Maximizes nb_loglik over log dispersions of all genes at once, on a grid that is refined around the maximum of each gene.
+
+	Returns:
+		np.ndarray: Dispersions of genes within MIN_DISP and `max_disp`.
+	"""
+	low, high = np.log(MIN_DISP), np.log(max_disp)
+	grid = np.linspace(low, high, grid_n)
+	step = grid[1] - grid[0]
+	center = np.zeros(len(y))
+	offset_l = grid
+	for _ in range(refine_n + 1):
+		log_alpha_l = np.clip(center[:, None] + offset_l[None, :], low, high)
+		loglik_l = np.stack([
+			nb_loglik(y, mu, log_alpha_l[:, i], X, log_prior_mean, prior_var) for i in range(len(offset_l))
+		], axis=1)
+		center = log_alpha_l[np.arange(len(y)), np.nanargmax(loglik_l, axis=1)]
+		offset_l = np.linspace(-step, step, 21)
+		step = offset_l[1] - offset_l[0]
+	return np.clip(np.exp(center), MIN_DISP, max_disp)
+
+def linear_model_mu(normalized, X):
+	"""
+	Returns least-squares fits of normalized counts, which are group means for designs of groups.
+	"""
+	hat = X @ np.linalg.pinv(X)
+	return normalized @ hat.T
+
+def gene_dispersions(counts, sf, X):
+	"""
+	Estimates dispersions of genes by maximizing the Cox-Reid adjusted likelihood,
+	with expected counts from group means of normalized counts.
+
+	Returns:
+		np.ndarray: Gene-wise dispersions.
+		np.ndarray: Gene x sample expected read counts.
+	"""
+	m, p = X.shape
+	max_disp = max(10, m)
+	normalized = counts / sf
+	mu = np.maximum(linear_model_mu(normalized, X) * sf, MIN_MU)
+	disp = np.empty(len(counts))
+	for rows in gene_chunks(len(counts), m):
+		disp[rows] = fit_dispersion(counts[rows], mu[rows], X, max_disp)
+	return disp, mu
+
+def parametric_trend(base_mean, disp):
+	"""
+	Fits the dispersion trend a0 + a1 / baseMean with a gamma-family GLM of identity link,
+	iteratively dropping genes far from the trend.
+
+	Returns:
+		np.ndarray: Coefficients a0 and a1, or None if the fit fails.
+	"""
+	coefs = np.array([0.1, 1.0])
+	A = np.column_stack([np.ones(len(base_mean)), 1 / base_mean])
+	for _ in range(10):
+		residual = disp / (A @ coefs)
+		good = (residual > 1e-4) & (residual < 15)
+		old_coefs = coefs
+		# Iteratively reweighted least squares of the gamma GLM
+		fit = coefs
+		for _ in range(25):
+			fitted = A[good] @ fit
+			if np.any(fitted <= 0):
+				return None
+			w = 1 / fitted ** 2
+			fit_new = np.linalg.solve((A[good] * w[:, None]).T @ A[good], (A[good] * w[:, None]).T @ disp[good])
+			converged = np.allclose(fit_new, fit, rtol=1e-10, atol=0)
+			fit = fit_new
+			if converged:
+				break
+		coefs = fit
+		if not np.all(coefs > 0):
+			return None
+		if np.sum(np.log(coefs / old_coefs) ** 2) < 1e-6:
+			return coefs
+	return None
+
+def map_dispersions(counts, mu, X, base_mean, disp_gene):
+	"""
+	Shrinks gene-wise dispersions toward the trend with a log-normal prior (maximum a posteriori).
+	Genes whose dispersions are far above the trend keep their gene-wise dispersions.
+
+	Returns:
+		np.ndarray: Final dispersions.
+	"""
+	m, p = X.shape
+	max_disp = max(10, m)
+	use = disp_gene > 100 * MIN_DISP
+	coefs = parametric_trend(base_mean[use], disp_gene[use])
+	if coefs is None:
+		logger.warning("The parametric dispersion trend did not converge. Using the mean of gene-wise dispersions instead.")
+		use_mean = disp_gene > 10 * MIN_DISP
+		disp_fit = np.full(len(disp_gene), stats.trim_mean(disp_gene[use_mean], 0.001))
+	else:
+		logger.debug(f"Dispersion trend: {coefs[0]} + {coefs[1]} / baseMean")
+		disp_fit = coefs[0] + coefs[1] / base_mean
+	residual = np.log(disp_gene) - np.log(disp_fit)
+	var_log_disp = stats.median_abs_deviation(residual[use], scale="normal") ** 2
+	prior_var = max(var_log_disp - polygamma(1, (m - p) / 2), 0.25)
+	disp_map = np.empty(len(counts))
+	for rows in gene_chunks(len(counts), m):
+		disp_map[rows] = fit_dispersion(counts[rows], mu[rows], X, max_disp, np.log(disp_fit[rows]), prior_var)
+	outlier = np.log(disp_gene) > np.log(disp_fit) + OUTLIER_SD * np.sqrt(var_log_disp)
+	return np.where(outlier, disp_gene, disp_map)
+
+def fit_glm(counts, sf, X, disp, maxit=100):
+	"""
+	Fits negative binomial GLMs of all genes at once by iteratively reweighted least squares,
+	with the small ridge penalty of DESeq2 on log2 fold changes.
+
+	Returns:
+		np.ndarray: Gene x coefficient estimates in natural log scale.
+		np.ndarray: Gene x coefficient standard errors in natural log scale.
+		np.ndarray: Gene x sample expected read counts.
+		np.ndarray: Gene x sample diagonal of the hat matrix.
+	"""
+	m, p = X.shape
+	ridge = np.diag(np.full(p, LFC_RIDGE / np.log(2) ** 2))
+	alpha = disp[:, None]
+	beta = np.log(counts / sf + 0.1) @ np.linalg.pinv(X).T
+	deviance = np.full(len(counts), np.inf)
+	active = np.ones(len(counts), dtype=bool)
+	for _ in range(maxit):
+		mu = np.maximum(sf * np.exp(beta[active] @ X.T), MIN_MU)
+		w = mu / (1 + alpha[active] * mu)
+		z = np.log(mu / sf) + (counts[active] - mu) / mu
+		xtwx = np.einsum("gm,mp,mq->gpq", w, X, X) + ridge
+		beta[active] = np.linalg.solve(xtwx, np.einsum("gm,mp->gp", w * z, X)[:, :, None])[:, :, 0]
+		mu = np.maximum(sf * np.exp(beta[active] @ X.T), MIN_MU)
+		size = 1 / alpha[active]
+		new_deviance = -2 * np.sum(stats.nbinom.logpmf(counts[active], size, size / (size + mu)), axis=1)
+		converged = np.abs(new_deviance - deviance[active]) / (np.abs(new_deviance) + 0.1) < 1e-8
+		deviance[active] = new_deviance
+		active[np.flatnonzero(active)[converged]] = False
+		if not active.any():
+			break
+	mu = np.maximum(sf * np.exp(beta @ X.T), MIN_MU)
+	w = mu / (1 + alpha * mu)
+	xtwx = np.einsum("gm,mp,mq->gpq", w, X, X)
+	xtwx_inv = np.linalg.inv(xtwx + ridge)
+	sigma = xtwx_inv @ xtwx @ xtwx_inv
+	se = np.sqrt(np.diagonal(sigma, axis1=1, axis2=2))
+	hat = w * np.einsum("mp,gpq,mq->gm", X, xtwx_inv, X)
+	return beta, se, mu, hat
+
+def robust_dispersions(normalized, cell):
+	"""
+	Estimates dispersions of genes from trimmed variances within cells (groups) of at least three samples,
+	as used for Cook's distances.
+	"""
+	variance_l = []
+	for c in np.unique(cell):
+		cell_counts = normalized[:, cell == c]
+		n = cell_counts.shape[1]
+		if n < 3:
+			continue
+		trim, scale = (1 / 3, 2.04) if n <= 3.5 else (1 / 4, 1.86) if n <= 23.5 else (1 / 8, 1.51)
+		cell_mean = stats.trim_mean(cell_counts, trim, axis=1)
+		variance_l.append(scale * stats.trim_mean((cell_counts - cell_mean[:, None]) ** 2, trim, axis=1))
+	mean = normalized.mean(axis=1)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		return np.maximum((np.max(variance_l, axis=0) - mean) / mean ** 2, 0.04)
+
+def cooks_outliers(counts, sf, X, mu, hat):
+	"""
+	Flags genes with a Cook's distance above the 0.99 quantile of F(p, m - p) in a sample of a cell with at least three samples,
+	unless at least three samples have more reads than the outlier.
+
+	Returns:
+		np.ndarray: Whether genes are outliers.
+	"""
+	m, p = X.shape
+	_, cell, cell_n = np.unique(X, axis=0, return_inverse=True, return_counts=True)
+	cell = cell.ravel()
+	replicated = cell_n[cell] >= 3
+	if not replicated.any():
+		return np.zeros(len(counts), dtype=bool)
+	disp = robust_dispersions(counts / sf, cell)
+	cooks = (counts - mu) ** 2 / (mu + disp[:, None] * mu ** 2) / p * hat / (1 - hat) ** 2
+	outlier = cooks[:, replicated].max(axis=1) > stats.f.ppf(0.99, p, m - p)
+	for gene in np.flatnonzero(outlier):
+		out_count = counts[gene, np.argmax(cooks[gene])]
+		if np.sum(counts[gene] > out_count) >= 3:
+			outlier[gene] = False
+	return outlier
+
+def bh(pvalue):
+	"""
+	Adjusts P-values by the Benjamini-Hochberg method, ignoring NaN.
+	"""
+	padj = np.full(len(pvalue), np.nan)
+	tested = ~np.isnan(pvalue)
+	if tested.any():
+		padj[tested] = multitest.multipletests(pvalue[tested], method="fdr_bh")[1]
+	return padj
+
+def filtered_padj(base_mean, pvalue, alpha=FILTER_ALPHA):
+	"""
+	Adjusts P-values after independent filtering of genes by baseMean. The baseMean quantile is chosen as in DESeq2,
+	the first one whose number of rejections at `alpha` is close to the maximum of a lowess fit.
+	Genes below the quantile have no adjusted P-value.
+	"""
+	lower = np.mean(base_mean == 0)
+	theta = np.linspace(lower, 0.95 if lower < 0.95 else 1, 50)
+	cutoff = np.quantile(base_mean, theta)
+	padj_l = []
+	for value in cutoff:
+		use = base_mean >= value
+		padj = np.full(len(pvalue), np.nan)
+		padj[use] = bh(pvalue[use])
+		padj_l.append(padj)
+	rejection = np.array([np.sum(padj < alpha) for padj in padj_l])
+	j = 0
+	if rejection.max() > 10:
+		fit = lowess(rejection, theta, frac=1 / 5, it=3, delta=0.01 * (theta[-1] - theta[0]), return_sorted=False)
+		residual = rejection[rejection > 0] - fit[rejection > 0]
+		threshold = fit.max() - np.sqrt(np.mean(residual ** 2))
+		if np.any(rejection > threshold):
+			j = np.flatnonzero(rejection > threshold)[0]
+	logger.debug(f"Independent filtering of genes below the {theta[j]:.3f} quantile of baseMean ({cutoff[j]:.3f})")
+	return padj_l[j]
+
+def deseq(count_df, condition, ref_group, alt_group, min_count=6):
+	"""
+	Tests differential expression of genes between two groups with a negative binomial GLM following the defaults of DESeq2:
+	median-of-ratios size factors, gene-wise dispersions shrunk toward a parametric trend, Wald test,
+	Cook's distance outlier filtering, and Benjamini-Hochberg adjustment after independent filtering.
+	Outlier counts are not replaced by refitting, and the prior variance of dispersions is not simulated for fewer than
+	four residual degrees of freedom.
+
+	Args:
+		count_df (pd.DataFrame): Gene x sample read counts indexed by gene ID.
+		condition (pd.Series): Group of each sample, indexed by sample name.
+		ref_group (str): Reference group.
+		alt_group (str): Alternative group.
+		min_count (int): Genes with no more than `min_count` reads in total are not tested.
+
+	Returns:
+		pd.DataFrame: Columns baseMean, log2FoldChange, lfcSE, stat, pvalue and padj indexed by gene ID.
+	"""
+	condition = condition[condition.isin([ref_group, alt_group])]
+	samples = [sample for sample in count_df.columns if sample in condition.index]
+	condition = condition[samples]
+	if (condition == ref_group).sum() < 1 or (condition == alt_group).sum() < 1:
+		raise ValueError(f"No samples of {ref_group} or {alt_group} found in the count table.")
+	counts = count_df[samples].to_numpy(dtype=np.float64)
+	keep = counts.sum(axis=1) > min_count
+	counts = counts[keep]
+	X = np.column_stack([np.ones(len(samples)), (condition == alt_group).to_numpy(dtype=np.float64)])
+	m, p = X.shape
+	if m <= p:
+		raise ValueError("The number of samples must be larger than the number of groups.")
+	logger.debug(f"Testing {len(counts)} genes in {m} samples")
+
+	sf = size_factors(counts)
+	logger.debug(f"Size factors: {dict(zip(samples, sf.round(4)))}")
+	base_mean = (counts / sf).mean(axis=1)
+	disp_gene, mu = gene_dispersions(counts, sf, X)
+	disp = map_dispersions(counts, mu, X, base_mean, disp_gene)
+	beta = np.empty((len(counts), p))
+	se = np.empty((len(counts), p))
+	outlier = np.empty(len(counts), dtype=bool)
+	for rows in gene_chunks(len(counts), m):
+		beta[rows], se[rows], mu_fit, hat = fit_glm(counts[rows], sf, X, disp[rows])
+		outlier[rows] = cooks_outliers(counts[rows], sf, X, mu_fit, hat)
+	log2_fold_change = beta[:, 1] / np.log(2)
+	lfc_se = se[:, 1] / np.log(2)
+	stat = log2_fold_change / lfc_se
+	pvalue = 2 * stats.norm.sf(np.abs(stat))
+	pvalue[outlier] = np.nan
+	logger.debug(f"{outlier.sum()} genes with Cook's distance outliers")
+	padj = filtered_padj(base_mean, pvalue)
+	return pd.DataFrame({
+		"baseMean": base_mean,
+		"log2FoldChange": log2_fold_change,
+		"lfcSE": lfc_se,
+		"stat": stat,
+		"pvalue": pvalue,
+		"padj": padj
+	}, index=count_df.index[keep])
+
+def write_deg(result_df, output_file, gene_name=None):
+	"""
+	Writes results of deseq in the format of DEG.txt from deseq2.R, ordered by padj with missing values last.
+
+	Args:
+		result_df (pd.DataFrame): Results of deseq.
+		output_file (str): Output file.
+		gene_name (pd.Series): Gene names indexed by gene ID, or None to omit the gene_name column.
+	"""
+	deg_df = result_df.rename_axis("gene_id").reset_index()
+	if gene_name is not None:
+		deg_df.insert(1, "gene_name", deg_df["gene_id"].map(gene_name))
+	deg_df = deg_df.sort_values("padj", kind="stable", na_position="last")
+	deg_df.to_csv(output_file, sep="\t", index=False, na_rep="NA", float_format="%.15g")
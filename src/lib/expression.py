@@ -1,51 +1,352 @@
+import bisect
+import re
+import sys
+from collections import Counter
+import numpy as np
+import pandas as pd
 import pysam
+from lib import bamprobe, junction
 import logging
 logger = logging.getLogger(__name__)
 
 def is_paired_end(bam_file, max_reads=100000):
 	"""
 	Determine if a BAM file is paired-end using pysam only.
-	Reads up to `max_reads` records to check for any paired read.
+	Reads up to `max_reads` records to check for any paired read. The result is cached by lib.bamprobe.
 	"""
-	paired_count = 0
-	total_checked = 0
+	return bamprobe.probe(bam_file, max_reads)["paired"]
+
+def read_counts(counts_file, samples):
+	"""
+	Reads a featureCounts output file of one or more BAM files.
+
+	Args:
+		counts_file (str): featureCounts output file.
+		samples (list): Sample names in the order of the BAM files given to featureCounts.
+
+	Returns:
+		pd.DataFrame: Gene lengths and read counts of the samples, indexed by gene_id.
+	"""
+	count_df = pd.read_csv(counts_file, sep="\t", skiprows=1, dtype={"Geneid": str})
+	count_df = count_df.drop(columns=["Chr", "Start", "End", "Strand"])
+	count_df.columns = ["gene_id", "Length"] + list(samples)
+	return count_df.set_index("gene_id")
+
+def merge_counts(count_df_list):
+	"""
+	Merges count tables from read_counts with one column-wise concat on the union of gene IDs.
+	Genes missing from a table have no reads in its samples.
+
+	Args:
+		count_df_list (list): DataFrames from read_counts.
+
+	Returns:
+		pd.DataFrame: Columns gene_id, Length and one column for each sample, sorted by gene_id.
+	"""
+	length = pd.concat([count_df["Length"] for count_df in count_df_list], axis=1).max(axis=1)
+	count_all_df = pd.concat([count_df.drop(columns=["Length"]) for count_df in count_df_list], axis=1)
+	count_all_df = count_all_df.fillna(0).astype(np.int64)
+	count_all_df.insert(0, "Length", length.astype(np.int64))
+	count_all_df = count_all_df.rename_axis("gene_id").reset_index()
+	return count_all_df.sort_values("gene_id")
+
+def flatten_exons(exon_l):
+	"""
+	Flattens exons of genes on a chromosome into sorted, disjoint segments labeled with the genes whose exons cover them.
+	Adjacent segments covered by the same genes are merged.
+
+	Args:
+		exon_l (list): Tuples of the 0-based start, end-exclusive end and gene index of exons.
+
+	Returns:
+		list: Segment starts.
+		list: Segment ends.
+		list: Tuples of gene indices of segments.
+	"""
+	event_l = sorted([(start, 1, gene) for start, end, gene in exon_l] + [(end, -1, gene) for start, end, gene in exon_l])
+	segment_start_l, segment_end_l, segment_gene_l = [], [], []
+	active = Counter()
+	previous = None
+	for pos, step, gene in event_l:
+		if previous is not None and pos > previous and active:
+			genes = tuple(sorted(active))
+			if segment_end_l and segment_end_l[-1] == previous and segment_gene_l[-1] == genes:
+				segment_end_l[-1] = pos
+			else:
+				segment_start_l.append(previous)
+				segment_end_l.append(pos)
+				segment_gene_l.append(genes)
+		active[gene] += step
+		if not active[gene]:
+			del active[gene]
+		previous = pos
+	return segment_start_l, segment_end_l, segment_gene_l
+
+def read_gene_model(gtf):
+	"""
+	Reads exons of genes from a GTF file as featureCounts -t exon -g gene_id does.
+
+	Returns:
+		pd.DataFrame: Genes in the order of the GTF file with columns Geneid, Chr, Start, End, Strand and Length
+			in the format of featureCounts, where Start and End are those of the merged exons.
+		dict: Flattened exons from flatten_exons by chromosome, labeled with row positions of genes.
+	"""
+	gene_index_dic = {}
+	strand_l = []
+	exon_dic = {}
+	gene_id_pattern = re.compile(r'gene_id "([^"]*)"')
+	try:
+		with open(gtf, "r") as gtf_file:
+			for line in gtf_file:
+				if line.startswith("#"):
+					continue
+				fields = line.rstrip("\n").split("\t")
+				if len(fields) < 9 or fields[2] != "exon":
+					continue
+				match = gene_id_pattern.search(fields[8])
+				if not match:
+					continue
+				gene = gene_index_dic.setdefault(match.group(1), len(gene_index_dic))
+				if gene == len(strand_l):
+					strand_l.append(fields[6])
+				exon_dic.setdefault(fields[0], []).append((int(fields[3]) - 1, int(fields[4]), gene))
+	except FileNotFoundError:
+		logger.error(f"GTF file not found: {gtf}")
+		sys.exit(1)
+
+	segment_dic = {contig: flatten_exons(exon_l) for contig, exon_l in exon_dic.items()}
+	# Merged exons of genes
+	interval_dic = {}
+	for contig, exon_l in exon_dic.items():
+		for start, end, gene in exon_l:
+			interval_dic.setdefault(gene, []).append((contig, start, end))
+	gene_l = []
+	for gene_id, gene in gene_index_dic.items():
+		interval_l = []
+		for contig in dict.fromkeys(contig for contig, _, _ in interval_dic[gene]):
+			interval_l += [(contig, start, end) for start, end in junction.merge_intervals(
+				[(start, end) for exon_contig, start, end in interval_dic[gene] if exon_contig == contig]
+			)]
+		gene_l.append([
+			gene_id,
+			";".join(contig for contig, _, _ in interval_l),
+			";".join(str(start + 1) for _, start, _ in interval_l),
+			";".join(str(end) for _, _, end in interval_l),
+			";".join(strand_l[gene] for _ in interval_l),
+			sum(end - start for _, start, end in interval_l)
+		])
+	gene_df = pd.DataFrame(gene_l, columns=["Geneid", "Chr", "Start", "End", "Strand", "Length"])
+	return gene_df, segment_dic
+
+class GeneCounter(junction.FragmentCounter):
+	"""
+	Counts reads or fragments of genes on a chromosome as featureCounts -t exon -g gene_id does without -O:
+	a read or fragment overlapping exons of one gene by at least one base is assigned to the gene,
+	and one overlapping exons of several genes is ambiguous. Reads are counted regardless of strand.
+	"""
+	# A fragment is counted once even if its mates are on different chromosomes
+	first_mate_only = True
+
+	def __init__(self, segment, paired, both_ends):
+		super().__init__(paired, both_ends)
+		self.segment_start_l, self.segment_end_l, self.segment_gene_l = segment
+		self.gene_count = Counter()
+
+	def assign(self, interval_l) -> str:
+		gene_set = set()
+		for start, end in interval_l:
+			index = bisect.bisect_right(self.segment_end_l, start)
+			while index < len(self.segment_start_l) and self.segment_start_l[index] < end:
+				gene_set.update(self.segment_gene_l[index])
+				index += 1
+		if not gene_set:
+			return "Unassigned_NoFeatures"
+		if len(gene_set) > 1:
+			return "Unassigned_Ambiguity"
+		self.gene_count[gene_set.pop()] += 1
+		return "Assigned"
+
+	def result(self):
+		"""
+		Returns:
+			tuple: Counter of reads by gene row position and a Counter of the read assignment summary.
+		"""
+		self.finish()
+		return self.gene_count, self.summary
+
+def gene_counters(bam_file, gene_model, paired=False, long_read=False, both_ends=True) -> dict:
+	"""
+	Returns a GeneCounter for each chromosome of a BAM file having genes, to be read by junction.scan_bam.
+	Paired-end data are counted as fragments (featureCounts -p, and -B with `both_ends`) and long-read data as reads.
+	"""
+	_gene_df, segment_dic = gene_model
 	with pysam.AlignmentFile(bam_file, "rb") as bam:
-		for read in bam:
-			total_checked += 1
-			if read.is_paired:
-				paired_count += 1
-				if paired_count >= 10:
-					return True
-			if total_checked >= max_reads:
-				break
-	logger.debug(f"Checked {total_checked} reads in {bam_file}. Paired count: {paired_count}")
-	return False
+		contig_set = set(bam.references)
+	counter_dic = {
+		contig: GeneCounter(segment, paired and not long_read, both_ends)
+		for contig, segment in segment_dic.items() if contig in contig_set
+	}
+	if not counter_dic:
+		logger.warning(f"No chromosome of the GTF file found in {bam_file}")
+	return counter_dic
+
+def write_gene_counts(bam_file, gene_model, result_dic, output_file) -> int:
+	"""
+	Writes reads counted by GeneCounter in the format of featureCounts with a .summary file.
+
+	Returns:
+		int: Number of assigned reads or fragments.
+	"""
+	gene_df, _segment_dic = gene_model
+	count_l = [0] * len(gene_df)
+	summary = Counter()
+	for gene_count, contig_summary in result_dic.values():
+		for gene, count in gene_count.items():
+			count_l[gene] += count
+		summary.update(contig_summary)
+	count_df = gene_df.copy()
+	count_df[bam_file] = count_l
+	with open(output_file, "w") as f:
+		f.write(f"# Gene counts of {bam_file}\n")
+		count_df.to_csv(f, sep="\t", index=False)
+	summary_l = ["Assigned", "Unassigned_MultiMapping", "Unassigned_NoFeatures", "Unassigned_Ambiguity", "Unassigned_Singleton"]
+	with open(f"{output_file}.summary", "w") as f:
+		f.write(f"Status\t{bam_file}\n")
+		for status in summary_l:
+			f.write(f"{status}\t{summary[status]}\n")
+	return summary["Assigned"]
+
+def count_genes(bam_file, gene_model, output_file, paired=False, long_read=False, processors=1) -> int:
+	"""
+	Counts reads of genes in an indexed BAM file with the semantics of featureCounts -t exon -g gene_id
+	(-p -B for paired-end and -L for long-read data), processing chromosomes in parallel.
+	The output and its .summary file have the same format as featureCounts.
+
+	Args:
+		bam_file (str): Indexed BAM file.
+		gene_model (tuple): Genes and flattened exons from read_gene_model.
+		output_file (str): Output count file.
+		paired (bool): Count fragments of paired-end reads.
+		long_read (bool): Count long reads as single reads.
+		processors (int): Number of processes.
+
+	Returns:
+		int: Number of assigned reads or fragments.
+	"""
+	counter_dic = gene_counters(bam_file, gene_model, paired, long_read)
+	result_dic, = junction.scan_bam(bam_file, [counter_dic], processors)
+	return write_gene_counts(bam_file, gene_model, result_dic, output_file)
+
+def count_totals(counts, length, chunksize=None):
+	"""
+	Sums read counts and reads per kilobase of each sample over chunks of genes.
+
+	Args:
+		counts (array-like): Gene x sample read counts, e.g. a NumPy array, a memory-mapped array or a DataFrame.
+		length (np.ndarray): Gene lengths.
+		chunksize (int): Number of genes per chunk, or None for all genes at once.
+
+	Returns:
+		np.ndarray: Read counts of samples.
+		np.ndarray: Reads per kilobase of samples.
+	"""
+	chunksize = chunksize or max(len(length), 1)
+	count_total = np.zeros(counts.shape[1], dtype=np.float64)
+	rpk_total = np.zeros(counts.shape[1], dtype=np.float64)
+	for start in range(0, len(length), chunksize):
+		chunk = count_chunk(counts, start, start + chunksize, np.float64)
+		count_total += chunk.sum(axis=0)
+		rpk_total += (1000 / length[start:start + chunksize]) @ chunk
+	return count_total, rpk_total
+
+def count_chunk(counts, start, end, dtype):
+	"""
+	Returns read counts of genes from `start` to `end` as an array of `dtype`, without copying when possible.
+	"""
+	chunk = counts.iloc[start:end] if isinstance(counts, pd.DataFrame) else counts[start:end]
+	return np.asarray(chunk, dtype=dtype)
+
+def normalize_counts(counts, length, tpm_out=None, cpm_out=None, chunksize=None):
+	"""
+	Normalizes read counts to TPM and CPM together with whole-block operations over chunks of genes.
+	Sample totals are computed once and shared by TPM and CPM. Chunks keep temporary arrays small,
+	so memory-mapped inputs and outputs larger than RAM can be normalized.
+
+	Args:
+		counts (array-like): Gene x sample read counts, e.g. a NumPy array, a memory-mapped array or a DataFrame.
+		length (np.ndarray): Gene lengths.
+		tpm_out (np.ndarray): Float array of the shape of `counts` to write TPM to, or None to skip TPM.
+			It may be `counts` itself to normalize in place.
+		cpm_out (np.ndarray): Float array of the shape of `counts` to write CPM to, or None to skip CPM.
+			It may be `counts` itself to normalize in place.
+		chunksize (int): Number of genes per chunk, or None for all genes at once.
+	"""
+	length = np.asarray(length, dtype=np.float64)
+	count_total, rpk_total = count_totals(counts, length, chunksize)
+	chunksize = chunksize or max(len(length), 1)
+	out_l = [out for out in [tpm_out, cpm_out] if out is not None]
+	if not out_l:
+		return
+	# Write to the input last when normalizing in place
+	out_l.sort(key=lambda out: out is counts)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		cpm_scale = 10**6 / count_total
+		tpm_scale = 10**6 / rpk_total
+		for start in range(0, len(length), chunksize):
+			end = start + chunksize
+			chunk = count_chunk(counts, start, end, out_l[0].dtype)
+			for out in out_l:
+				if out is tpm_out:
+					np.multiply(chunk, (1000 / length[start:end])[:, None].astype(out.dtype), out=out[start:end])
+					out[start:end] *= tpm_scale.astype(out.dtype)
+				else:
+					np.multiply(chunk, cpm_scale.astype(out.dtype), out=out[start:end])
 
 class ExpressionProcessor:
-	def __init__(self, df):
+	"""
+	Normalizes read counts of genes to TPM and CPM.
+	The table has gene IDs in the first column, gene lengths in Length and read counts of samples in the other columns.
+	Counts are normalized as a block of `dtype` in chunks of `chunksize` genes. np.float32 halves memory for very large
+	tables, but keeps only about seven significant digits, so large TPM and CPM values may differ in the second decimal.
+	"""
+	def __init__(self, df, dtype=np.float64, chunksize=10000):
 		self.df = df
+		self.dtype = dtype
+		self.chunksize = chunksize
+
+	def normalize(self, tpm=True, cpm=True):
+		"""
+		Computes TPM and CPM in one pass over the read counts.
+
+		Returns:
+			pd.DataFrame: TPM with gene IDs and samples, rounded to two decimals, or None when `tpm` is False.
+			pd.DataFrame: CPM with gene IDs and samples, rounded to two decimals, or None when `cpm` is False.
+		"""
+		samples = [col for col in self.df.columns[1:] if col != "Length"]
+		counts = self.df[samples]
+		tpm_out = np.empty(counts.shape, dtype=self.dtype) if tpm else None
+		cpm_out = np.empty(counts.shape, dtype=self.dtype) if cpm else None
+		normalize_counts(counts, self.df["Length"].to_numpy(), tpm_out, cpm_out, self.chunksize)
+		result_l = []
+		for out in [tpm_out, cpm_out]:
+			if out is None:
+				result_l.append(None)
+				continue
+			np.round(out, 2, out=out)
+			result_df = pd.DataFrame(out, index=self.df.index, columns=samples)
+			result_df.insert(0, self.df.columns[0], self.df.iloc[:, 0])
+			result_l.append(result_df)
+		return tuple(result_l)
 
 	def TPM(self):
-		samples = self.df.columns[2:]
-		for s in samples:
-			self.df[s] = (self.df[s] / self.df["Length"]) * 1000
-			self.df[s] = (self.df[s] / sum(self.df[s])) * 10**6
-		self.df = self.df.drop(columns=["Length"])
-		self.df = self.df.round(2)
-		return self.df
+		return self.normalize(cpm=False)[0]
 
 	def CPM(self):
-		samples = self.df.columns[2:]
-		for s in samples:
-			self.df[s] = (self.df[s] / sum(self.df[s])) * 10**6
-		self.df = self.df.drop(columns=["Length"])
-		self.df = self.df.round(2)
-		return self.df
+		return self.normalize(tpm=False)[1]
 
 # Usage:
 # processor = ExpressionProcessor(df)
-# df_tpm = processor.TPM()
-# df_cpm = processor.CPM()
+# df_tpm, df_cpm = processor.normalize()
 
 def gene_id_to_name(gtf):
 	gene_dict = {}
@@ -27,6 +27,32 @@ def load_config(config_path):
     except yaml.YAMLError as e:
         raise ValueError(f"Error parsing YAML configuration file: {e}")
 
+EVENT_TYPES = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"]
+
+def parse_events(events):
+    """
+    Parses a selection of alternative splicing event types.
+
+    Parameters:
+    events (str or list): Comma-separated string or list of event types. None or "all" selects all event types.
+
+    Returns:
+    list: The selected event types in the order of EVENT_TYPES.
+    """
+    if events is None:
+        return list(EVENT_TYPES)
+    if isinstance(events, str):
+        events = events.split(",")
+    events = {str(event).strip().upper() for event in events if str(event).strip()}
+    if "ALL" in events:
+        return list(EVENT_TYPES)
+    unknown = events - set(EVENT_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown event types: {', '.join(sorted(unknown))} (choose from {', '.join(EVENT_TYPES)})")
+    if not events:
+        raise ValueError("No event types selected")
+    return [event for event in EVENT_TYPES if event in events]
+
 def check_config(config, keys):
     missing_keys = [key for key in keys if key not in config or not config[key]]
     return missing_keys
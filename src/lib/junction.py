@@ -0,0 +1,560 @@
+import bisect
+import concurrent.futures
+import contextlib
+import heapq
+import os
+from collections import Counter
+import numpy as np
+import pandas as pd
+import pysam
+import logging
+logger = logging.getLogger(__name__)
+
+# CIGAR operations
+BAM_CMATCH = 0
+BAM_CINS = 1
+BAM_CDEL = 2
+BAM_CREF_SKIP = 3
+BAM_CSOFT_CLIP = 4
+BAM_CEQUAL = 7
+BAM_CDIFF = 8
+
+def chr_name(chr):
+	"""
+	Adds "chr" to numbered and short chromosome names, as done for junctions from regtools.
+	"""
+	return f"chr{chr}" if chr.isdecimal() or len(chr) <= 2 else chr
+
+def junction_strand(read, strand):
+	"""
+	Returns the strand of junctions in a read following regtools: the XS tag for XS, and the orientation
+	of the read and its mate for RF (first-strand) and FR (second-strand). "?" when the strand is unknown.
+	"""
+	if strand == "XS":
+		return read.get_tag("XS") if read.has_tag("XS") else "?"
+	first_strand = (strand == "RF") ^ read.is_read1 ^ read.is_reverse
+	second_strand = (strand == "RF") ^ read.is_read2 ^ read.mate_is_reverse
+	if first_strand != second_strand:
+		return "?"
+	return "+" if first_strand else "-"
+
+def read_junctions(reference_start, cigartuples, anchor, min_intron, max_intron) -> list:
+	"""
+	Returns junctions in a read with an intron length within `min_intron` and `max_intron` (no maximum when 0),
+	and whether the read anchors each side of them, following regtools.
+	A side is anchored when the consecutive matches next to the intron, bounded by insertions, deletions,
+	mismatches, soft clips or other introns, sum to at least `anchor` bases. As in regtools, a junction is closed
+	at the first operation after the intron that ends its right anchor, so later operations of the read do not affect it.
+
+	Returns:
+		list: Tuples of the 0-based intron start, the 0-based end-exclusive intron end,
+		and whether the left and right sides are anchored.
+	"""
+	junction_l = []
+	pos = reference_start
+	# Matched bases since the last operation that is not a match
+	match = 0
+	# Intron start, intron end, and whether the left side is anchored
+	pending = None
+	for op, length in cigartuples:
+		if op == BAM_CMATCH or op == BAM_CEQUAL:
+			match += length
+			pos += length
+			continue
+		if op not in (BAM_CINS, BAM_CDEL, BAM_CREF_SKIP, BAM_CSOFT_CLIP, BAM_CDIFF):
+			continue
+		# The run of matches ends here, closing the right anchor of the pending junction
+		if pending:
+			junction_l.append(pending + (match >= anchor,))
+			pending = None
+		if op == BAM_CREF_SKIP:
+			pending = (pos, pos + length, match >= anchor)
+		if op != BAM_CINS and op != BAM_CSOFT_CLIP:
+			pos += length
+		match = 0
+	if pending:
+		junction_l.append(pending + (match >= anchor,))
+
+	return [
+		junction for junction in junction_l
+		if junction[1] - junction[0] >= min_intron and (max_intron == 0 or junction[1] - junction[0] <= max_intron)
+	]
+
+class JunctionCounter:
+	"""
+	Counts reads supporting each junction on a chromosome, following regtools.
+	Every read within the intron length limits is counted, and a junction is reported when its left side and
+	its right side are each anchored by at least one of its reads, not necessarily the same one.
+	Reads are given one at a time by scan_contig, so that the BAM pass can be shared with other counters.
+	"""
+	def __init__(self, strand, anchor, min_intron, max_intron):
+		self.strand = strand
+		self.anchor = anchor
+		self.min_intron = min_intron
+		self.max_intron = max_intron
+		self.junction_count = Counter()
+		# Whether any read anchors the left and right sides of each junction
+		self.left_anchor = set()
+		self.right_anchor = set()
+
+	def add(self, read):
+		if read.is_unmapped:
+			return
+		cigartuples = read.cigartuples
+		if not cigartuples or not any(op == BAM_CREF_SKIP for op, _ in cigartuples):
+			return
+		junction_l = read_junctions(read.reference_start, cigartuples, self.anchor, self.min_intron, self.max_intron)
+		if junction_l:
+			read_strand = junction_strand(read, self.strand)
+			for start, end, left, right in junction_l:
+				key = (start, end, read_strand)
+				self.junction_count[key] += 1
+				if left:
+					self.left_anchor.add(key)
+				if right:
+					self.right_anchor.add(key)
+
+	def result(self) -> Counter:
+		"""
+		Returns:
+			Counter: Number of reads for each tuple of intron start, intron end and strand, of junctions anchored on both sides.
+		"""
+		return Counter({
+			key: count for key, count in self.junction_count.items()
+			if key in self.left_anchor and key in self.right_anchor
+		})
+
+def scan_contig(bam_file, contig, counter_l) -> list:
+	"""
+	Reads a chromosome of an indexed BAM file once, giving every read to each counter.
+
+	Returns:
+		list: Results of the counters.
+	"""
+	with pysam.AlignmentFile(bam_file, "rb") as bam:
+		for read in bam.fetch(contig):
+			for counter in counter_l:
+				counter.add(read)
+	return [counter.result() for counter in counter_l]
+
+def scan_bam(bam_file, counter_dic_l, processors=1) -> list:
+	"""
+	Reads an indexed BAM file once for several kinds of counts, processing chromosomes in parallel.
+	Chromosomes without mapped reads are not read and have no results.
+
+	Args:
+		bam_file (str): Indexed BAM file.
+		counter_dic_l (list): Dictionaries of counters by chromosome, one for each kind of count.
+		processors (int): Number of processes.
+
+	Returns:
+		list: Dictionaries of counter results by chromosome, in the order of `counter_dic_l`.
+	"""
+	with pysam.AlignmentFile(bam_file, "rb") as bam:
+		# Largest chromosomes first to balance processes
+		contig_l = [
+			stat.contig for stat in sorted(bam.get_index_statistics(), key=lambda x: x.mapped, reverse=True)
+			if stat.mapped > 0 and any(stat.contig in counter_dic for counter_dic in counter_dic_l)
+		]
+	logger.debug(f"Reading {len(contig_l)} chromosomes in {bam_file} for {len(counter_dic_l)} kinds of counts")
+	result_dic_l = [{} for _ in counter_dic_l]
+	with concurrent.futures.ProcessPoolExecutor(max_workers=processors) as executor:
+		future_dic = {}
+		for contig in contig_l:
+			index_l = [i for i, counter_dic in enumerate(counter_dic_l) if contig in counter_dic]
+			future = executor.submit(scan_contig, bam_file, contig, [counter_dic_l[i][contig] for i in index_l])
+			future_dic[future] = (contig, index_l)
+		for future in concurrent.futures.as_completed(future_dic):
+			contig, index_l = future_dic[future]
+			for i, result in zip(index_l, future.result()):
+				result_dic_l[i][contig] = result
+	return result_dic_l
+
+def extract_contig(bam_file, contig, strand, anchor, min_intron, max_intron) -> Counter:
+	"""
+	Counts reads supporting each junction on a chromosome.
+
+	Returns:
+		Counter: Number of reads for each tuple of intron start, intron end and strand.
+	"""
+	return scan_contig(bam_file, contig, [JunctionCounter(strand, anchor, min_intron, max_intron)])[0]
+
+def junction_counters(bam_file, strand, anchor, min_intron, max_intron) -> dict:
+	"""
+	Returns a JunctionCounter for each chromosome of a BAM file, to be read by scan_bam.
+	"""
+	with pysam.AlignmentFile(bam_file, "rb") as bam:
+		return {contig: JunctionCounter(strand, anchor, min_intron, max_intron) for contig in bam.references}
+
+def write_junctions(result_dic, output_file) -> int:
+	"""
+	Writes junctions counted by JunctionCounter with IDs in the coordinates of junctions.bed,
+	the last base of the upstream exon and the first base of the downstream exon.
+
+	Returns:
+		int: Number of junctions written.
+	"""
+	junction_l = []
+	for contig, junction_count in result_dic.items():
+		chr = chr_name(contig)
+		for (start, end, read_strand), count in junction_count.items():
+			junction_l.append([chr, start, end + 1, f"{chr}:{start}-{end + 1}", read_strand, count])
+	junction_df = pd.DataFrame(junction_l, columns=["chr", "start", "end", "ID", "strand", "count"])
+	junction_df = junction_df.sort_values(["chr", "start", "end", "strand"])
+	junction_df.to_csv(output_file, sep="\t", index=False)
+	return len(junction_df)
+
+def extract_junctions(bam_file, output_file, strand, anchor, min_intron, max_intron, processors=1):
+	"""
+	Extracts junctions from an indexed BAM file with the same rules as `regtools junctions extract`,
+	processing chromosomes in parallel.
+
+	Returns:
+		int: Number of junctions written.
+	"""
+	counter_dic = junction_counters(bam_file, strand, anchor, min_intron, max_intron)
+	logger.debug(f"Extracting junctions from {bam_file}")
+	result_dic, = scan_bam(bam_file, [counter_dic], processors)
+	return write_junctions(result_dic, output_file)
+
+def read_saf(saf_file) -> pd.DataFrame:
+	"""
+	Reads intron boundaries written by bam2junc.py or the make_RI_saf rule in SAF format.
+	"""
+	return pd.read_csv(saf_file, sep="\t", dtype={"GeneID": str, "Chr": str, "Start": int, "End": int, "Strand": str})
+
+def aligned_intervals(cigartuples, reference_start) -> list:
+	"""
+	Returns the reference intervals covered by a read as featureCounts sees them:
+	matches, mismatches and deletions are covered and skipped regions (N) split the read.
+
+	Returns:
+		list: Tuples of the 0-based start and end-exclusive end of each interval.
+	"""
+	interval_l = []
+	start = pos = reference_start
+	for op, length in cigartuples:
+		if op == BAM_CMATCH or op == BAM_CEQUAL or op == BAM_CDIFF or op == BAM_CDEL:
+			pos += length
+		elif op == BAM_CREF_SKIP:
+			if pos > start:
+				interval_l.append((start, pos))
+			pos += length
+			start = pos
+	if pos > start:
+		interval_l.append((start, pos))
+	return interval_l
+
+def covered_features(interval_l, feature_start_l, feature_end_l) -> set:
+	"""
+	Returns indices of features fully covered by one of the intervals (featureCounts --fracOverlapFeature 1.0 -O).
+	Features are sorted by start.
+	"""
+	feature_set = set()
+	for start, end in interval_l:
+		index = bisect.bisect_left(feature_start_l, start)
+		while index < len(feature_start_l) and feature_start_l[index] < end:
+			if feature_end_l[index] <= end:
+				feature_set.add(index)
+			index += 1
+	return feature_set
+
+def merge_intervals(interval_l) -> list:
+	"""
+	Merges overlapping or adjacent intervals, e.g. of the two mates of a fragment.
+	"""
+	merged_l = []
+	for start, end in sorted(interval_l):
+		if merged_l and start <= merged_l[-1][1]:
+			merged_l[-1] = (merged_l[-1][0], max(merged_l[-1][1], end))
+		else:
+			merged_l.append((start, end))
+	return merged_l
+
+class FragmentCounter:
+	"""
+	Assigns reads or fragments on a chromosome to features, given one read at a time by scan_contig.
+	Multi-mapping reads (NH > 1), secondary and supplementary alignments are not counted, as in featureCounts without -M.
+	When paired, both mates of a fragment are combined and the fragment is assigned once.
+	With `both_ends`, fragments with one mapped mate are not counted (featureCounts -B).
+	Subclasses implement assign, which assigns the reference intervals of a read or fragment and returns its status.
+	"""
+	# Mates on different chromosomes are assigned separately in each process, or only from the first mate
+	first_mate_only = False
+
+	def __init__(self, paired, both_ends):
+		self.paired = paired
+		self.both_ends = both_ends
+		self.summary = Counter()
+		self.mate_dic = {}
+
+	def assign(self, interval_l) -> str:
+		raise NotImplementedError
+
+	def count(self, interval_l):
+		self.summary[self.assign(interval_l)] += 1
+
+	def add(self, read):
+		if read.is_unmapped or read.is_secondary or read.is_supplementary:
+			return
+		if read.has_tag("NH") and read.get_tag("NH") > 1:
+			self.summary["Unassigned_MultiMapping"] += 1
+			return
+		interval_l = aligned_intervals(read.cigartuples, read.reference_start)
+		if not (self.paired and read.is_paired):
+			self.count(interval_l)
+			return
+		if read.mate_is_unmapped:
+			if self.both_ends:
+				self.summary["Unassigned_Singleton"] += 1
+			else:
+				self.count(interval_l)
+			return
+		if read.next_reference_id != read.reference_id:
+			if not (self.first_mate_only and read.is_read2):
+				self.count(interval_l)
+			return
+		mate_interval_l = self.mate_dic.pop(read.query_name, None)
+		if mate_interval_l is None:
+			self.mate_dic[read.query_name] = interval_l
+		else:
+			self.count(merge_intervals(interval_l + mate_interval_l))
+
+	def finish(self):
+		# Mates filtered out or missing from the BAM file
+		for interval_l in self.mate_dic.values():
+			self.count(interval_l)
+		self.mate_dic = {}
+
+class BoundaryCounter(FragmentCounter):
+	"""
+	Counts reads or fragments fully covering each feature on a chromosome (featureCounts --fracOverlapFeature 1.0 -O).
+	Features are tuples of the 0-based start and end-exclusive end, sorted by start.
+	"""
+	def __init__(self, feature_l, paired, both_ends):
+		super().__init__(paired, both_ends)
+		self.feature_start_l = [start for start, _ in feature_l]
+		self.feature_end_l = [end for _, end in feature_l]
+		self.count_l = [0] * len(feature_l)
+
+	def assign(self, interval_l) -> str:
+		feature_set = covered_features(interval_l, self.feature_start_l, self.feature_end_l)
+		for index in feature_set:
+			self.count_l[index] += 1
+		return "Assigned" if feature_set else "Unassigned_NoFeatures"
+
+	def result(self):
+		"""
+		Returns:
+			tuple: Counts in the order of the features and a Counter of the read assignment summary.
+		"""
+		self.finish()
+		return self.count_l, self.summary
+
+def count_contig_boundaries(bam_file, contig, feature_l, paired, both_ends):
+	"""
+	Counts reads or fragments fully covering each feature on a chromosome.
+
+	Returns:
+		tuple: Counts in the order of `feature_l` and a Counter of the read assignment summary.
+	"""
+	return scan_contig(bam_file, contig, [BoundaryCounter(feature_l, paired, both_ends)])[0]
+
+def boundary_counters(bam_file, boundary_df, paired=False, long_read=False, both_ends=False):
+	"""
+	Returns a BoundaryCounter for each chromosome of a BAM file having boundaries, to be read by scan_bam.
+	Paired-end data are counted as fragments and long-read data as reads.
+
+	Returns:
+		dict: BoundaryCounter by chromosome.
+		dict: Row positions in `boundary_df` of the boundaries of each counter, in the order of counting.
+	"""
+	boundary_df = boundary_df.reset_index(drop=True)
+	with pysam.AlignmentFile(bam_file, "rb") as bam:
+		contig_set = set(bam.references)
+	# Boundaries sorted by start for each chromosome
+	counter_dic, index_dic = {}, {}
+	for contig, contig_df in boundary_df.groupby("Chr", sort=False):
+		if contig not in contig_set:
+			logger.debug(f"Chromosome {contig} not found in {bam_file}")
+			continue
+		contig_df = contig_df.sort_values("Start")
+		index_dic[contig] = contig_df.index.tolist()
+		counter_dic[contig] = BoundaryCounter(
+			list(zip(contig_df["Start"] - 1, contig_df["End"])), paired and not long_read, both_ends
+		)
+	return counter_dic, index_dic
+
+def write_boundaries(bam_file, boundary_df, index_dic, result_dic, output_file) -> int:
+	"""
+	Writes reads counted by BoundaryCounter in the format of featureCounts with a .summary file,
+	summarizing reads on chromosomes having boundaries.
+
+	Returns:
+		int: Number of assigned reads or fragments.
+	"""
+	boundary_df = boundary_df.reset_index(drop=True)
+	count_l = [0] * len(boundary_df)
+	summary = Counter()
+	for contig, (contig_count_l, contig_summary) in result_dic.items():
+		for index, count in zip(index_dic[contig], contig_count_l):
+			count_l[index] = count
+		summary.update(contig_summary)
+
+	count_df = boundary_df[["GeneID", "Chr", "Start", "End", "Strand"]].rename(columns={"GeneID": "Geneid"})
+	count_df["Length"] = count_df["End"] - count_df["Start"] + 1
+	count_df[bam_file] = count_l
+	with open(output_file, "w") as f:
+		f.write(f"# Intron boundary counts of {bam_file}\n")
+		count_df.to_csv(f, sep="\t", index=False)
+	summary_l = ["Assigned", "Unassigned_MultiMapping", "Unassigned_NoFeatures", "Unassigned_Singleton"]
+	with open(f"{output_file}.summary", "w") as f:
+		f.write(f"Status\t{bam_file}\n")
+		for status in summary_l:
+			f.write(f"{status}\t{summary[status]}\n")
+	return summary["Assigned"]
+
+def count_boundaries(bam_file, boundary_df, output_file, paired=False, long_read=False, both_ends=False, processors=1):
+	"""
+	Counts reads spanning RI boundaries with the semantics of featureCounts -F SAF --fracOverlapFeature 1.0 -O,
+	processing chromosomes in parallel. Paired-end data are counted as fragments and long-read data as reads.
+	The output and its .summary file have the same format as featureCounts.
+
+	Returns:
+		int: Number of assigned reads or fragments.
+	"""
+	counter_dic, index_dic = boundary_counters(bam_file, boundary_df, paired, long_read, both_ends)
+	result_dic, = scan_bam(bam_file, [counter_dic], processors)
+	return write_boundaries(bam_file, boundary_df, index_dic, result_dic, output_file)
+
+def read_junction_file(junc_file, junction_type) -> pd.DataFrame:
+	"""
+	Reads junctions of a sample from regtools (exon-exon), the native extractor (exon-exon-native)
+	or featureCounts (exon-intron) in the coordinates of junctions.bed.
+
+	Returns:
+		pd.DataFrame: chr, start, end, ID and count of each junction.
+	"""
+	columns = ["chr", "start", "end", "ID", "count"]
+	if junction_type == "exon-exon":
+		try:
+			df = pd.read_csv(junc_file, sep="\t", header=None, usecols=[0, 1, 2, 4, 10], dtype={0: str, 10: str})
+		except pd.errors.EmptyDataError:
+			return pd.DataFrame(columns=columns)
+		df.columns = ["chr", "start", "end", "count", "block"]
+		block_l = [block.split(",", 2) for block in df["block"].tolist()]
+		df["start"] = df["start"].to_numpy() + np.array([int(block[0]) for block in block_l], dtype=int)
+		df["end"] = df["end"].to_numpy() - np.array([int(block[1]) for block in block_l], dtype=int) + 1
+	elif junction_type == "exon-exon-native":
+		df = pd.read_csv(junc_file, sep="\t", dtype={"chr": str, "ID": str})
+	else:
+		df = pd.read_csv(junc_file, sep="\t", comment="#", dtype={"Geneid": str, "Chr": str})
+		df = df.iloc[:, [1, 2, 3, 0, 6]]
+		df.columns = columns
+		df = df.astype({"chr": str, "ID": str})
+	chr_dic = {chr: chr_name(chr) for chr in df["chr"].unique()}
+	df["chr"] = df["chr"].map(chr_dic)
+	if junction_type == "exon-exon":
+		df["ID"] = df["chr"] + ":" + df["start"].astype(str) + "-" + df["end"].astype(str)
+	return df[columns]
+
+def sort_sample_junctions(junc_files, sample, output_file) -> None:
+	"""
+	Writes junctions of a sample sorted by chr, start, end and ID, summing counts of junctions found on both strands.
+
+	Args:
+		junc_files (list): Tuples of junction file and junction type of the sample.
+	"""
+	df = pd.concat([read_junction_file(file, junction_type) for file, junction_type in junc_files], ignore_index=True)
+	count_s = df.groupby("ID", sort=False)["count"].sum()
+	df = df.drop_duplicates("ID").sort_values(["chr", "start", "end", "ID"])
+	with open(output_file, "w") as f:
+		f.write(f"chr\tstart\tend\tID\t{sample}\n")
+		f.writelines(
+			f"{chr}\t{start}\t{end}\t{id}\t{count}\n"
+			for chr, start, end, id, count in zip(
+				df["chr"].tolist(), df["start"].tolist(), df["end"].tolist(), df["ID"].tolist(), count_s.loc[df["ID"]].tolist()
+			)
+		)
+
+def iter_junction_rows(f, index):
+	"""
+	Yields the sort key, the index of the input file and the tab-separated counts of each row of a sorted junction count file.
+	"""
+	for line in f:
+		chr, start, end, id, counts = line.rstrip("\n").split("\t", 4)
+		yield (chr, int(start), int(end), id), index, counts
+
+def merge_sorted_junctions(input_files, output_file) -> int:
+	"""
+	Merges junction count files sorted by chr, start, end and ID into one wide file with a k-way merge,
+	writing rows one by one. Junctions missing from an input file have zero counts.
+	Memory use is bounded by the number of input files.
+
+	Returns:
+		int: Number of junctions written.
+	"""
+	junction_n = 0
+	with contextlib.ExitStack() as stack, open(output_file, "w") as out:
+		f_l = [stack.enter_context(open(file, "r")) for file in input_files]
+		sample_l = []
+		zero_l = []
+		for f in f_l:
+			header = next(f).rstrip("\n").split("\t")
+			sample_l += header[4:]
+			zero_l.append("\t".join(["0"] * len(header[4:])))
+		out.write("\t".join(["chr", "start", "end", "ID"] + sample_l) + "\n")
+		row_iterators = [iter_junction_rows(f, i) for i, f in enumerate(f_l)]
+		current_key = None
+		count_l = None
+		for key, i, counts in heapq.merge(*row_iterators):
+			if key != current_key:
+				if count_l is not None:
+					out.write(f"{current_key[0]}\t{current_key[1]}\t{current_key[2]}\t{current_key[3]}\t" + "\t".join(count_l) + "\n")
+					junction_n += 1
+				current_key = key
+				count_l = zero_l.copy()
+			count_l[i] = counts
+		if count_l is not None:
+			out.write(f"{current_key[0]}\t{current_key[1]}\t{current_key[2]}\t{current_key[3]}\t" + "\t".join(count_l) + "\n")
+			junction_n += 1
+	return junction_n
+
+def merge_junctions(sample_junc_dic, output_file, tmp_dir, processors=1, max_open_files=256) -> int:
+	"""
+	Merges per-sample junction files into the junction count matrix (junctions.bed).
+	Junctions of each sample are sorted by coordinate in parallel, one sample per process, and merged with a streaming
+	k-way merge, in several rounds when there are more samples than `max_open_files`. Samples are ordered by name.
+
+	Args:
+		sample_junc_dic (dict): Junction files of each sample as tuples of junction file and junction type.
+
+	Returns:
+		int: Number of junctions written.
+	"""
+	sample_l = sorted(sample_junc_dic)
+	sorted_file_l = [os.path.join(tmp_dir, f"{i}.sorted.tsv") for i in range(len(sample_l))]
+	logger.debug(f"Sorting junctions of {len(sample_l)} samples")
+	with concurrent.futures.ProcessPoolExecutor(max_workers=processors) as executor:
+		futures = [
+			executor.submit(sort_sample_junctions, sample_junc_dic[sample], sample, sorted_file)
+			for sample, sorted_file in zip(sample_l, sorted_file_l)
+		]
+		for future in futures:
+			future.result()
+	merge_round = 0
+	while len(sorted_file_l) > max_open_files:
+		merge_round += 1
+		logger.debug(f"Merging {len(sorted_file_l)} files in round {merge_round}")
+		merged_file_l = []
+		for i in range(0, len(sorted_file_l), max_open_files):
+			merged_file = os.path.join(tmp_dir, f"{merge_round}_{i}.merged.tsv")
+			merge_sorted_junctions(sorted_file_l[i:i + max_open_files], merged_file)
+			merged_file_l.append(merged_file)
+		for file in sorted_file_l:
+			os.remove(file)
+		sorted_file_l = merged_file_l
+	junction_n = merge_sorted_junctions(sorted_file_l, output_file)
+	for file in sorted_file_l:
+		os.remove(file)
+	return junction_n
@@ -7,50 +7,52 @@ import numpy as np
 import scipy.stats as stats
 import statsmodels.stats.multitest as multitest
 import concurrent.futures
+import os
 import logging
 logger = logging.getLogger(__name__)
 
-def read_events(event_path) -> dict:
+def read_events(event_path, event_types = None) -> dict:
     """
     Reads alternative splicing events from text files and returns a dictionary of dataframes.
 
     Args:
     - event_path (str): Path to the directory that contains text files of alternative splicing events.
+    - event_types (list): Event types to read. All event types by default. Event types without an event file are skipped.
 
     Returns:
     - event_df_dict (dict): A dictionary of dataframes containing alternative splicing events.
     """
 
-    event_types = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"]
+    if event_types is None:
+        event_types = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"]
     event_df_dict = {}
     for event in event_types:
+        event_file = f"{event_path}/EVENT_{event}.txt"
+        if not os.path.isfile(event_file):
+            logger.warning(f"Event file not found, skipping {event} events: {event_file}")
+            continue
         event_df_dict[event] = pd.read_csv(
-            f"{event_path}/EVENT_{event}.txt",
+            event_file,
             sep="\t",
             dtype="str"
         )
     return event_df_dict
 
-def read_events_sc(event_path) -> dict:
+def read_events_sc(event_path, event_types = None) -> dict:
     """
     Reads alternative splicing events from text files and returns a dictionary of dataframes for single cell data.
 
     Args:
     - event_path (str): Path to the directory that contains text files of alternative splicing events.
+    - event_types (list): Event types to read. All event types except RI by default. Event types without an event file are skipped.
 
     Returns:
     - event_df_dict (dict): A dictionary of dataframes containing alternative splicing events.
     """
 
-    event_types = ["SE", "FIVE", "THREE", "MXE", "MSE", "AFE", "ALE"]
-    event_df_dict = {}
-    for event in event_types:
-        event_df_dict[event] = pd.read_csv(
-            f"{event_path}/EVENT_{event}.txt",
-            sep="\t",
-            dtype="str"
-        )
-    return event_df_dict
+    if event_types is None:
+        event_types = ["SE", "FIVE", "THREE", "MXE", "MSE", "AFE", "ALE"]
+    return read_events(event_path, event_types)
 
 def read_junctions(junction_path) -> pd.DataFrame:
     """
@@ -2000,6 +2002,155 @@ def diff_event(event_for_analysis_df, psi_table_df, junc_dict_all, group_df, gro
             output_df = output_df.sort_values(["Diff events", "q"], ascending = [False, True])
     return(output_df)
 
+# Reference group of one-vs-rest contrasts, pooling all groups other than the alternative group
+REST_GROUP = "rest"
+
+def parse_contrasts(contrasts, group_list) -> list:
+    """
+    Parse contrasts of groups for differential analysis.
+
+    Args:
+    - contrasts (str): "all-pairs" for every pair of groups, "one-vs-rest" for each group against all other groups pooled,
+      or a path to a tab-separated file of reference and alternative groups, one contrast per line.
+    - group_list (list): List of group names.
+
+    Returns:
+    - list: List of tuples of reference and alternative groups. The reference of one-vs-rest contrasts is REST_GROUP.
+    """
+
+    if contrasts == "all-pairs":
+        return [(reference, alternative) for i, reference in enumerate(group_list) for alternative in group_list[i + 1:]]
+    if contrasts == "one-vs-rest":
+        if REST_GROUP in group_list:
+            raise ValueError(f"A group is named {REST_GROUP}, which is reserved for one-vs-rest contrasts")
+        if len(group_list) < 2:
+            raise ValueError("One-vs-rest contrasts need at least two groups")
+        return [(REST_GROUP, alternative) for alternative in group_list]
+    if not os.path.isfile(contrasts):
+        raise ValueError(f"Contrasts must be all-pairs, one-vs-rest or a file of contrasts: {contrasts}")
+    contrast_list = []
+    with open(contrasts, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            contrast = tuple(line.split("\t"))
+            if len(contrast) != 2:
+                raise ValueError(f"Each line of the contrast file must have a reference and an alternative group: {line}")
+            missing = [group for group in contrast if group not in group_list]
+            if missing:
+                raise ValueError(f"Groups not found in the junction file: {', '.join(missing)}")
+            if contrast not in contrast_list:
+                contrast_list.append(contrast)
+    if not contrast_list:
+        raise ValueError(f"No contrasts found in {contrasts}")
+    return contrast_list
+
+def diff_contrast(contrast, event_data_dict, junc_count_df, minimum_reads, FDR, dPSI) -> dict:
+    """
+    Differential splicing analysis of a contrast for each event type, using PSI tables of groups computed once for all contrasts.
+
+    Args:
+    - contrast (tuple): Reference and alternative groups.
+    - event_data_dict (dict): For each event type, a tuple of the events for analysis, the PSI table of all groups,
+      and the PSI, column, differential and individual PSI functions.
+    - junc_count_df (pd.DataFrame): Junction IDs and read counts of all groups, pooled for the reference of one-vs-rest contrasts.
+    - minimum_reads (int): Minimum number of reads to be considered.
+    - FDR (float): False discovery rate.
+    - dPSI (float): Minimum delta PSI.
+
+    Returns:
+    - dict: A dictionary of DataFrames containing the differential splicing analysis results for each event type.
+    """
+
+    reference, alternative = contrast
+    junc_dict_rest = None
+    if reference == REST_GROUP:
+        # Read counts of all groups other than the alternative group
+        group_columns = [col for col in junc_count_df.columns if col != "ID"]
+        rest_counts = junc_count_df[group_columns].sum(axis = 1) - junc_count_df[alternative]
+        junc_dict_rest = {REST_GROUP: dict(zip(junc_count_df["ID"].values, rest_counts.values))}
+    diff_df_dict = {}
+    for event, (event_for_analysis_df, psi_table_df, func_psi, func_col, func_diff, func_ind) in event_data_dict.items():
+        if junc_dict_rest is not None:
+            rest_df = pd.DataFrame(
+                func_psi(junc_dict_rest, [REST_GROUP], event_for_analysis_df, 1, minimum_reads, 0),
+                columns = func_col([REST_GROUP], True)
+            )
+            rest_columns = [col for col in rest_df.columns if col.startswith(REST_GROUP + "_")]
+            psi_table_df = pd.merge(psi_table_df[func_col([alternative], True)], rest_df[["event_id"] + rest_columns], on = "event_id")
+        psi_table_df = psi_table_df[func_col([reference, alternative], True)]
+        diff_df_dict[event] = diff_event(
+            event_for_analysis_df, psi_table_df, {}, False, [reference, alternative], [reference, alternative],
+            func_diff, func_ind, 1, FDR, dPSI, False, False
+        )
+    return(diff_df_dict)
+
+# Data shared by all contrasts in worker processes of diff_contrasts
+contrast_data = {}
+
+def init_contrast_worker(event_data_dict, junc_count_df):
+    contrast_data["event_data_dict"] = event_data_dict
+    contrast_data["junc_count_df"] = junc_count_df
+
+def diff_contrast_worker(contrast, minimum_reads, FDR, dPSI) -> dict:
+    return(diff_contrast(contrast, contrast_data["event_data_dict"], contrast_data["junc_count_df"], minimum_reads, FDR, dPSI))
+
+def diff_contrasts(contrast_list, event_data_dict, junc_count_df, num_process, minimum_reads, FDR, dPSI) -> dict:
+    """
+    Differential splicing analysis of contrasts in parallel.
+    PSI tables and junction read counts are sent once to each worker process rather than with each contrast.
+
+    Args:
+    - contrast_list (list): List of tuples of reference and alternative groups.
+    - event_data_dict (dict): See diff_contrast.
+    - junc_count_df (pd.DataFrame): See diff_contrast. None without one-vs-rest contrasts.
+    - num_process (int): Number of processes to use.
+    - minimum_reads (int): Minimum number of reads to be considered.
+    - FDR (float): False discovery rate.
+    - dPSI (float): Minimum delta PSI.
+
+    Returns:
+    - dict: A dictionary of the results of diff_contrast for each contrast.
+    """
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers = min(num_process, len(contrast_list)),
+        initializer = init_contrast_worker,
+        initargs = (event_data_dict, junc_count_df)
+    ) as executor:
+        futures = {contrast: executor.submit(diff_contrast_worker, contrast, minimum_reads, FDR, dPSI) for contrast in contrast_list}
+        contrast_results = {contrast: future.result() for contrast, future in futures.items()}
+    return(contrast_results)
+
+def summarize_diff(diff_df_dict, dPSI) -> pd.DataFrame:
+    """
+    Count differential events by event type, direction and label.
+
+    Args:
+    - diff_df_dict (dict): A dictionary of DataFrames containing the differential splicing analysis results for each event type.
+    - dPSI (float): Minimum delta PSI.
+
+    Returns:
+    - pd.DataFrame: DataFrame of the number of differential events.
+    """
+
+    summary_l = []
+    for event, diff_df in diff_df_dict.items():
+        logger.debug(f"Counting events for {event}...")
+        event_counts = EventCounter(diff_df, dPSI).count_all_events()
+        summary_l.extend([
+            [event, "Up", "annotated", event_counts["up_annotated_num"]],
+            [event, "Down", "annotated", event_counts["down_annotated_num"]],
+            [event, "Up", "unannotated", event_counts["up_unannotated_num"]],
+            [event, "Down", "unannotated", event_counts["down_unannotated_num"]],
+        ])
+    summary_df = pd.DataFrame(
+        summary_l,
+        columns = ["AS", "Direction", "Label", "Number"]
+    )
+    return(summary_df)
+
 def make_psi_mtx(psi_table_df) -> pd.DataFrame:
     """
     Make PSI matrix.
@@ -2045,20 +2196,14 @@ class EventCounter:
             "down_unannotated_num": self.count_events("unannotated", -1),
         }
 
-def save_excel(output_path, SE_df, FIVE_df, THREE_df, MXE_df, RI_df, MSE_df, AFE_df, ALE_df):
+def save_excel(output_path, event_df_dict):
     """
     Save excel file.
 
     Args:
     - output_path (str): Output path.
-    - SE_df (pd.DataFrame): DataFrame containing the differential splicing analysis results for SE events.
-    - FIVE_df (pd.DataFrame): DataFrame containing the differential splicing analysis results for FIVE events.
-    - THREE_df (pd.DataFrame): DataFrame containing the differential splicing analysis results for THREE events.
-    - MXE_df (pd.DataFrame): DataFrame containing the differential splicing analysis results for MXE events.
-    - RI_df (pd.DataFrame): DataFrame containing the differential splicing analysis results for RI events.
-    - MSE_df (pd.DataFrame): DataFrame containing the differential splicing events for MSE events.
-    - AFE_df (pd.DataFrame): DataFrame containing the differential splicing events for AFE events.
-    - ALE_df (pd.DataFrame): DataFrame containing the differential splicing events for ALE events.
+    - event_df_dict (dict): A dictionary of DataFrames containing the results for each event type, written to one sheet each.
+      Event types missing from the dictionary or with None are skipped.
 
     """
 
@@ -2071,143 +2216,25 @@ def save_excel(output_path, SE_df, FIVE_df, THREE_df, MXE_df, RI_df, MSE_df, AFE
         wrap_text = False
     )
     with StyleFrame.ExcelWriter(output_path + "/results.xlsx") as writer:
-        # SE
-        SE_sf = StyleFrame(SE_df)
-        SE_sf.set_column_width(columns = SE_df.columns, width = 20)
-        SE_sf.apply_column_style(cols_to_style = SE_df.columns, styler_obj = style, style_header = True)
-        SE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "SE")
-        # FIVE
-        FIVE_sf = StyleFrame(FIVE_df)
-        FIVE_sf.set_column_width(columns = FIVE_df.columns, width = 20)
-        FIVE_sf.apply_column_style(cols_to_style = FIVE_df.columns, styler_obj = style, style_header = True)
-        try:
-            FIVE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "FIVE")
-        except:
-            pass
-        # THREE
-        THREE_sf = StyleFrame(THREE_df)
-        THREE_sf.set_column_width(columns = THREE_df.columns, width = 20)
-        THREE_sf.apply_column_style(cols_to_style = THREE_df.columns, styler_obj = style, style_header = True)
-        try:
-            THREE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "THREE")
-        except:
-            pass
-        # MXE
-        MXE_sf = StyleFrame(MXE_df)
-        MXE_sf.set_column_width(columns = MXE_df.columns, width = 20)
-        MXE_sf.apply_column_style(cols_to_style = MXE_df.columns, styler_obj = style, style_header = True)
-        try:
-            MXE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "MXE")
-        except:
-            pass
-        # RI
-        RI_sf = StyleFrame(RI_df)
-        RI_sf.set_column_width(columns = RI_df.columns, width = 20)
-        RI_sf.apply_column_style(cols_to_style = RI_df.columns, styler_obj = style, style_header = True)
-        try:
-            RI_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "RI")
-        except:
-            pass
-        # MSE
-        MSE_sf = StyleFrame(MSE_df)
-        MSE_sf.set_column_width(columns = MSE_df.columns, width = 20)
-        MSE_sf.apply_column_style(cols_to_style = MSE_df.columns, styler_obj = style, style_header = True)
-        try:
-            MSE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "MSE")
-        except:
-            pass
-        # AFE
-        AFE_sf = StyleFrame(AFE_df)
-        AFE_sf.set_column_width(columns = AFE_df.columns, width = 20)
-        AFE_sf.apply_column_style(cols_to_style = AFE_df.columns, styler_obj = style, style_header = True)
-        try:
-            AFE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "AFE")
-        except:
-            pass
-        # ALE
-        ALE_sf = StyleFrame(ALE_df)
-        ALE_sf.set_column_width(columns = ALE_df.columns, width = 20)
-        ALE_sf.apply_column_style(cols_to_style = ALE_df.columns, styler_obj = style, style_header = True)
-        try:
-            ALE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "ALE")
-        except:
-            pass
+        for event, event_df in event_df_dict.items():
+            if event_df is None:
+                continue
+            event_sf = StyleFrame(event_df)
+            event_sf.set_column_width(columns = event_df.columns, width = 20)
+            event_sf.apply_column_style(cols_to_style = event_df.columns, styler_obj = style, style_header = True)
+            try:
+                event_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = event)
+            except Exception as e:
+                logger.debug(f"Failed to write {event} sheet: {e}")
 
-def save_excel_sc(output_path, SE_df, FIVE_df, THREE_df, MXE_df, MSE_df, AFE_df, ALE_df):
+def save_excel_sc(output_path, event_df_dict):
     """
-    Save excel file.
+    Save excel file for single cell data.
 
     Args:
     - output_path (str): Output path.
-    - SE_df (pd.DataFrame): DataFrame containing the differential splicing analysis results for SE events.
-    - FIVE_df (pd.DataFrame): DataFrame containing the differential splicing analysis results for FIVE events.
-    - THREE_df (pd.DataFrame): DataFrame containing the differential splicing analysis results for THREE events.
-    - MXE_df (pd.DataFrame): DataFrame containing the differential splicing analysis results for MXE events.
-    - MSE_df (pd.DataFrame): DataFrame containing the differential splicing events for MSE events.
-    - AFE_df (pd.DataFrame): DataFrame containing the differential splicing events for AFE events.
-    - ALE_df (pd.DataFrame): DataFrame containing the differential splicing events for ALE events.
+    - event_df_dict (dict): A dictionary of DataFrames containing the results for each event type.
 
     """
 
-    from styleframe import StyleFrame, Styler, utils
-
-    # Style
-    style = Styler(
-        horizontal_alignment = utils.horizontal_alignments.left,
-        border_type = utils.borders.default_grid,
-        wrap_text = False
-    )
-    with StyleFrame.ExcelWriter(output_path + "/results.xlsx") as writer:
-        # SE
-        SE_sf = StyleFrame(SE_df)
-        SE_sf.set_column_width(columns = SE_df.columns, width = 20)
-        SE_sf.apply_column_style(cols_to_style = SE_df.columns, styler_obj = style, style_header = True)
-        SE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "SE")
-        # FIVE
-        FIVE_sf = StyleFrame(FIVE_df)
-        FIVE_sf.set_column_width(columns = FIVE_df.columns, width = 20)
-        FIVE_sf.apply_column_style(cols_to_style = FIVE_df.columns, styler_obj = style, style_header = True)
-        try:
-            FIVE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "FIVE")
-        except:
-            pass
-        # THREE
-        THREE_sf = StyleFrame(THREE_df)
-        THREE_sf.set_column_width(columns = THREE_df.columns, width = 20)
-        THREE_sf.apply_column_style(cols_to_style = THREE_df.columns, styler_obj = style, style_header = True)
-        try:
-            THREE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "THREE")
-        except:
-            pass
-        # MXE
-        MXE_sf = StyleFrame(MXE_df)
-        MXE_sf.set_column_width(columns = MXE_df.columns, width = 20)
-        MXE_sf.apply_column_style(cols_to_style = MXE_df.columns, styler_obj = style, style_header = True)
-        try:
-            MXE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "MXE")
-        except:
-            pass
-        # MSE
-        MSE_sf = StyleFrame(MSE_df)
-        MSE_sf.set_column_width(columns = MSE_df.columns, width = 20)
-        MSE_sf.apply_column_style(cols_to_style = MSE_df.columns, styler_obj = style, style_header = True)
-        try:
-            MSE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "MSE")
-        except:
-            pass
-        # AFE
-        AFE_sf = StyleFrame(AFE_df)
-        AFE_sf.set_column_width(columns = AFE_df.columns, width = 20)
-        AFE_sf.apply_column_style(cols_to_style = AFE_df.columns, styler_obj = style, style_header = True)
-        try:
-            AFE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "AFE")
-        except:
-            pass
-        # ALE
-        ALE_sf = StyleFrame(ALE_df)
-        ALE_sf.set_column_width(columns = ALE_df.columns, width = 20)
-        ALE_sf.apply_column_style(cols_to_style = ALE_df.columns, styler_obj = style, style_header = True)
-        try:
-            ALE_sf.to_excel(writer, index = False, columns_and_rows_to_freeze = "B2", sheet_name = "ALE")
-        except:
-            pass
+    save_excel(output_path, event_df_dict)
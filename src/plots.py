@@ -11,6 +11,7 @@ import seaborn as sns
 import html
 import logging
 from template_renderer import HTMLTemplateRenderer, get_splicing_event_config
+from lib import general
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -25,6 +26,7 @@ def get_args():
 	parser.add_argument("-e", "--experiment-table", type = str, help = "Experiment table file")
 	parser.add_argument("-s", "--shiba-command", type = str, help = "Shiba command")
 	parser.add_argument("-o", "--output", type = str, help = "Directory for output files")
+	parser.add_argument("--events", type = str, help = "Comma-separated event types to plot, e.g. SE,RI,MXE", default = "all")
 	parser.add_argument('-v', '--verbose', action='store_true', help='Verbose output')
 	args = parser.parse_args()
 	return(args)
@@ -347,7 +349,7 @@ def load_splicing_summary_image(output_dir: str) -> str:
 		logger.warning(f"Error loading splicing summary image: {e}")
 		return '<p style="text-align: center; color: #64748b;">Summary chart not available</p>'
 
-def write_summary_html(shiba_command: str, input_dir: str, output_dir: str):
+def write_summary_html(shiba_command: str, input_dir: str, output_dir: str, events: list):
 	"""Write summary HTML using modern template system with individual event files."""
 	
 	# Initialize template renderer
@@ -363,7 +365,7 @@ def write_summary_html(shiba_command: str, input_dir: str, output_dir: str):
 	
 	# Prepare splicing events data
 	splicing_events = []
-	event_configs = get_splicing_event_config()
+	event_configs = [config for config in get_splicing_event_config() if config['code'] in events]
 	
 	for config in event_configs:
 		event_count = calculate_event_count(input_dir, config['code'])
@@ -490,13 +492,13 @@ def load_splicing_summary_table(input_dir: str) -> pd.DataFrame:
 	summary_df = pd.read_csv(os.path.join(input_dir, "splicing", "summary.txt"), sep = "\t")
 	return summary_df
 
-def barplot_splicing(summary_df: pd.DataFrame, png_path: str, pdf_path: str):
+def barplot_splicing(summary_df: pd.DataFrame, png_path: str, pdf_path: str, events: list):
 	
 	g = sns.catplot(
 		data = summary_df,
 		x = "Number",
 		y = "AS",
-		order = ["SE", "FIVE", "THREE", "MXE", "RI", "AFE", "ALE", "MSE"],
+		order = [AS for AS in ["SE", "FIVE", "THREE", "MXE", "RI", "AFE", "ALE", "MSE"] if AS in events],
 		hue = "Direction",
 		hue_order = ["Up", "Down"],
 		col = "Label",
@@ -540,6 +542,13 @@ def main():
 		level = logging.DEBUG if args.verbose else logging.INFO
 	)
 	logger.info("Starting making plots....")
+	try:
+		events = general.parse_events(args.events)
+	except ValueError as e:
+		logger.error(e)
+		sys.exit(1)
+	# Skip event types without results
+	events = [AS for AS in events if os.path.isfile(os.path.join(args.input, "splicing", "PSI_" + AS + ".txt"))]
 
 	# Set variables
 	input_dir = args.input
@@ -555,7 +564,7 @@ def main():
 	os.makedirs(pdf_dir, exist_ok=True)
 	png_path = os.path.join(png_dir, "barplot_splicing_summary.png")
 	pdf_path = os.path.join(pdf_dir, "barplot_splicing_summary.pdf")
-	barplot_splicing(load_splicing_summary_table(input_dir), png_path, pdf_path)
+	barplot_splicing(load_splicing_summary_table(input_dir), png_path, pdf_path, events)
 
 	# Load experiment table
 	logger.info("Loading experiment table....")
@@ -571,12 +580,11 @@ def main():
 	plots_pca("PSI", pca_psi_df, contribution_psi_PC1, contribution_psi_PC2, output_dir)
 	# Splicing events
 	logger.info("Making plots for splicing events....")
-	AS_list = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"]
-	for AS in AS_list:
+	for AS in events:
 		plots(AS, input_dir, output_dir)
 	# Write summary html
 	logger.info("Writing summary html....")
-	write_summary_html(args.shiba_command, input_dir, output_dir)
+	write_summary_html(args.shiba_command, input_dir, output_dir, events)
 
 	logger.info("Making plots completed!")
 
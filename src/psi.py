@@ -5,7 +5,7 @@ import logging
 import sys
 import os
 import pandas as pd
-from lib import shibalib
+from lib import shibalib, general
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -33,6 +33,7 @@ def get_args():
     parser.add_argument("--onlypsi", help = "Just calculate PSI for each sample, not perform statistical tests", action = 'store_true')
     parser.add_argument("--onlypsi-group", help = "Just calculate PSI for each group, not perform statistical tests (Overrides --onlypsi when used together)", action = 'store_true')
     parser.add_argument("--excel", help = "Make result files in excel format", action = 'store_true')
+    parser.add_argument("--events", type = str, help = "Comma-separated event types to analyze, e.g. SE,RI,MXE", default = "all")
     parser.add_argument("-v", "--verbose", action="store_true", help="Verbose output")
 
     args = parser.parse_args()
@@ -71,9 +72,18 @@ def main():
         "excel": args.excel,
     }
 
+    try:
+        event_types = general.parse_events(args.events)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+
     # Load event and junction data
     logger.info("Loading event and junction files...")
-    event_df_dict = shibalib.read_events(paths["event"])
+    event_df_dict = shibalib.read_events(paths["event"], event_types)
+    if not event_df_dict:
+        logger.error(f"No event files found in {paths['event']}")
+        sys.exit(1)
     junc_df = shibalib.read_junctions(paths["junction"])
     junc_dict_all = shibalib.junc_dict(junc_df)
     sample_list = shibalib.make_sample_list(junc_df)
@@ -137,8 +147,8 @@ def main():
         "ALE": (shibalib.event_for_analysis_afe_ale, shibalib.afe_ale, shibalib.col_five_three_afe_ale, shibalib.diff_afe_ale, shibalib.afe_ale_ind)
     }
 
-    # Process each event
-    event_results = {event: process_event(event, *functions) for event, functions in event_definitions.items()}
+    # Process each selected event with an event file
+    event_results = {event: process_event(event, *functions) for event, functions in event_definitions.items() if event in event_df_dict}
 
     # Save PSI matrices
     logger.info("Saving PSI matrices...")
@@ -168,11 +178,9 @@ def main():
     # Save summary file
     logger.info("Saving summary file...")
     if paths["group"] and not params["onlypsi"] and not params["onlypsi_group"]:
-        # Define the event types
-        event_types = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"]
         # Collect event counts
         summary_l = []
-        for event in event_types:
+        for event in event_results:
             logger.debug(f"Counting events for {event}...")
             event_counter = shibalib.EventCounter(event_results[event]["diff"], params["dPSI"])
             event_counts = event_counter.count_all_events()
@@ -196,15 +204,15 @@ def main():
     # Optionally save to Excel
     if params["excel"]:
         logger.info("Exporting results to Excel...")
-        excel_data = []
+        excel_data = {}
         if params["onlypsi_group"]:
-            excel_data = [result["nodiff_group"] for result in event_results.values() if result["nodiff_group"] is not None]
+            excel_data = {event: result["nodiff_group"] for event, result in event_results.items() if result["nodiff_group"] is not None}
         elif params["onlypsi"]:
-            excel_data = [result["nodiff_sample"] for result in event_results.values() if result["nodiff_sample"] is not None]
+            excel_data = {event: result["nodiff_sample"] for event, result in event_results.items() if result["nodiff_sample"] is not None}
         else:
-            excel_data = [result["diff"] for result in event_results.values() if result["diff"] is not None]
+            excel_data = {event: result["diff"] for event, result in event_results.items() if result["diff"] is not None}
         if excel_data:
-            shibalib.save_excel(paths["output"], *excel_data)
+            shibalib.save_excel(paths["output"], excel_data)
         else:
             logger.warning("No data to export to Excel")
 
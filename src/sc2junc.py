@@ -1,11 +1,15 @@
 import warnings
 warnings.simplefilter('ignore')
 import argparse
+import concurrent.futures
+import gzip
 import logging
 import sys
 import os
+import numpy as np
 import pandas as pd
-import scanpy as sc
+from scipy import sparse
+from lib import cellpsi, general, shibalib
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -22,6 +26,13 @@ def get_args():
 
 	parser.add_argument('-i', '--experiment', type = str, help = 'Experiment table', required = True)
 	parser.add_argument('-o', '--out', type = str, help = 'Output junction file', required = True)
+	parser.add_argument('-p', '--processors', type = int, help = 'Number of SJ directories loaded in parallel', default = 1)
+	parser.add_argument('--h5ad', help = 'Also write group x junction read counts as an AnnData h5ad file next to the output junction file (requires anndata)', action = 'store_true')
+	parser.add_argument('--cell-psi', type = str, help = 'Output directory for PSI of each cell and event as sparse matrices (requires --event)')
+	parser.add_argument('--cell-psi-format', type = str, choices = ['npz', 'h5ad'], help = 'Format of per-cell PSI: sparse .npz files with cell and event tables, or an AnnData h5ad file (requires anndata)', default = 'npz')
+	parser.add_argument('-e', '--event', type = str, help = 'Directory that contains text files of alternative splicing events generated by gtf2event.py, used for per-cell PSI')
+	parser.add_argument('--events', type = str, help = 'Comma-separated event types for per-cell PSI', default = 'all')
+	parser.add_argument('-m', '--minimum-reads', type = float, help = 'Minimum read count of the inclusion or exclusion isoform for per-cell PSI', default = 1)
 	parser.add_argument("-v", "--verbose", action="store_true", help="Verbose mode")
 
 	args = parser.parse_args()
@@ -43,19 +54,79 @@ def make_sjpath_list(experiment_table_df):
 	sjpath_list = experiment_table_df["SJ"].tolist()
 	return(sjpath_list)
 
-def load_sj(sj_file):
+def sj_dir_file(sj_dir, name):
 	'''
-	Load SJ file and returns a DataFrame object
+	Returns the path of a file in a STARsolo SJ directory, plain or gzipped
 	'''
 
-	adata = sc.read_mtx(sj_file + "/matrix.mtx")
-	var = pd.read_csv(sj_file + "/barcodes.tsv", header = None)
-	obs = pd.read_csv(sj_file + "/features.tsv", sep = "\t", header = None, usecols = [0, 1, 2])
-	obs["SJ"] = obs[0].astype(str) + ":" + obs[1].astype(str) + "-" + obs[2].astype(str)
-	adata.obs.index = obs["SJ"]
-	adata.var.index = var[0]
+	path = os.path.join(sj_dir, name)
+	if not os.path.exists(path) and os.path.exists(path + ".gz"):
+		path = path + ".gz"
+	return(path)
 
-	return(adata)
+def read_mtx_filtered(mtx_path, keep_cols, block_size = 1 << 22):
+	'''
+	Read a Matrix Market coordinate file (plain or gzipped) in blocks of block_size bytes, keeping only
+	entries in the columns listed in keep_cols (0-based). Memory is bounded by the block size and the kept entries.
+	Returns a sparse matrix of all rows and the kept columns in the order of keep_cols.
+	'''
+
+	opener = gzip.open if mtx_path.endswith(".gz") else open
+	with opener(mtx_path, "rb") as f:
+		# Skip the header and comments up to the dimension line
+		line = f.readline()
+		dtype = np.int64 if b"integer" in line or b"pattern" in line else np.float64
+		pattern = b"pattern" in line
+		while line.startswith(b"%"):
+			line = f.readline()
+		n_rows, n_cols, n_entries = map(int, line.split())
+		col_map = np.full(n_cols + 1, -1, dtype = np.int64)
+		col_map[np.asarray(keep_cols, dtype = np.int64) + 1] = np.arange(len(keep_cols))
+		row_list, col_list, value_list = [], [], []
+		rest = b""
+		while True:
+			block = f.read(block_size)
+			if not block and not rest:
+				break
+			data = rest + block
+			if block:
+				# Parse complete lines only
+				cut = data.rfind(b"\n") + 1
+				data, rest = data[:cut], data[cut:]
+			else:
+				rest = b""
+			entries = np.fromstring(data, dtype = dtype, sep = " ").reshape(-1, 2 if pattern else 3)
+			cols = col_map[entries[:, 1].astype(np.int64)]
+			keep = cols >= 0
+			row_list.append(entries[keep, 0].astype(np.int64) - 1)
+			col_list.append(cols[keep])
+			value_list.append(np.ones(keep.sum()) if pattern else entries[keep, 2])
+	count_matrix = sparse.csr_matrix(
+		(
+			np.concatenate(value_list) if value_list else np.array([]),
+			(np.concatenate(row_list) if row_list else np.array([], dtype = np.int64), np.concatenate(col_list) if col_list else np.array([], dtype = np.int64))
+		),
+		shape = (n_rows, len(keep_cols))
+	)
+	logger.debug(f"Kept {count_matrix.nnz} of {n_entries} entries in {mtx_path}")
+
+	return(count_matrix)
+
+def load_sj(sj_file, barcode_list):
+	'''
+	Load SJ files of barcodes in barcode_list.
+	Returns a sparse junction x barcode matrix, junction IDs and barcodes.
+	'''
+
+	var = pd.read_csv(sj_dir_file(sj_file, "barcodes.tsv"), header = None, dtype = str)
+	obs = pd.read_csv(sj_dir_file(sj_file, "features.tsv"), sep = "\t", header = None, usecols = [0, 1, 2])
+	sj_index = pd.Index(obs[0].astype(str) + ":" + obs[1].astype(str) + "-" + obs[2].astype(str), name = "SJ")
+	barcode_index = pd.Index(var[0])
+	barcode_pos = barcode_index.get_indexer(pd.Index(barcode_list).unique())
+	barcode_pos = np.sort(barcode_pos[barcode_pos >= 0])
+	count_matrix = read_mtx_filtered(sj_dir_file(sj_file, "matrix.mtx"), barcode_pos)
+
+	return(count_matrix, sj_index, barcode_index[barcode_pos])
 
 def make_grouppath_list(experiment_table_df):
 	'''
@@ -74,35 +145,95 @@ def load_group(grouppath):
 	group_df = group_df.drop_duplicates()
 	return(group_df)
 
-def make_sample_group_dict(group_df):
+def grouping_read_count(count_matrix, sj_index, barcode_index, group_df, group_list):
 	'''
-	Generate a dictionary of sample and group
+	Sum junction read counts of barcodes in each group as one sparse product of
+	the junction x barcode matrix and a barcode x group indicator matrix.
+	Returns a DataFrame of junctions with reads in any group.
 	'''
 
-	sample_group_dict = {}
-	group_list = group_df["group"].unique().tolist()
-	for i in range(len(group_list)):
-		sample_group_dict[group_list[i]] = group_df[group_df["group"] == group_list[i]]["barcode"].tolist()
+	barcode_pos = pd.Index(barcode_index).get_indexer(group_df["barcode"])
+	if (barcode_pos < 0).any():
+		logger.warning(f"{(barcode_pos < 0).sum()} barcodes in the group file are not found in the SJ matrix.")
+	group_pos = pd.Index(group_list).get_indexer(group_df["group"])
+	found = barcode_pos >= 0
+	indicator = sparse.csr_matrix(
+		(np.ones(found.sum(), dtype = np.float64), (barcode_pos[found], group_pos[found])),
+		shape = (len(barcode_index), len(group_list))
+	)
+	count_matrix = sparse.csr_matrix(count_matrix) @ indicator
+	count_matrix.eliminate_zeros()
+	# Junctions with reads in any group
+	junction_pos = np.flatnonzero(count_matrix.getnnz(axis = 1))
+	count_df = pd.DataFrame(
+		count_matrix[junction_pos].toarray(),
+		index = pd.Index(sj_index[junction_pos], name = "SJ"),
+		columns = group_list
+	)
 
-	return(sample_group_dict)
+	return(count_df)
 
-def grouping_read_count_each(adata, sample_group_dict, group, j):
+def reduce_run(j, sj_path, group_df, group_list, junction_df = None, event_n = 0):
 	'''
-	Group junction read counts
+	Load an SJ directory and reduce it to junction read counts of each group.
+	With junctions of events, also returns inclusion and exclusion read counts of each barcode and event.
 	'''
 
-	# Sample list
-	if group not in sample_group_dict:
-		count_df = pd.DataFrame()
-	else:
-		sample_list = list(sample_group_dict[group])
-		adata = adata[:, sample_list]
-		count_sum = adata.X.sum(axis = 1).flatten().tolist()[0]
-		# Summarize junction read counts
-		count_df = pd.DataFrame({"SJ": list(adata.obs.index), j: count_sum})
-		count_df = count_df[count_df[j] != 0]
+	logger.debug(f"Loading {sj_path}...")
+	count_matrix, sj_index, barcode_index = load_sj(sj_path, group_df["barcode"])
+	count_df = grouping_read_count(count_matrix, sj_index, barcode_index, group_df, group_list)
+	for group in group_df["group"].unique():
+		if count_df.empty or count_df[group].sum() == 0:
+			logger.warning(f"No junction read counts found for group {group} in sample {j}.")
+	if junction_df is None:
+		return(count_df, None)
+	inclusion, exclusion = cellpsi.cell_counts(count_matrix, sj_index, junction_df, event_n)
 
-	return(count_df)
+	return(count_df, (inclusion, exclusion, barcode_index))
+
+def cell_table(experiment_table_df, group_df_list, barcode_index_list):
+	'''
+	Make a table of cells in the order of the per-cell matrices.
+	Cell IDs are barcodes prefixed with the sample name, since barcodes may be shared by samples.
+	'''
+
+	cell_df_list = []
+	for j, barcode_index in enumerate(barcode_index_list):
+		sample = str(experiment_table_df["sample"].iloc[j]) if "sample" in experiment_table_df.columns else str(j)
+		group_dict = dict(zip(group_df_list[j]["barcode"], group_df_list[j]["group"]))
+		cell_df_list.append(pd.DataFrame({
+			"cell_id": sample + "_" + pd.Series(barcode_index, dtype = str),
+			"barcode": list(barcode_index),
+			"sample": sample,
+			"group": [group_dict[x] for x in barcode_index]
+		}))
+	cell_df = pd.concat(cell_df_list, ignore_index = True)
+
+	return(cell_df)
+
+def write_cell_psi(output, output_format, cell_result_list, cell_df, event_df, minimum_reads):
+	'''
+	Compute per-cell PSI and write cells and events with at least one covered pair
+	'''
+
+	inclusion = sparse.vstack([x[0] for x in cell_result_list], format = "csr")
+	exclusion = sparse.vstack([x[1] for x in cell_result_list], format = "csr")
+	psi = cellpsi.cell_psi(inclusion, exclusion, minimum_reads)
+	cell_pos, event_pos = cellpsi.covered(psi)
+	logger.info(f"{len(cell_pos)} of {psi.shape[0]} cells and {len(event_pos)} of {psi.shape[1]} events are covered")
+	psi = psi[cell_pos][:, event_pos]
+	inclusion = inclusion[cell_pos][:, event_pos]
+	exclusion = exclusion[cell_pos][:, event_pos]
+	cell_df = cell_df.iloc[cell_pos].reset_index(drop = True)
+	event_df = event_df.iloc[event_pos].reset_index(drop = True)
+	if output_format == "h5ad":
+		os.makedirs(output, exist_ok = True)
+		cellpsi.write_h5ad(
+			os.path.join(output, "psi.h5ad"), psi, cell_df.set_index("cell_id"), event_df.set_index("event_id"),
+			{"inclusion": inclusion, "exclusion": exclusion}
+		)
+	else:
+		cellpsi.write_npz(output, psi, inclusion, exclusion, cell_df, event_df)
 
 def formatting_output(count_df):
 	'''
@@ -122,6 +253,16 @@ def formatting_output(count_df):
 
 	return(output_df)
 
+def write_junction_h5ad(h5ad_path, output_df):
+	'''
+	Write junction read counts as a sparse group x junction matrix in an h5ad file, with junction coordinates in .var
+	'''
+
+	count_matrix = sparse.csr_matrix(output_df.iloc[:, 4:].to_numpy(dtype = np.int32).T)
+	obs_df = pd.DataFrame(index = pd.Index(output_df.columns[4:], name = "group"))
+	var_df = output_df[["ID", "chr", "start", "end"]].astype({"start": np.int64, "end": np.int64}).set_index("ID")
+	cellpsi.write_h5ad(h5ad_path, count_matrix, obs_df, var_df)
+
 def main():
 	'''
 	Main function
@@ -139,6 +280,15 @@ def main():
 	# Parse arguments
 	experiment_table = args.experiment
 	output_path = args.out
+	if args.cell_psi and not args.event:
+		logger.error("--cell-psi requires an event directory given by --event")
+		sys.exit(1)
+	if args.h5ad or (args.cell_psi and args.cell_psi_format == "h5ad"):
+		try:
+			import anndata
+		except ImportError:
+			logger.error("anndata is required to write h5ad files. Install anndata or write text and npz files only")
+			sys.exit(1)
 
 	# Make directory
 	logger.info("Making output directory ...")
@@ -152,14 +302,6 @@ def main():
 	logger.info("Making SJ file paths ...")
 	sjpath_list = make_sjpath_list(experiment_table_df)
 
-	# Load SJ files
-	logger.info("Loading SJ files ...")
-	adata_list = []
-	for x in sjpath_list:
-		logger.debug(f"Loading {x}...")
-		adata = load_sj(x)
-		adata_list.append(adata)
-
 	# Make a list of group file paths
 	logger.info("Making group file paths ...")
 	grouppath_list = make_grouppath_list(experiment_table_df)
@@ -168,37 +310,39 @@ def main():
 	logger.info("Loading group files ...")
 	group_df_list = []
 	group_list = []
-	sample_group_dict_list = []
 	for x in grouppath_list:
 		logger.debug(f"Loading {x}...")
 		group_df = load_group(x)
 		group_df_list.append(group_df)
-		sample_group_dict = make_sample_group_dict(group_df)
-		sample_group_dict_list.append(sample_group_dict)
-		group_list += list(sample_group_dict.keys())
+		group_list += group_df["group"].unique().tolist()
 	group_list = sorted(list(set(group_list)))
 
+	# Load events for per-cell PSI
+	junction_df, event_n = None, 0
+	if args.cell_psi:
+		logger.info("Loading events for per-cell PSI ...")
+		try:
+			event_types = general.parse_events(args.events)
+		except ValueError as e:
+			logger.error(e)
+			sys.exit(1)
+		event_df_dict = shibalib.read_events_sc(args.event, [x for x in event_types if x != "RI"])
+		event_df, junction_df = cellpsi.event_junctions(event_df_dict)
+		event_n = len(event_df)
+		logger.debug(f"{event_n} events with {len(junction_df)} junctions")
+
+	# Load SJ files and group junction read counts
 	logger.info("Grouping junction read counts ...")
-	sj_grouped_df = pd.DataFrame()
-	for group in group_list:
-		logger.debug(f"Group: {group}")
-		sj_tmp_df = pd.DataFrame()
-		for j in range(len(adata_list)):
-			logger.debug(f"Sample: {j}")
-			tmp_df = grouping_read_count_each(adata_list[j], sample_group_dict_list[j], group, j)
-			if tmp_df.empty:
-				logger.warning(f"No junction read counts found for group {group} in sample {j}.")
-				continue
-			sj_tmp_df = pd.merge(sj_tmp_df, tmp_df, on="SJ", how="outer").fillna(0) if not sj_tmp_df.empty else tmp_df
-
-		sj_tmp_df = sj_tmp_df.set_index("SJ")
-		# Summarize junction read counts
-		sj_tmp_df = pd.DataFrame({group: sj_tmp_df.sum(axis = 1)})
-		if sj_grouped_df.empty:
-			sj_grouped_df = sj_tmp_df
-		else:
-			sj_grouped_df = pd.merge(sj_grouped_df, sj_tmp_df, on = "SJ", how = "outer")
-			sj_grouped_df = sj_grouped_df.fillna(0)
+	with concurrent.futures.ProcessPoolExecutor(max_workers = args.processors) as executor:
+		futures = [
+			executor.submit(reduce_run, j, x, group_df_list[j], group_list, junction_df, event_n)
+			for j, x in enumerate(sjpath_list)
+		]
+		result_list = [future.result() for future in futures]
+	count_df_list = [x[0] for x in result_list]
+
+	# Sum junction read counts across SJ files
+	sj_grouped_df = pd.concat(count_df_list).groupby(level = 0).sum()
 
 	# Formatting output junction file
 	logger.info("Formatting output junction file ...")
@@ -207,6 +351,18 @@ def main():
 	# Write output junction file
 	logger.info("Writing output junction file ...")
 	output_df.to_csv(output_path, sep = "\t", index = False)
+	if args.h5ad:
+		h5ad_path = os.path.splitext(output_path)[0] + ".h5ad"
+		logger.info(f"Writing junction read counts to {h5ad_path} ...")
+		write_junction_h5ad(h5ad_path, output_df)
+
+	# Per-cell PSI
+	if args.cell_psi:
+		logger.info("Calculating per-cell PSI ...")
+		cell_result_list = [x[1] for x in result_list]
+		cell_df = cell_table(experiment_table_df, group_df_list, [x[2] for x in cell_result_list])
+		write_cell_psi(args.cell_psi, args.cell_psi_format, cell_result_list, cell_df, event_df, args.minimum_reads)
+		logger.info(f"Per-cell PSI written to {args.cell_psi}")
 
 	logger.info("All processes completed.")
 
@@ -5,7 +5,7 @@ import logging
 import sys
 import os
 import pandas as pd
-from lib import shibalib
+from lib import cellpsi, shibalib, general
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -32,9 +32,12 @@ def get_args():
     parser.add_argument("-d", "--psi", type = float, help = "Threshold of delta PSI for detecting differential events", default = 0.1)
     parser.add_argument("-r", "--reference", type = str, help = "Reference group for detecting differential events")
     parser.add_argument("-a", "--alternative", type = str, help = "Alternative group for detecting differential events")
+    parser.add_argument("-c", "--contrasts", type = str, help = "Contrasts for detecting differential events instead of --reference and --alternative: all-pairs, one-vs-rest, or a tab-separated file of reference and alternative groups, one contrast per line")
     parser.add_argument("-m", "--minimum-reads", type = int, help = "Minumum value of total reads for each junction for detecting differential events", default = 10)
     parser.add_argument("--onlypsi", help = "Just calculate PSI for each sample, not perform statistical tests", type = str2bool, nargs = "?", const = True, default = False)
     parser.add_argument("--excel", help = "Make result files in excel format", type = str2bool, nargs = "?", const = True, default = False)
+    parser.add_argument("--h5ad", help = "Make a file of PSI of each group in h5ad format (requires anndata)", type = str2bool, nargs = "?", const = True, default = False)
+    parser.add_argument("--events", type = str, help = "Comma-separated event types to analyze, e.g. SE,MXE (RI is not supported for single-cell data)", default = "all")
     parser.add_argument("-v", "--verbose", action="store_true", help="Verbose output")
     args = parser.parse_args()
     return(args)
@@ -63,32 +66,62 @@ def main():
         "dPSI": args.psi,
         "reference": args.reference,
         "alternative": args.alternative,
+        "contrasts": args.contrasts,
         "minimum_reads": args.minimum_reads,
         "onlypsi": args.onlypsi,
         "excel": args.excel,
+        "h5ad": args.h5ad,
     }
+    if params["h5ad"]:
+        try:
+            import anndata
+        except ImportError:
+            logger.error("anndata is required to make files in h5ad format")
+            sys.exit(1)
+
+    try:
+        event_types = general.parse_events(args.events)
+    except ValueError as e:
+        logger.error(e)
+        sys.exit(1)
+    if "RI" in event_types:
+        if args.events.strip().lower() != "all":
+            logger.warning("RI events are not supported for single-cell data. Skipping RI events.")
+        event_types = [event for event in event_types if event != "RI"]
+        if not event_types:
+            logger.error("No event types to analyze")
+            sys.exit(1)
 
     # Load event and junction data
     logger.info("Loading event and junction files...")
-    event_df_dict = shibalib.read_events(paths["event"])
+    event_df_dict = shibalib.read_events(paths["event"], event_types)
+    if not event_df_dict:
+        logger.error(f"No event files found in {paths['event']}")
+        sys.exit(1)
     junc_df = shibalib.read_junctions(paths["junction"])
-    junc_dict_all = shibalib.junc_dict(junc_df)
     sample_list = shibalib.make_sample_list(junc_df)
     junc_set = shibalib.make_junc_set(junc_df)
 
     # Group handling
-    group_data = {}
     if not params["onlypsi"]:
         logger.info("Processing group information...")
-        if params["reference"] in sample_list and params["alternative"] in sample_list:
-            logger.info(f"{params['reference']} vs. {params['alternative']}")
-            group_list = [params["reference"], params["alternative"]]
-            junc_group_df = junc_df[["chr", "start", "end", "ID"] + group_list]
-            junc_dict_group = shibalib.junc_dict(junc_group_df)
-            group_data = {"group_list": group_list, "junc_dict_group": junc_dict_group, "group_df": junc_group_df, "sample_list_diff": sample_list}
-        else:
-            logger.error(f"Error: {params['reference']} or {params['alternative']} is not in the sample list")
+        try:
+            if params["contrasts"]:
+                contrast_list = shibalib.parse_contrasts(params["contrasts"], sample_list)
+            elif params["reference"] in sample_list and params["alternative"] in sample_list:
+                contrast_list = [(params["reference"], params["alternative"])]
+            else:
+                raise ValueError(f"Error: {params['reference']} or {params['alternative']} is not in the sample list")
+        except ValueError as e:
+            logger.error(e)
             sys.exit(1)
+        for reference, alternative in contrast_list:
+            logger.info(f"{reference} vs. {alternative}")
+        # PSI of each group is calculated once for all contrasts
+        group_list = [group for group in sample_list if any(group in contrast for contrast in contrast_list)]
+        junc_dict_group = shibalib.junc_dict(junc_df[["chr", "start", "end", "ID"] + group_list])
+    else:
+        junc_dict_all = shibalib.junc_dict(junc_df)
 
     # Define event processing
     def process_event(event_type, event_func, func, col_func, diff_func=None, index_func=None):
@@ -102,27 +135,18 @@ def main():
         event_for_analysis_df = event_func(event_df_dict[event_type], junc_set)
 
         # Generate PSI tables
-        psi_table_group_df, psi_table_sample_df = None, None
-        if not params["onlypsi"]:
-            psi_table_group_df = shibalib.make_psi_table_group(group_data["group_list"], event_for_analysis_df, group_data["junc_dict_group"], func, col_func, params["num_process"], params["minimum_reads"])
-        else:
-            psi_table_sample_df = shibalib.make_psi_table_sample(sample_list, event_for_analysis_df, junc_dict_all, func, col_func, params["num_process"], params["minimum_reads"])
-
-        # Perform differential analysis
-        diff_df = None
         nodiff_sample_df = None
         output_mtx_sample_df = None
+        event_data = None
         if not params["onlypsi"]:
-            diff_df = shibalib.diff_event(
-                event_for_analysis_df, psi_table_group_df, junc_dict_all, False,
-                [params["reference"], params["alternative"]], sample_list,
-                diff_func, index_func, params["num_process"], params["FDR"], params["dPSI"], False, False
-            )
+            psi_table_group_df = shibalib.make_psi_table_group(group_list, event_for_analysis_df, junc_dict_group, func, col_func, params["num_process"], params["minimum_reads"])
+            event_data = (event_for_analysis_df, psi_table_group_df, func, col_func, diff_func, index_func)
         else:
+            psi_table_sample_df = shibalib.make_psi_table_sample(sample_list, event_for_analysis_df, junc_dict_all, func, col_func, params["num_process"], params["minimum_reads"])
             # Generate PSI matrices
             nodiff_sample_df, output_mtx_sample_df = (shibalib.make_psi_mtx(psi_table_sample_df) if psi_table_sample_df is not None else (None, None))
 
-        return {"nodiff_sample": nodiff_sample_df, "output_mtx_sample": output_mtx_sample_df, "diff": diff_df}
+        return {"nodiff_sample": nodiff_sample_df, "output_mtx_sample": output_mtx_sample_df, "event_data": event_data}
 
     # Define events and functions
     event_definitions = {
@@ -135,8 +159,18 @@ def main():
         "ALE": (shibalib.event_for_analysis_afe_ale, shibalib.afe_ale, shibalib.col_five_three_afe_ale, shibalib.diff_afe_ale, shibalib.afe_ale_ind)
     }
 
-    # Process each event
-    event_results = {event: process_event(event, *functions) for event, functions in event_definitions.items()}
+    # Process each selected event with an event file
+    event_results = {event: process_event(event, *functions) for event, functions in event_definitions.items() if event in event_df_dict}
+
+    # Perform differential analysis
+    if not params["onlypsi"]:
+        logger.info(f"Performing differential analysis of {len(contrast_list)} contrasts...")
+        event_data_dict = {event: result["event_data"] for event, result in event_results.items()}
+        one_vs_rest = any(reference == shibalib.REST_GROUP for reference, _ in contrast_list)
+        junc_count_df = junc_df[["ID"] + sample_list] if one_vs_rest else None
+        contrast_results = shibalib.diff_contrasts(
+            contrast_list, event_data_dict, junc_count_df, params["num_process"], params["minimum_reads"], params["FDR"], params["dPSI"]
+        )
 
     # Save PSI matrices
     logger.info("Saving PSI matrices...")
@@ -149,43 +183,52 @@ def main():
             if result["nodiff_sample"] is not None:
                 result["nodiff_sample"].to_csv(f"{paths['output']}/PSI_{event}.txt", sep="\t", index=False)
     else:
-        for event, result in event_results.items():
-            if result["diff"] is not None:
-                result["diff"].to_csv(f"{paths['output']}/PSI_{event}.txt", sep="\t", index=False)
+        # Results of --contrasts are saved in a directory for each contrast
+        contrast_dirs = {
+            contrast: os.path.join(paths["output"], f"{contrast[0]}_vs_{contrast[1]}") if params["contrasts"] else paths["output"]
+            for contrast in contrast_list
+        }
+        for contrast, diff_df_dict in contrast_results.items():
+            os.makedirs(contrast_dirs[contrast], exist_ok=True)
+            for event, diff_df in diff_df_dict.items():
+                if diff_df is not None:
+                    diff_df.to_csv(os.path.join(contrast_dirs[contrast], f"PSI_{event}.txt"), sep="\t", index=False)
 
     # Save summary file
     logger.info("Saving summary file...")
     if not params["onlypsi"]:
-        # Define the event types
-        event_types = ["SE", "FIVE", "THREE", "MXE", "MSE", "AFE", "ALE"]
-        # Collect event counts
-        summary_l = []
-        for event in event_types:
-            logger.debug(f"Counting events for {event}...")
-            event_counter = shibalib.EventCounter(event_results[event]["diff"], params["dPSI"])
-            event_counts = event_counter.count_all_events()
-            summary_l.extend([
-                [event, "Up", "annotated", event_counts["up_annotated_num"]],
-                [event, "Down", "annotated", event_counts["down_annotated_num"]],
-                [event, "Up", "unannotated", event_counts["up_unannotated_num"]],
-                [event, "Down", "unannotated", event_counts["down_unannotated_num"]],
-            ])
-        # Create and save the summary DataFrame
-        summary_df = pd.DataFrame(
-            summary_l,
-            columns=["AS", "Direction", "Label", "Number"]
-        )
-        summary_df.to_csv(
-            os.path.join(paths["output"], "summary.txt"),
-            sep="\t",
-            index=False,
+        summary_df_list = []
+        for contrast, diff_df_dict in contrast_results.items():
+            summary_df = shibalib.summarize_diff(diff_df_dict, params["dPSI"])
+            summary_df.to_csv(os.path.join(contrast_dirs[contrast], "summary.txt"), sep="\t", index=False)
+            summary_df.insert(0, "Alternative", contrast[1])
+            summary_df.insert(0, "Reference", contrast[0])
+            summary_df_list.append(summary_df)
+        if params["contrasts"]:
+            # Combined summary of all contrasts
+            pd.concat(summary_df_list).to_csv(os.path.join(paths["output"], "summary.txt"), sep="\t", index=False)
+
+    # Optionally save to h5ad
+    if params["h5ad"]:
+        logger.info("Exporting PSI to h5ad...")
+        psi, inclusion, exclusion, annotation_df = cellpsi.group_psi(junc_df, event_df_dict, params["minimum_reads"])
+        _, event_pos = cellpsi.covered(psi)
+        cellpsi.write_h5ad(
+            os.path.join(paths["output"], "PSI.h5ad"),
+            cellpsi.dense_psi(psi[:, event_pos]),
+            pd.DataFrame(index = pd.Index(sample_list, name = "group")),
+            annotation_df.iloc[event_pos].set_index("event_id"),
+            {"inclusion": inclusion[:, event_pos].toarray(), "exclusion": exclusion[:, event_pos].toarray()}
         )
 
     # Optionally save to Excel
     if params["excel"]:
         logger.info("Exporting results to Excel...")
-        results_to_save = [result["nodiff_sample"] if params["onlypsi"] else result["diff"] for result in event_results.values()]
-        shibalib.save_excel_sc(paths["output"], *results_to_save)
+        if params["onlypsi"]:
+            shibalib.save_excel_sc(paths["output"], {event: result["nodiff_sample"] for event, result in event_results.items()})
+        else:
+            for contrast, diff_df_dict in contrast_results.items():
+                shibalib.save_excel_sc(contrast_dirs[contrast], diff_df_dict)
 
     logger.info("All processes completed.")
 
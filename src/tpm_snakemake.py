@@ -35,33 +35,13 @@ def get_args():
 
 def merge_table(countfiles, reference_gtf):
 
-	count_all_df = pd.DataFrame()
-	for i in range(len(countfiles)):
-		sample = countfiles[i].split('/')[-1].rstrip("_counts.txt")
-		count_df = pd.read_csv(
-			countfiles[i],
-			sep = "\t",
-			skiprows = 1,
-			usecols = [0, 5, 6],
-			dtype = {
-				0: "str",
-				5: "int32",
-				6: "int32"
-			}
-		)
-
-		count_df.columns = count_df.columns[0:2].tolist() + [sample]
-		if count_all_df.empty:
-			count_all_df = count_df
-		else:
-			count_all_df = pd.merge(
-				count_all_df,
-				count_df[["Geneid", sample]],
-				on = "Geneid"
-			)
-
-	count_all_df = count_all_df.rename(columns = {"Geneid": "gene_id"})
-	count_all_df = count_all_df.sort_values("gene_id")
+	# Sample names are taken from file names such as {sample}_counts.txt
+	count_df_list = []
+	for countfile in countfiles:
+		sample = os.path.basename(countfile)
+		sample = sample[:-len("_counts.txt")] if sample.endswith("_counts.txt") else sample
+		count_df_list.append(expression.read_counts(countfile, [sample]))
+	count_all_df = expression.merge_counts(count_df_list)
 	return(count_all_df)
 
 def main():
@@ -105,9 +85,9 @@ def main():
 			index = False
 		)
 
-	# Calculate TPM and CPM
-	logger.info("Calculate TPM...")
-	tpm_df = expression.ExpressionProcessor(merged_table_df.copy()).TPM()
+	# Calculate TPM and CPM in one pass
+	logger.info("Calculate TPM and CPM...")
+	tpm_df, cpm_df = expression.ExpressionProcessor(merged_table_df).normalize()
 	try:
 		tpm_df['gene_name'] = tpm_df['gene_id'].map(gene_dict)
 	except Exception as e:
@@ -120,8 +100,6 @@ def main():
 	# Save TPM
 	tpm_df.to_csv(os.path.join(args.output, "TPM.txt"), sep = "\t", index = False)
 
-	logger.info("Calculate CPM...")
-	cpm_df = expression.ExpressionProcessor(merged_table_df.copy()).CPM()
 	try:
 		cpm_df['gene_name'] = cpm_df['gene_id'].map(gene_dict)
 	except Exception as e:
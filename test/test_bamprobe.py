@@ -0,0 +1,66 @@
+import unittest
+import os
+import sys
+import json
+import tempfile
+import pysam
+# Add parent directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib import bamprobe
+
+class TestBamProbe(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.bam = os.path.join(self.tmp_dir.name, "test.bam")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_bam(self, paired, n=20, length=50):
+        header = {"HD": {"VN": "1.6", "SO": "coordinate"}, "SQ": [{"SN": "chr1", "LN": 10000}, {"SN": "chr2", "LN": 10000}]}
+        with pysam.AlignmentFile(self.bam, "wb", header=header) as bam:
+            for i in range(n):
+                read = pysam.AlignedSegment()
+                read.query_name = f"read{i}"
+                read.query_sequence = "A" * length
+                read.flag = 0x1 | 0x40 if paired else 0
+                read.reference_id = 0
+                read.reference_start = 100 + i
+                read.cigarstring = f"{length}M"
+                read.mapping_quality = 60
+                bam.write(read)
+
+    def test_probe(self):
+        self.write_bam(paired=True)
+        result = bamprobe.probe(self.bam)
+        self.assertTrue(result["paired"])
+        self.assertEqual(result["read_length"]["median"], 50)
+        self.assertEqual(result["read_length"]["distribution"], [[50, 20]])
+        self.assertTrue(result["chr_prefix"])
+        self.assertFalse(result["indexed"])
+        self.assertIsNone(result["mapped"])
+        # Index information is not cached
+        pysam.index(self.bam)
+        result = bamprobe.probe(self.bam)
+        self.assertTrue(result["indexed"])
+        self.assertEqual(result["mapped"], 20)
+
+    def test_sidecar(self):
+        self.write_bam(paired=False)
+        self.assertFalse(bamprobe.probe(self.bam)["paired"])
+        sidecar = bamprobe.sidecar_path(self.bam)
+        self.assertTrue(os.path.isfile(sidecar))
+        # The cached result is reused while the BAM file is unchanged
+        with open(sidecar, "r") as f:
+            cached = json.load(f)
+        cached["result"]["paired"] = True
+        with open(sidecar, "w") as f:
+            json.dump(cached, f)
+        self.assertTrue(bamprobe.probe(self.bam)["paired"])
+        # and invalidated when it is rewritten
+        self.write_bam(paired=False, n=30)
+        os.utime(self.bam, ns=(0, 0))
+        self.assertFalse(bamprobe.probe(self.bam)["paired"])
+
+if __name__ == "__main__":
+    unittest.main()
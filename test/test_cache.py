@@ -0,0 +1,52 @@
+import unittest
+import os
+import sys
+import tempfile
+# Add parent directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib import cache
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        self.gtf = os.path.join(self.tmp_dir.name, "test.gtf")
+        with open(self.gtf, "w") as f:
+            f.write('chr1\tsrc\texon\t100\t200\t.\t+\t.\tgene_id "G1"; transcript_id "T1";\n')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_save_and_load(self):
+        obj = {"G1": {"exon_list": {"chr1:100-200"}}}
+        path = cache.cache_path(self.cache_dir, "gene_model", self.gtf)
+        self.assertIsNone(cache.load(path))
+        cache.save(obj, path)
+        self.assertEqual(cache.load(path), obj)
+
+    def test_cache_path_changes_with_content(self):
+        path1 = cache.cache_path(self.cache_dir, "gene_model", self.gtf)
+        with open(self.gtf, "a") as f:
+            f.write('chr1\tsrc\texon\t300\t400\t.\t+\t.\tgene_id "G1"; transcript_id "T1";\n')
+        path2 = cache.cache_path(self.cache_dir, "gene_model", self.gtf)
+        self.assertNotEqual(path1, path2)
+
+    def test_load_corrupted(self):
+        path = os.path.join(self.cache_dir, "broken.pkl")
+        os.makedirs(self.cache_dir)
+        with open(path, "wb") as f:
+            f.write(b"not a pickle")
+        self.assertIsNone(cache.load(path))
+
+    def test_evict(self):
+        paths = [os.path.join(self.cache_dir, f"entry{i}.pkl") for i in range(3)]
+        for i, path in enumerate(paths):
+            cache.save(b"x" * 1000, path)
+            os.utime(path, (i, i))
+        removed = cache.evict(self.cache_dir, 2500, keep=[paths[0]])
+        self.assertEqual(removed, [os.path.abspath(paths[1])])
+        self.assertTrue(os.path.exists(paths[0]))
+        self.assertTrue(os.path.exists(paths[2]))
+
+if __name__ == "__main__":
+    unittest.main()
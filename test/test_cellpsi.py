@@ -0,0 +1,74 @@
+import unittest
+import os
+import sys
+import numpy as np
+import pandas as pd
+from scipy import sparse
+# Add parent directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib import cellpsi
+
+class TestCellPsi(unittest.TestCase):
+    def setUp(self):
+        self.event_df_dict = {
+            "SE": pd.DataFrame({
+                "event_id": ["SE_1"], "intron_a": ["chr1:100-200"], "intron_b": ["chr1:300-400"], "intron_c": ["chr1:100-400"],
+                "strand": ["+"], "gene_id": ["G1"], "gene_name": ["Gene1"], "label": ["annotated"]
+            }),
+            "MSE": pd.DataFrame({
+                "event_id": ["MSE_1"], "intron": ["chr1:100-200;chr1:300-400;chr1:500-600;chr1:100-600"],
+                "strand": ["+"], "gene_id": ["G1"], "gene_name": ["Gene1"], "label": ["annotated"]
+            }),
+        }
+        # STARsolo junctions and read counts of three cells
+        self.sj_index = pd.Index(["chr1:101-199", "chr1:301-399", "chr1:101-399", "chr1:501-599", "chr1:101-599"])
+        self.count_matrix = sparse.csr_matrix(np.array([
+            [4, 0, 0],
+            [2, 0, 0],
+            [1, 0, 0],
+            [3, 0, 0],
+            [0, 5, 0],
+        ]))
+
+    def test_event_junctions(self):
+        event_df, junction_df = cellpsi.event_junctions(self.event_df_dict)
+        self.assertEqual(event_df["event_id"].tolist(), ["SE_1", "MSE_1"])
+        self.assertEqual(event_df["event_type"].tolist(), ["SE", "MSE"])
+        mse_df = junction_df[junction_df["event"] == 1]
+        self.assertEqual(mse_df[~mse_df["inclusion"]]["junction"].tolist(), ["chr1:101-599"])
+        self.assertEqual(mse_df[mse_df["inclusion"]]["weight"].tolist(), [1 / 3] * 3)
+        self.assertEqual(cellpsi.star_junction_id(pd.Series(["GL456354.1:83560-84521"])).tolist(), ["GL456354.1:83561-84520"])
+
+    def test_cell_psi(self):
+        event_df, junction_df = cellpsi.event_junctions(self.event_df_dict)
+        inclusion, exclusion = cellpsi.cell_counts(self.count_matrix, self.sj_index, junction_df, len(event_df))
+        self.assertEqual(inclusion.shape, (3, 2))
+        np.testing.assert_allclose(inclusion.toarray(), [[3, 3], [0, 0], [0, 0]])
+        np.testing.assert_allclose(exclusion.toarray(), [[1, 0], [0, 5], [0, 0]])
+        psi = cellpsi.cell_psi(inclusion, exclusion, minimum_reads=2)
+        # PSI of zero is stored, pairs without coverage are not
+        self.assertEqual(psi.nnz, 3)
+        np.testing.assert_allclose(psi.toarray(), [[0.75, 1], [0, 0], [0, 0]])
+        self.assertEqual(psi[1].indices.tolist(), [1])
+        self.assertEqual(psi[1].data.tolist(), [0])
+        cell_pos, event_pos = cellpsi.covered(psi)
+        self.assertEqual(cell_pos.tolist(), [0, 1])
+        self.assertEqual(event_pos.tolist(), [0, 1])
+        # Pairs below the minimum read count have no PSI
+        self.assertEqual(cellpsi.cell_psi(inclusion, exclusion, minimum_reads=6).nnz, 0)
+
+    def test_group_psi(self):
+        junc_df = pd.DataFrame({
+            "chr": ["chr1"] * 3, "start": ["100", "300", "100"], "end": ["200", "400", "400"],
+            "ID": ["chr1:100-200", "chr1:300-400", "chr1:100-400"], "A": [10, 20, 5], "B": [0, 0, 0]
+        })
+        psi, inclusion, exclusion, event_df = cellpsi.group_psi(junc_df, {"SE": self.event_df_dict["SE"]}, minimum_reads=10)
+        np.testing.assert_allclose(inclusion.toarray(), [[15], [0]])
+        np.testing.assert_allclose(exclusion.toarray(), [[5], [0]])
+        psi_dense = cellpsi.dense_psi(psi)
+        self.assertAlmostEqual(psi_dense[0, 0], 0.75)
+        self.assertTrue(np.isnan(psi_dense[1, 0]))
+        self.assertEqual(event_df["event_id"].tolist(), ["SE_1"])
+
+if __name__ == "__main__":
+    unittest.main()
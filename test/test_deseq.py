@@ -0,0 +1,62 @@
+import unittest
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+# Add parent directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib import deseq
+
+class TestSizeFactors(unittest.TestCase):
+    def test_median_of_ratios(self):
+        counts = np.array([[10, 20, 40], [5, 10, 20], [0, 3, 3], [8, 16, 32]], dtype=np.float64)
+        # Genes with a zero count are not used
+        np.testing.assert_allclose(deseq.size_factors(counts), [0.5, 1, 2])
+
+class TestDeseq(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        gene_n = 300
+        base_mean = np.exp(rng.uniform(np.log(20), np.log(2000), gene_n))
+        fold_change = np.ones(gene_n)
+        fold_change[:10] = 8
+        sf = np.array([0.8, 1.0, 1.2, 0.9, 1.1, 1.0])
+        alt = np.array([0, 0, 0, 1, 1, 1])
+        mu = base_mean[:, None] * sf[None, :] * np.where(alt == 1, fold_change[:, None], 1)
+        disp = 0.05
+        counts = rng.negative_binomial(1 / disp, 1 / (1 + mu * disp))
+        self.samples = ["A1", "A2", "A3", "B1", "B2", "B3"]
+        self.count_df = pd.DataFrame(counts, index=[f"G{i}" for i in range(gene_n)], columns=self.samples)
+        self.count_df.loc["G_low"] = [1, 0, 0, 2, 0, 1]
+        self.condition = pd.Series(["A", "A", "A", "B", "B", "B"], index=self.samples)
+
+    def test_deseq(self):
+        result_df = deseq.deseq(self.count_df, self.condition, "A", "B")
+        self.assertEqual(result_df.columns.tolist(), ["baseMean", "log2FoldChange", "lfcSE", "stat", "pvalue", "padj"])
+        # Genes with no more than six reads are not tested
+        self.assertNotIn("G_low", result_df.index)
+        significant = result_df.index[result_df["padj"] < 0.05]
+        self.assertTrue({f"G{i}" for i in range(10)} <= set(significant))
+        self.assertLess(len(significant), 15)
+        self.assertTrue(np.all(np.abs(result_df.loc["G0":"G9", "log2FoldChange"] - 3) < 1))
+
+    def test_write_deg(self):
+        result_df = deseq.deseq(self.count_df, self.condition, "A", "B")
+        gene_name = pd.Series("Gene" + self.count_df.index.str[1:], index=self.count_df.index)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = os.path.join(tmpdir, "DEG.txt")
+            deseq.write_deg(result_df, output_file, gene_name)
+            deg_df = pd.read_csv(output_file, sep="\t")
+        self.assertEqual(deg_df.columns.tolist(), ["gene_id", "gene_name", "baseMean", "log2FoldChange", "lfcSE", "stat", "pvalue", "padj"])
+        self.assertEqual(deg_df["gene_name"].iloc[0], "Gene" + deg_df["gene_id"].iloc[0][1:])
+        padj = deg_df["padj"].dropna()
+        self.assertTrue(padj.is_monotonic_increasing)
+        self.assertTrue(deg_df["padj"].iloc[len(padj):].isna().all())
+
+    def test_missing_group(self):
+        with self.assertRaises(ValueError):
+            deseq.deseq(self.count_df, self.condition, "A", "C")
+
+if __name__ == "__main__":
+    unittest.main()
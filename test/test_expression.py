@@ -1,9 +1,13 @@
 import unittest
+import numpy as np
 import pandas as pd
+import pysam
 import os
 import sys
+import tempfile
 # Add parent directory to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib import expression
 from lib.expression import ExpressionProcessor
 
 class TestExpressionProcessor(unittest.TestCase):
@@ -49,5 +53,111 @@ class TestExpressionProcessor(unittest.TestCase):
         ]
         pd.testing.assert_frame_equal(processed_df.set_index("Gene"), expected_df.set_index("Gene"), atol=0.01)
 
+    def test_normalize(self):
+        tpm_df, cpm_df = ExpressionProcessor(self.df.copy(), dtype=np.float32, chunksize=2).normalize()
+        pd.testing.assert_frame_equal(tpm_df, self.processor.TPM(), check_dtype=False, atol=0.01)
+        pd.testing.assert_frame_equal(cpm_df, ExpressionProcessor(self.df.copy()).CPM(), check_dtype=False, atol=0.01)
+        self.assertEqual(tpm_df["Sample1"].dtype, np.float32)
+
+    def test_normalize_in_place(self):
+        counts = np.array(self.df[["Sample1", "Sample2"]], dtype=np.float64)
+        tpm = np.empty_like(counts)
+        expression.normalize_counts(counts, self.df["Length"].to_numpy(), tpm_out=tpm, cpm_out=counts, chunksize=2)
+        np.testing.assert_allclose(tpm, 10**6 / 3)
+        np.testing.assert_allclose(counts[:, 0], np.array([50, 100, 75]) / 225 * 10**6)
+
+class TestMergeCounts(unittest.TestCase):
+    def test_merge_counts(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # featureCounts output of two BAM files and of one BAM file
+            with open(os.path.join(tmp_dir, "batch1_counts.txt"), "w") as f:
+                f.write("# Program:featureCounts\nGeneid\tChr\tStart\tEnd\tStrand\tLength\ta.bam\tb.bam\nGene2\tchr1\t1\t100\t+\t100\t5\t6\nGene1\tchr1\t1\t50\t+\t50\t1\t2\n")
+            with open(os.path.join(tmp_dir, "batch2_counts.txt"), "w") as f:
+                f.write("# Program:featureCounts\nGeneid\tChr\tStart\tEnd\tStrand\tLength\tc.bam\nGene1\tchr1\t1\t50\t+\t50\t7\nGene3\tchr1\t1\t20\t+\t20\t9\n")
+            count_df = expression.merge_counts([
+                expression.read_counts(os.path.join(tmp_dir, "batch1_counts.txt"), ["Sample1", "Sample2"]),
+                expression.read_counts(os.path.join(tmp_dir, "batch2_counts.txt"), ["Sample3"])
+            ])
+        # Genes missing from a file are kept with no reads
+        expected_df = pd.DataFrame({
+            "gene_id": ["Gene1", "Gene2", "Gene3"],
+            "Length": [50, 100, 20],
+            "Sample1": [1, 5, 0],
+            "Sample2": [2, 6, 0],
+            "Sample3": [7, 0, 9]
+        })
+        pd.testing.assert_frame_equal(count_df.reset_index(drop=True), expected_df, check_dtype=False)
+
+class TestCountGenes(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.gtf = os.path.join(self.tmp_dir.name, "genes.gtf")
+        with open(self.gtf, "w") as f:
+            f.write('chr1\ttest\tgene\t101\t400\t.\t+\t.\tgene_id "G1"; gene_name "Gene1";\n')
+            f.write('chr1\ttest\texon\t101\t200\t.\t+\t.\tgene_id "G1"; gene_name "Gene1";\n')
+            f.write('chr1\ttest\texon\t301\t400\t.\t+\t.\tgene_id "G1"; gene_name "Gene1";\n')
+            f.write('chr1\ttest\texon\t381\t450\t.\t-\t.\tgene_id "G2"; gene_name "Gene2";\n')
+            f.write('chr2\ttest\texon\t101\t200\t.\t+\t.\tgene_id "G3"; gene_name "Gene3";\n')
+        self.bam = os.path.join(self.tmp_dir.name, "test.bam")
+        header = {"HD": {"VN": "1.6", "SO": "coordinate"}, "SQ": [{"SN": "chr1", "LN": 10000}, {"SN": "chr2", "LN": 10000}]}
+        reads = [
+            # (name, chromosome, start, cigar, mate, mate chromosome, NH)
+            ("gene1", 0, 120, "20M", None, None, 1),
+            ("intronic", 0, 220, "20M", None, None, 1),
+            ("ambiguous", 0, 390, "20M", None, None, 1),
+            ("multi", 0, 120, "20M", None, None, 2),
+            ("fragment", 0, 150, "20M", 1, 0, 1),
+            ("fragment", 0, 310, "20M", 2, 0, 1),
+            ("spliced", 0, 190, "10M100N10M", None, None, 1),
+            ("singleton", 0, 130, "20M", 1, -1, 1),
+            ("split", 0, 130, "20M", 1, 1, 1),
+            ("split", 1, 120, "20M", 2, 0, 1),
+            ("gene3", 1, 150, "20M", None, None, 1),
+        ]
+        reads.sort(key=lambda x: (x[1], x[2]))
+        with pysam.AlignmentFile(self.bam, "wb", header=header) as bam:
+            for name, tid, start, cigar, mate, mate_tid, nh in reads:
+                read = pysam.AlignedSegment()
+                read.query_name = name
+                read.query_sequence = "A" * 20
+                read.flag = 0 if mate is None else 0x1 | (0x40 if mate == 1 else 0x80) | (0x8 if mate_tid == -1 else 0)
+                read.reference_id = tid
+                read.reference_start = start
+                read.cigarstring = cigar
+                read.next_reference_id = -1 if mate is None else mate_tid
+                read.mapping_quality = 60
+                read.set_tag("NH", nh)
+                bam.write(read)
+        pysam.index(self.bam)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_flatten_exons(self):
+        self.assertEqual(
+            expression.flatten_exons([(300, 400, 0), (100, 200, 0), (380, 450, 1), (100, 150, 0)]),
+            ([100, 300, 380, 400], [200, 380, 400, 450], [(0,), (0,), (0, 1), (1,)])
+        )
+
+    def count(self, paired):
+        output = os.path.join(self.tmp_dir.name, "count.txt")
+        gene_model = expression.read_gene_model(self.gtf)
+        assigned_n = expression.count_genes(self.bam, gene_model, output, paired=paired, processors=2)
+        count_df = pd.read_csv(output, sep="\t", skiprows=1)
+        self.assertEqual(count_df["Geneid"].tolist(), ["G1", "G2", "G3"])
+        self.assertEqual(count_df["Start"].tolist(), ["101;301", "381", "101"])
+        self.assertEqual(count_df["Length"].tolist(), [200, 70, 100])
+        summary_df = pd.read_csv(f"{output}.summary", sep="\t", index_col=0)
+        self.assertEqual(summary_df.loc["Unassigned_Ambiguity"].iloc[0], 1)
+        self.assertEqual(summary_df.loc["Unassigned_MultiMapping"].iloc[0], 1)
+        return assigned_n, count_df.iloc[:, 6].tolist()
+
+    def test_fragments(self):
+        # Mates are counted once, also on different chromosomes, and singletons are not counted
+        self.assertEqual(self.count(True), (5, [4, 0, 1]))
+
+    def test_reads(self):
+        self.assertEqual(self.count(False), (8, [6, 0, 2]))
+
 if __name__ == "__main__":
     unittest.main()
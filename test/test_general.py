@@ -7,7 +7,7 @@ import yaml
 
 # Add parent directory to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
-from lib.general import load_config, check_config, execute_command
+from lib.general import load_config, check_config, execute_command, parse_events, EVENT_TYPES
 
 class TestGeneralModule(unittest.TestCase):
     def test_load_config_success(self):
@@ -65,5 +65,19 @@ class TestGeneralModule(unittest.TestCase):
         self.assertEqual(returncode, 1)
         mock_subprocess.assert_called_once_with(["false"], shell=False)
 
+    def test_parse_events_all(self):
+        self.assertEqual(parse_events(None), EVENT_TYPES)
+        self.assertEqual(parse_events("all"), EVENT_TYPES)
+
+    def test_parse_events_selection(self):
+        self.assertEqual(parse_events("RI,se, MXE"), ["SE", "MXE", "RI"])
+        self.assertEqual(parse_events(["MXE", "SE"]), ["SE", "MXE"])
+
+    def test_parse_events_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_events("SE,XX")
+        with self.assertRaises(ValueError):
+            parse_events("")
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import os
+import sys
+import tempfile
+from unittest import mock
+import pandas as pd
+# Add parent directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+import gtf2event
+
+EVENTS = ["SE", "FIVE", "THREE", "MXE", "RI", "MSE", "AFE", "ALE"]
+
+def gene_lines(gene, offset, middle_start=300):
+    # A skipped exon between the first and last exons
+    lines = []
+    for transcript, exons in [("T1", [(100, 200), (middle_start, 400), (500, 600)]), ("T2", [(100, 200), (500, 600)])]:
+        for start, end in exons:
+            lines.append(f'chr1\tsrc\texon\t{start + offset}\t{end + offset}\t.\t+\t.\tgene_id "{gene}"; transcript_id "{gene}.{transcript}"; gene_name "{gene}";\n')
+    return lines
+
+class TestIncremental(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_gtf2event(self, gene_l, output_dir, incremental):
+        gtf = os.path.join(self.tmp_dir.name, "test.gtf")
+        with open(gtf, "w") as f:
+            for gene, offset, middle_start in gene_l:
+                f.writelines(gene_lines(gene, offset, middle_start))
+        argv = ["gtf2event.py", "-i", gtf, "-o", output_dir] + (["--incremental"] if incremental else [])
+        with mock.patch.object(sys, "argv", argv):
+            gtf2event.main()
+        return {event: pd.read_csv(os.path.join(output_dir, f"EVENT_{event}.txt"), sep="\t", dtype=str) for event in EVENTS}
+
+    def test_incremental(self):
+        output_dir = os.path.join(self.tmp_dir.name, "events")
+        first_df = self.run_gtf2event([("G1", 0, 300), ("G2", 10000, 300), ("G3", 20000, 300)], output_dir, True)["SE"]
+        self.assertEqual(sorted(first_df["event_id"]), ["SE_1", "SE_2", "SE_3"])
+        first_df = first_df.set_index("gene_id")
+        # The skipped exon of G2 changes, replacing its event
+        gene_l = [("G1", 0, 300), ("G2", 10000, 320), ("G3", 20000, 300)]
+        incremental_dic = self.run_gtf2event(gene_l, output_dir, True)
+        full_dic = self.run_gtf2event(gene_l, os.path.join(self.tmp_dir.name, "full"), False)
+        # Events are the same as those of a full run, apart from event IDs
+        for event in EVENTS:
+            pd.testing.assert_frame_equal(incremental_dic[event].drop(columns="event_id"), full_dic[event].drop(columns="event_id"))
+        second_df = incremental_dic["SE"].set_index("gene_id")
+        # Events of unchanged genes keep their IDs
+        self.assertEqual(second_df.loc["G1", "event_id"], first_df.loc["G1", "event_id"])
+        self.assertEqual(second_df.loc["G3", "event_id"], first_df.loc["G3", "event_id"])
+        # The new event is numbered after the last ID, and the ID of the removed event is not reused
+        self.assertNotEqual(second_df.loc["G2", "pos_id"], first_df.loc["G2", "pos_id"])
+        self.assertEqual(second_df.loc["G2", "event_id"], "SE_4")
+
+if __name__ == "__main__":
+    unittest.main()
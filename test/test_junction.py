@@ -0,0 +1,218 @@
+import unittest
+import os
+import sys
+import tempfile
+import pandas as pd
+import pysam
+# Add parent directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib import junction
+
+M, I, D, N, S = 0, 1, 2, 3, 4
+
+class TestReadJunctions(unittest.TestCase):
+    def test_junction_coordinates(self):
+        self.assertEqual(junction.read_junctions(100, [(M, 10), (N, 100), (M, 10)], 8, 70, 500000), [(110, 210, True, True)])
+
+    def test_multiple_junctions(self):
+        cigar = [(M, 10), (N, 100), (M, 20), (N, 200), (M, 10)]
+        self.assertEqual(junction.read_junctions(0, cigar, 8, 70, 500000), [(10, 110, True, True), (130, 330, True, True)])
+
+    def test_read_anchor(self):
+        self.assertEqual(junction.read_junctions(0, [(M, 5), (N, 100), (M, 10)], 8, 70, 500000), [(5, 105, False, True)])
+        self.assertEqual(junction.read_junctions(0, [(M, 10), (N, 100), (M, 5)], 8, 70, 500000), [(10, 110, True, False)])
+        # Soft clips before the anchor do not matter, insertions within the anchor do
+        self.assertEqual(junction.read_junctions(0, [(S, 3), (M, 10), (N, 100), (M, 10)], 8, 70, 500000), [(10, 110, True, True)])
+        self.assertEqual(junction.read_junctions(0, [(M, 10), (I, 2), (M, 3), (N, 100), (M, 10)], 8, 70, 500000), [(13, 113, False, True)])
+        # Operations after a full right anchor do not matter
+        self.assertEqual(junction.read_junctions(0, [(M, 10), (N, 100), (M, 20), (S, 3)], 8, 70, 500000), [(10, 110, True, True)])
+        self.assertEqual(junction.read_junctions(0, [(M, 10), (N, 100), (M, 20), (I, 2), (M, 3)], 8, 70, 500000), [(10, 110, True, True)])
+        # A deletion between two junctions ends the right anchor of the first and the left anchor of the second
+        cigar = [(M, 10), (N, 100), (M, 10), (D, 1), (M, 3), (N, 100), (M, 20)]
+        self.assertEqual(junction.read_junctions(0, cigar, 8, 70, 500000), [(10, 110, True, True), (124, 224, False, True)])
+        # Anchors are the sum of consecutive matches
+        self.assertEqual(junction.read_junctions(0, [(M, 4), (M, 4), (N, 100), (M, 5), (M, 5)], 8, 70, 500000), [(8, 108, True, True)])
+
+    def test_anchor(self):
+        # Each read anchors one side of the junction, which is reported with both reads as in regtools
+        header = pysam.AlignmentHeader.from_dict({"SQ": [{"SN": "chr1", "LN": 10000}]})
+        counter = junction.JunctionCounter("XS", 8, 70, 500000)
+        for start, cigar in [(95, "15M100N5M"), (105, "5M100N15M")]:
+            read = pysam.AlignedSegment(header)
+            read.query_name = cigar
+            read.query_sequence = "A" * 20
+            read.reference_id = 0
+            read.reference_start = start
+            read.cigarstring = cigar
+            read.set_tag("XS", "+")
+            counter.add(read)
+        self.assertEqual(counter.result(), {(110, 210, "+"): 2})
+        # A junction anchored on one side only is not reported
+        counter = junction.JunctionCounter("XS", 8, 70, 500000)
+        counter.add(read)
+        self.assertEqual(counter.result(), {})
+
+    def test_intron_length(self):
+        self.assertEqual(junction.read_junctions(0, [(M, 10), (N, 50), (M, 10)], 8, 70, 500000), [])
+        self.assertEqual(junction.read_junctions(0, [(M, 10), (N, 1000), (M, 10)], 8, 70, 500), [])
+        self.assertEqual(junction.read_junctions(0, [(M, 10), (N, 1000), (M, 10)], 8, 70, 0), [(10, 1010, True, True)])
+
+class TestExtractJunctions(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.bam = os.path.join(self.tmp_dir.name, "test.bam")
+        header = {"HD": {"VN": "1.6", "SO": "coordinate"}, "SQ": [{"SN": "1", "LN": 10000}, {"SN": "chrX", "LN": 10000}]}
+        reads = [
+            # (chromosome, start, cigar, read1, reverse, mate reverse, XS)
+            (0, 100, "10M100N10M", True, False, True, "+"),
+            (0, 100, "10M100N10M", False, True, False, "+"),
+            (0, 100, "10M100N10M", True, True, False, "-"),
+            (0, 100, "10M100N10M", True, False, False, "+"),
+            # Counted with the other reads of the junction, which anchor its left side
+            (0, 105, "5M100N10M", True, False, True, "+"),
+            (1, 500, "20M300N20M", True, False, True, None),
+        ]
+        with pysam.AlignmentFile(self.bam, "wb", header=header) as bam:
+            for i, (tid, start, cigar, read1, reverse, mate_reverse, xs) in enumerate(reads):
+                read = pysam.AlignedSegment()
+                read.query_name = f"read{i}"
+                read.query_sequence = "A" * 40 if cigar.startswith("20M") else "A" * 20 if cigar.startswith("10M") else "A" * 15
+                read.flag = 0x1 | (0x40 if read1 else 0x80) | (0x10 if reverse else 0) | (0x20 if mate_reverse else 0)
+                read.reference_id = tid
+                read.reference_start = start
+                read.cigarstring = cigar
+                read.next_reference_id = tid
+                read.next_reference_start = start
+                read.mapping_quality = 60
+                if xs:
+                    read.set_tag("XS", xs)
+                bam.write(read)
+        pysam.index(self.bam)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def extract(self, strand):
+        output = os.path.join(self.tmp_dir.name, f"{strand}.txt")
+        junction_n = junction.extract_junctions(self.bam, output, strand, 8, 70, 500000, processors=2)
+        junction_df = pd.read_csv(output, sep="\t")
+        self.assertEqual(junction_n, len(junction_df))
+        return dict(zip(zip(junction_df["ID"], junction_df["strand"]), junction_df["count"]))
+
+    def test_xs(self):
+        self.assertEqual(self.extract("XS"), {("chr1:110-211", "+"): 4, ("chr1:110-211", "-"): 1, ("chrX:520-821", "?"): 1})
+
+    def test_rf(self):
+        self.assertEqual(self.extract("RF"), {("chr1:110-211", "-"): 3, ("chr1:110-211", "+"): 1, ("chr1:110-211", "?"): 1, ("chrX:520-821", "-"): 1})
+
+    def test_fr(self):
+        self.assertEqual(self.extract("FR"), {("chr1:110-211", "+"): 3, ("chr1:110-211", "-"): 1, ("chr1:110-211", "?"): 1, ("chrX:520-821", "+"): 1})
+
+class TestCountBoundaries(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.bam = os.path.join(self.tmp_dir.name, "test.bam")
+        header = {"HD": {"VN": "1.6", "SO": "coordinate"}, "SQ": [{"SN": "chr1", "LN": 10000}, {"SN": "chr2", "LN": 10000}]}
+        reads = [
+            # (name, start, cigar, mate, NH)
+            ("single", 100, "20M", None, 1),
+            ("short", 100, "10M", None, 1),
+            ("multi", 100, "20M", None, 2),
+            ("union", 95, "15M", 1, 1),
+            ("union", 110, "10M", 2, 1),
+            ("both1", 100, "20M", 1, 1),
+            ("both1", 105, "20M", 2, 1),
+            ("both2", 100, "20M", 1, 1),
+            ("both2", 105, "20M", 2, 1),
+            ("spliced", 90, "10M100N20M", None, 1),
+        ]
+        reads.sort(key=lambda x: x[1])
+        with pysam.AlignmentFile(self.bam, "wb", header=header) as bam:
+            for name, start, cigar, mate, nh in reads:
+                read = pysam.AlignedSegment()
+                read.query_name = name
+                read.query_sequence = "A" * sum(int(x) for x in cigar.replace("N", "M").split("M")[:-1] if x) if "N" not in cigar else "A" * 30
+                read.flag = 0 if mate is None else 0x1 | (0x40 if mate == 1 else 0x80)
+                read.reference_id = 0
+                read.reference_start = start
+                read.cigarstring = cigar
+                read.next_reference_id = 0 if mate else -1
+                read.mapping_quality = 60
+                read.set_tag("NH", nh)
+                bam.write(read)
+        pysam.index(self.bam)
+        self.boundary_df = pd.DataFrame(
+            [["chr1:110-111", "chr1", 110, 111, "+"], ["chr1:201-202", "chr1", 201, 202, "+"], ["chr2:10-11", "chr2", 10, 11, "-"]],
+            columns=["GeneID", "Chr", "Start", "End", "Strand"]
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def count(self, paired):
+        output = os.path.join(self.tmp_dir.name, "count.txt")
+        assigned_n = junction.count_boundaries(self.bam, self.boundary_df, output, paired=paired, processors=2)
+        count_df = pd.read_csv(output, sep="\t", comment="#")
+        self.assertEqual(count_df.columns.tolist()[:6], ["Geneid", "Chr", "Start", "End", "Strand", "Length"])
+        return assigned_n, count_df.iloc[:, 6].tolist()
+
+    def test_fragments(self):
+        # Mates are combined and each fragment is counted once
+        self.assertEqual(self.count(True), (5, [4, 1, 0]))
+
+    def test_reads(self):
+        self.assertEqual(self.count(False), (6, [5, 1, 0]))
+
+    def test_aligned_intervals(self):
+        self.assertEqual(junction.aligned_intervals([(S, 2), (M, 10), (2, 3), (M, 5), (N, 100), (M, 5)], 100), [(100, 118), (218, 223)])
+
+class TestMergeJunctions(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, lines):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w") as f:
+            f.write("".join(line + "\n" for line in lines))
+        return path
+
+    def test_merge(self):
+        regtools = "{}\t{}\t{}\tJUNC\t{}\t{}\t0\t0\t0\t2\t{},{}\t0,0"
+        sample_junc_dic = {
+            "B": [
+                (self.write("B_exon-exon.junc", [
+                    regtools.format("1", 90, 230, 5, "+", 20, 20),
+                    regtools.format("1", 90, 230, 5, "-", 20, 20),
+                    regtools.format("chrX", 10, 500, 1, "+", 10, 10),
+                ]), "exon-exon"),
+                (self.write("B_exon-intron.junc", [
+                    "# featureCounts",
+                    "Geneid\tChr\tStart\tEnd\tStrand\tLength\tB.bam",
+                    "1:110-111\t1\t110\t111\t+\t2\t3",
+                ]), "exon-intron"),
+            ],
+            "A": [(self.write("A_exon-exon.txt", [
+                "chr\tstart\tend\tID\tstrand\tcount",
+                "chr1\t110\t211\tchr1:110-211\t+\t7",
+                "chr1\t2000\t2101\tchr1:2000-2101\t+\t2",
+            ]), "exon-exon-native")],
+            "C": [(self.write("C_exon-exon.junc", []), "exon-exon")],
+        }
+        output = os.path.join(self.tmp_dir.name, "junctions.bed")
+        junction_n = junction.merge_junctions(sample_junc_dic, output, self.tmp_dir.name, max_open_files=2)
+        with open(output) as f:
+            rows = [line.rstrip("\n").split("\t") for line in f]
+        self.assertEqual(junction_n, 4)
+        self.assertEqual(rows, [
+            ["chr", "start", "end", "ID", "A", "B", "C"],
+            ["chr1", "110", "111", "1:110-111", "0", "3", "0"],
+            ["chr1", "110", "211", "chr1:110-211", "7", "10", "0"],
+            ["chr1", "2000", "2101", "chr1:2000-2101", "2", "0", "0"],
+            ["chrX", "20", "491", "chrX:20-491", "0", "1", "0"],
+        ])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import gzip
+import os
+import sys
+import tempfile
+import numpy as np
+from scipy import io, sparse
+# Add parent directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+import sc2junc
+
+class TestReadMtxFiltered(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        self.matrix = sparse.random(20, 12, density=0.3, format="coo", random_state=rng, data_rvs=lambda n: rng.integers(1, 100, n))
+        self.keep_cols = np.array([7, 0, 3, 11])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, matrix, field, trailing_newline=True):
+        path = os.path.join(self.tmp_dir.name, name)
+        io.mmwrite(path, matrix, field=field)
+        if not trailing_newline:
+            with open(path, "rb") as f:
+                content = f.read()
+            with open(path, "wb") as f:
+                f.write(content.rstrip(b"\n"))
+        if name.endswith(".gz"):
+            # mmwrite adds .mtx to names without it
+            with open(path + ".mtx", "rb") as f, gzip.open(path, "wb") as g:
+                g.write(f.read())
+        return path
+
+    def assert_same(self, path, reference_path):
+        expected = io.mmread(reference_path).tocsc()[:, self.keep_cols].toarray()
+        # A tiny block size splits lines across blocks
+        for block_size in [7, 1 << 22]:
+            result = sc2junc.read_mtx_filtered(path, self.keep_cols, block_size=block_size)
+            self.assertEqual(result.shape, expected.shape)
+            np.testing.assert_array_equal(result.toarray(), expected)
+
+    def test_integer(self):
+        path = self.write("matrix.mtx", self.matrix, "integer")
+        self.assert_same(path, path)
+        gz_path = self.write("matrix.gz", self.matrix, "integer")
+        self.assert_same(gz_path, gz_path + ".mtx")
+
+    def test_no_trailing_newline(self):
+        path = self.write("matrix.mtx", self.matrix, "integer", trailing_newline=False)
+        self.assert_same(path, path)
+
+    def test_real(self):
+        path = self.write("matrix.mtx", self.matrix.astype(np.float64) / 8, "real")
+        self.assert_same(path, path)
+
+    def test_pattern(self):
+        path = self.write("matrix.mtx", self.matrix, "pattern")
+        self.assert_same(path, path)
+        gz_path = self.write("matrix.gz", self.matrix, "pattern")
+        self.assert_same(gz_path, gz_path + ".mtx")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import os
+import sys
+import tempfile
+import pandas as pd
+# Add parent directory to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from lib import shibalib
+
+class TestContrasts(unittest.TestCase):
+    def setUp(self):
+        self.group_list = ["A", "B", "C"]
+
+    def test_all_pairs(self):
+        self.assertEqual(shibalib.parse_contrasts("all-pairs", self.group_list), [("A", "B"), ("A", "C"), ("B", "C")])
+
+    def test_one_vs_rest(self):
+        self.assertEqual(shibalib.parse_contrasts("one-vs-rest", self.group_list), [("rest", "A"), ("rest", "B"), ("rest", "C")])
+        with self.assertRaises(ValueError):
+            shibalib.parse_contrasts("one-vs-rest", ["A", "rest"])
+
+    def test_contrast_file(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".tsv", delete=False) as f:
+            f.write("# reference\talternative\nC\tA\n\nB\tA\nC\tA\n")
+        try:
+            self.assertEqual(shibalib.parse_contrasts(f.name, self.group_list), [("C", "A"), ("B", "A")])
+            with open(f.name, "w") as g:
+                g.write("A\tD\n")
+            with self.assertRaises(ValueError):
+                shibalib.parse_contrasts(f.name, self.group_list)
+        finally:
+            os.remove(f.name)
+        with self.assertRaises(ValueError):
+            shibalib.parse_contrasts("some-vs-some", self.group_list)
+
+class TestDiffContrast(unittest.TestCase):
+    def test_one_vs_rest(self):
+        event_df = pd.DataFrame({
+            "event_id": ["FIVE_1"], "pos_id": ["p"], "exon_a": ["chr1:50-100"], "exon_b": ["chr1:50-120"],
+            "intron_a": ["chr1:100-200"], "intron_b": ["chr1:120-200"], "strand": ["+"], "gene_id": ["G1"], "gene_name": ["Gene1"], "label": ["annotated"]
+        })
+        junc_count_df = pd.DataFrame({"ID": ["chr1:100-200", "chr1:120-200"], "A": [90, 10], "B": [5, 45], "C": [5, 45]})
+        junc_dict_group = shibalib.junc_dict(junc_count_df)
+        psi_table_df = shibalib.make_psi_table_group(["A", "B", "C"], event_df, junc_dict_group, shibalib.five_three, shibalib.col_five_three_afe_ale, 1, 10)
+        event_data_dict = {"FIVE": (event_df, psi_table_df, shibalib.five_three, shibalib.col_five_three_afe_ale, shibalib.diff_five_three, shibalib.five_three_ind)}
+        result = shibalib.diff_contrast(("rest", "A"), event_data_dict, junc_count_df, 10, 0.05, 0.1)["FIVE"]
+        # Groups other than A are pooled
+        self.assertEqual(result["ref_junction_a"].tolist(), [10])
+        self.assertEqual(result["ref_junction_b"].tolist(), [90])
+        self.assertAlmostEqual(result["dPSI"].iloc[0], 0.8)
+        result = shibalib.diff_contrast(("B", "C"), event_data_dict, None, 10, 0.05, 0.1)["FIVE"]
+        self.assertAlmostEqual(result["dPSI"].iloc[0], 0)
+
+if __name__ == "__main__":
+    unittest.main()